@@ -0,0 +1,71 @@
+import os
+import re
+import sys
+import time
+import argparse
+import subprocess
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+import_pattern = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+default_commands = ["purge", "integrate", "generate_events", "fit", "morph", "analyze", "gen_libs", "install"]
+
+
+def dispatch_code(name):
+    # the CLI parses its arguments and then resolves the subcommand through vbf_hh_heft.command, argparse options
+    # like --help exit before that, so the dispatch is timed directly
+    script = os.path.join(root, "vbf_hh_heft.py")
+    return (
+        f"import sys; sys.path.insert(0, {root!r}); sys.argv = [{script!r}, '--version']\n"
+        f"try:\n    exec(open({script!r}).read(), {{'__name__': '__main__'}})\nexcept SystemExit:\n    pass\n"
+        f"import vbf_hh_heft; vbf_hh_heft.command({name!r})"
+    )
+
+
+def time_command(name, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", dispatch_code(name)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def time_interpreter():
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"])
+    return time.perf_counter() - start
+
+
+def top_level_imports(name, limit):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", dispatch_code(name)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        match = import_pattern.match(line)
+        if match and len(match.group(3)) == 1:
+            imports.append((int(match.group(2)), match.group(4)))
+    return sorted(imports, reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the start-up of the command line interface")
+    parser.add_argument("commands", nargs="*", default=default_commands, help="Subcommand functions to dispatch")
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    parser.add_argument("-i", "--imports", type=int, default=0, help="Also list the N most expensive top-level imports")
+    args = parser.parse_args()
+    interpreter = min(time_interpreter() for _ in range(args.repeat))
+    print(f"{'command':<24} {'best [ms]':>12} {'over interpreter [ms]':>22}")
+    for command in args.commands:
+        best = time_command(command, args.repeat)
+        print(f"{command:<24} {best * 1e3:>12.1f} {(best - interpreter) * 1e3:>22.1f}")
+        for cumulative, module in top_level_imports(command, args.imports):
+            print(f"    {module:<40} {cumulative / 1e3:>8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+import os
+import re
+import sys
+import time
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vbf_hh_heft.downloads import download_archives, read_checksums, file_digest
+
+
+class ArchiveHandler(BaseHTTPRequestHandler):
+    """Serves files from the server directory with per-connection bandwidth limits, Range support and dropped
+    connections after 'drop_after' bytes for the first request of every file."""
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = os.path.join(self.server.directory, os.path.basename(self.path))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        start = 0
+        match = re.fullmatch(r"bytes=(\d+)-", self.headers.get("Range", ""))
+        if match:
+            start = int(match.group(1))
+            if start >= size:
+                self.send_error(416)
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{size - 1}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(size - start))
+        self.end_headers()
+        with self.server.lock:
+            drop = self.server.drop_after is not None and path not in self.server.dropped
+            self.server.dropped.add(path)
+        time.sleep(self.server.latency)
+        with open(path, "rb") as file:
+            file.seek(start)
+            sent = 0
+            while data := file.read(16384):
+                if drop and sent + len(data) > self.server.drop_after:
+                    self.wfile.write(data[: self.server.drop_after - sent])
+                    self.wfile.flush()
+                    self.close_connection = True
+                    return
+                self.wfile.write(data)
+                sent += len(data)
+                time.sleep(len(data) / self.server.bandwidth)
+
+
+def serve(directory, bandwidth, latency, drop_after=None):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ArchiveHandler)
+    server.directory = directory
+    server.bandwidth = bandwidth
+    server.latency = latency
+    server.drop_after = drop_after
+    server.dropped = set()
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the download manager against a local throttled HTTP server")
+    parser.add_argument("-n", "--archives", type=int, default=11)
+    parser.add_argument("-s", "--size", type=int, default=4, help="Archive size in MiB")
+    parser.add_argument("-b", "--bandwidth", type=float, default=20, help="Bandwidth per connection in MiB/s")
+    parser.add_argument("--latency", type=float, default=0.3, help="Delay before each response in seconds")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        upstream = os.path.join(tmpdir, "upstream")
+        os.makedirs(upstream)
+        names = [f"package-{i}.tar.gz" for i in range(args.archives)]
+        for name in names:
+            with open(os.path.join(upstream, name), "wb") as file:
+                file.write(os.urandom(args.size << 20))
+        pins = {name: file_digest(os.path.join(upstream, name)) for name in names}
+        server = serve(upstream, args.bandwidth * (1 << 20), args.latency)
+        urls = [f"http://127.0.0.1:{server.server_port}/{name}" for name in names]
+        timings = {}
+        for jobs in [1, 8]:
+            start = time.perf_counter()
+            download_archives(urls, os.path.join(tmpdir, f"jobs_{jobs}"), pins, jobs=jobs)
+            timings[f"{jobs} connections"] = time.perf_counter() - start
+        # once digests are pinned, archives without one are refused unless the first download is trusted explicitly,
+        # the digest recorded then protects later runs without the flag
+        unpinned = {name: digest for name, digest in pins.items() if name != names[0]}
+        try:
+            download_archives(urls[:1], os.path.join(tmpdir, "unpinned"), unpinned)
+            raise AssertionError("an unpinned archive was downloaded")
+        except SystemExit:
+            pass
+        download_archives(urls[:1], os.path.join(tmpdir, "unpinned"), unpinned, allow_unpinned=True)
+        download_archives(urls[:1], os.path.join(tmpdir, "unpinned"), unpinned)
+        server.shutdown()
+
+        # every first connection is dropped halfway, the retries have to resume instead of starting over
+        server = serve(upstream, args.bandwidth * (1 << 20), 0.0, drop_after=(args.size << 20) // 2)
+        start = time.perf_counter()
+        download_archives(
+            [f"http://127.0.0.1:{server.server_port}/{name}" for name in names], os.path.join(tmpdir, "resumed"), pins
+        )
+        timings["resumed after drops"] = time.perf_counter() - start
+        server.shutdown()
+        checksums = read_checksums(os.path.join(tmpdir, "resumed", "SHA256SUMS"))
+        for name in names:
+            assert checksums[name] == file_digest(os.path.join(upstream, name)), f"{name} differs"
+
+        # the first directory acts as a mirror, its SHA256SUMS provides the digests
+        start = time.perf_counter()
+        download_archives(urls, os.path.join(tmpdir, "mirrored"), mirror=os.path.join(tmpdir, "jobs_8"))
+        timings["local mirror"] = time.perf_counter() - start
+    print(f"{'download':<24} {'total [s]':>10}")
+    for mode, total in timings.items():
+        print(f"{mode:<24} {total:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import importlib.util
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vbf_hh_heft import ufo
+from vbf_hh_heft.param_card import write_param_cards, card_name
+
+
+def write_reference(points, directory):
+    model = ufo.import_ufo(ufo.get_model_path(), "benchmark_ufo")
+    spec = importlib.util.spec_from_file_location(
+        "benchmark_ufo_writer", os.path.join(ufo.get_model_path(), "write_param_card.py")
+    )
+    writer = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(writer)
+    external = [parameter for parameter in model.all_parameters if parameter.nature == "external"]
+    by_name = {parameter.name: parameter for parameter in external}
+    for i in range(len(next(iter(points.values())))):
+        for name, values in points.items():
+            by_name[name].value = float(values[i])
+        card = writer.ParamCardWriter(os.path.join(directory, card_name(i)), external)
+        card.fsock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the batch param_card writer against the UFO ParamCardWriter")
+    parser.add_argument("-n", "--points", type=int, default=5000)
+    parser.add_argument("-j", "--jobs", type=int, nargs="+", default=[1, 4])
+    args = parser.parse_args()
+    couplings = np.random.default_rng(1).uniform(-5, 5, (3, args.points))
+    points = {"clambda": couplings[0], "cV": couplings[1], "c2V": couplings[2]}
+    ufo.load_model()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        reference = os.path.join(tmpdir, "reference")
+        os.makedirs(reference)
+        start = time.perf_counter()
+        write_reference(points, reference)
+        timings = {"ParamCardWriter": time.perf_counter() - start}
+        for jobs in args.jobs:
+            output = os.path.join(tmpdir, f"batch_{jobs}")
+            start = time.perf_counter()
+            write_param_cards(points, output, jobs=jobs)
+            timings[f"batch, {jobs} workers"] = time.perf_counter() - start
+            for i in range(args.points):
+                with open(os.path.join(reference, card_name(i))) as a, open(os.path.join(output, card_name(i))) as b:
+                    assert a.read() == b.read(), f"card {i} differs"
+        start = time.perf_counter()
+        write_param_cards(points, os.path.join(tmpdir, "cards.tar"), jobs=max(args.jobs))
+        timings[f"archive, {max(args.jobs)} workers"] = time.perf_counter() - start
+    print(f"{'writer':<24} {'total [s]':>10} {'per card [us]':>14}")
+    for writer, total in timings.items():
+        print(f"{writer:<24} {total:>10.3f} {total / args.points * 1e6:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vbf_hh_heft.sindarin import scan
+
+
+def generate_sindarin(n_processes):
+    lines = [
+        'model = SM_HEFT_LO (ufo ("Model"))',
+        "cuts =",
+        "     let subevt @clustered_jets = cluster [nlojet] in",
+        "     count [@clustered_jets] >= 2",
+        "     and all M > 600 GeV [@clustered_jets]",
+        "iterations = 5:100000",
+        "n_events = 1000",
+    ]
+    for i in range(n_processes):
+        lines += [
+            f"# process COMMENTED_{i} = pr, pr => H, H, j, j",
+            f"process P{i}_BORN = pr, pr => H, H, j, j",
+            f"process P{i}_REAL = pr, pr =>",
+            "    H, H, j, j {",
+            "    nlo_calculation = real",
+            "}",
+            f"integrate (P{i}_BORN) {{ iterations = 5:100000:\"gw\", 15:100000 }}",
+            f"integrate (P{i}_REAL) {{",
+            "    iterations = 5:100000:\"gw\",",
+            "                 15:100000",
+            "}",
+            f'simulate (P{i}_BORN) {{ $sample = "P{i}_BORN" n_events = 500 checkpoint = n_events/100 }}',
+            f"simulate (P{i}_REAL)",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the Sindarin scanner on generated templates")
+    parser.add_argument("-n", "--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    args = parser.parse_args()
+    print(f"{'processes':>10} {'bytes':>12} {'best [ms]':>12} {'per process [us]':>18}")
+    for size in args.sizes:
+        sindarin = generate_sindarin(size)
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = scan(sindarin)
+            timings.append(time.perf_counter() - start)
+        assert len(result.processes) == size
+        best = min(timings)
+        print(f"{size:>10} {len(sindarin):>12} {best * 1e3:>12.2f} {best / size * 1e6:>18.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vbf_hh_heft import ufo
+
+
+def best_of(function, repeat):
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function(i)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time loading a UFO model from source and from the compiled cache")
+    parser.add_argument("-m", "--model", default="SM_HEFT_LO")
+    parser.add_argument("-r", "--repeat", type=int, default=20)
+    parser.add_argument("-n", "--points", type=int, default=1000000, help="Coupling points for the vectorized evaluator")
+    args = parser.parse_args()
+    path = ufo.get_model_path(args.model)
+    ufo.load_model(args.model)
+
+    def cached(_):
+        ufo.model_cache.clear()
+        ufo.load_model(args.model)
+
+    timings = {
+        "import UFO package": best_of(lambda i: ufo.import_ufo(path, f"benchmark_{i}"), args.repeat),
+        "compile model": best_of(lambda _: ufo.compile_model(path), args.repeat),
+        "load compiled model": best_of(cached, args.repeat),
+        "evaluate parameters": best_of(lambda _: ufo.evaluate_model(ufo.load_model(args.model)), args.repeat),
+    }
+    evaluator = ufo.compile_evaluator(ufo.load_model(args.model))
+    couplings = np.random.default_rng(1).uniform(-5, 5, (3, args.points))
+    timings[f"evaluate {args.points} points"] = best_of(
+        lambda _: evaluator(clambda=couplings[0], cV=couplings[1], c2V=couplings[2]), max(1, args.repeat // 10)
+    )
+    print(f"{'step':<28} {'best [ms]':>12}")
+    for step, best in timings.items():
+        print(f"{step:<28} {best * 1e3:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
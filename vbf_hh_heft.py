@@ -6,7 +6,7 @@ import os
 
 from rich.logging import RichHandler
 import argparse
-from vbf_hh_heft import install, print_dep_check, gen_libs, integrate, purge, fit, generate_events
+from vbf_hh_heft import command
 
 try:
     from rich_argparse import RichHelpFormatter
@@ -44,8 +44,21 @@ if __name__ == "__main__":
         help="Absolute location to install to [default: $PWD/local]",
     )
     install_parser.add_argument("--mpi", action="store_true", help="Compile Whizard with MPI support")
+    install_parser.add_argument(
+        "--mirror",
+        help="Directory or URL with the source archives and a SHA256SUMS file to use instead of the upstream servers",
+    )
+    install_parser.add_argument(
+        "--allow-unpinned",
+        action="store_true",
+        help="Trust the first download of archives without a pinned or recorded SHA256 digest",
+    )
+    install_parser.add_argument(
+        "--toolchain-cache",
+        help="Directory with prebuilt toolchains, a matching one is unpacked instead of building from source and new builds are added to it",
+    )
     install_parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="Number of jobs to use")
-    install_parser.set_defaults(func=install)
+    install_parser.set_defaults(func="install")
 
     check_parser = subparsers.add_parser(
         "check_deps",
@@ -53,7 +66,7 @@ if __name__ == "__main__":
         formatter_class=help_formatter,
     )
     check_parser.add_argument("--mpi", action="store_true", help="Check MPI compilers and library")
-    check_parser.set_defaults(func=print_dep_check)
+    check_parser.set_defaults(func="print_dep_check")
 
     gen_libs_parser = subparsers.add_parser(
         "gen_libs",
@@ -63,7 +76,20 @@ if __name__ == "__main__":
     gen_libs_parser.add_argument(
         "templates", help="Name of the templates in the 'Templates' folder to generate the libraries for", nargs="+"
     )
-    gen_libs_parser.set_defaults(func=gen_libs)
+    gen_libs_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes to compile concurrently on the local machine with --seed-processes [default: 1]",
+    )
+    gen_libs_parser.add_argument(
+        "--seed-processes",
+        action="store_true",
+        help="Compile every process separately and in parallel, then seed the library build with the cached processes "
+        "(experimental, relies on Whizard reusing the separately compiled processes)",
+    )
+    gen_libs_parser.set_defaults(func="gen_libs")
 
     integrate_parser = subparsers.add_parser(
         "integrate",
@@ -92,7 +118,14 @@ if __name__ == "__main__":
         action="store_true",
         help="Run in cluster mode, i.e. submit the integration for each parameter point to a compute cluster instead of running locally",
     )
-    integrate_parser.set_defaults(func=integrate)
+    integrate_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of parameter points to process concurrently on the local machine [default: 1]",
+    )
+    integrate_parser.set_defaults(func="integrate")
 
     fit_parser = subparsers.add_parser(
         "fit",
@@ -118,7 +151,14 @@ if __name__ == "__main__":
         action="store_true",
         help="Run in cluster mode, i.e. submit the integration for each parameter point to a compute cluster instead of running locally",
     )
-    fit_parser.set_defaults(func=fit)
+    fit_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of parameter points to process concurrently on the local machine [default: 1]",
+    )
+    fit_parser.set_defaults(func="fit")
 
     event_parser = subparsers.add_parser(
         "generate", help="Generate and analyze events for the given template", formatter_class=help_formatter
@@ -135,13 +175,70 @@ if __name__ == "__main__":
     )
     event_parser.add_argument("--id", type=int, help="Only run the event generation for the 'id'-th parameter point")
     event_parser.add_argument("--mpi", action="store_true", help="Run the event generation with MPI")
+    event_parser.add_argument(
+        "--cache-columns",
+        action="store_true",
+        help="Also store the per-event weights and Higgs and jet four-momenta of each seed as memory-mappable NumPy arrays",
+    )
     event_parser.add_argument(
         "--cluster",
         action="store_true",
         help="Run in cluster mode, i.e. submit the event generation for each parameter point to a compute cluster instead of running locally",
     )
+    event_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of parameter points to process concurrently on the local machine [default: 1]",
+    )
+
+    event_parser.set_defaults(func="generate_events")
 
-    event_parser.set_defaults(func=generate_events)
+    morph_parser = subparsers.add_parser(
+        "morph",
+        help="Compute histograms for arbitrary coupling values as linear combinations of the histograms of a minimal set of basis points",
+        formatter_class=help_formatter,
+    )
+    morph_parser.add_argument("template", help="Name of the template in the 'Templates' folder to use")
+    morph_parser.add_argument(
+        "-c", "--config", help="TOML file containing the fit function, the basis and the parameter points to morph to"
+    )
+    morph_parser.add_argument(
+        "-P",
+        action="append",
+        dest="cmd_parameters",
+        default=[],
+        metavar="parameter",
+        help="Set a parameter to a specific value (Example: -Pc_V=1.1) (Can be used multiple times, overrides config file)",
+    )
+    morph_parser.add_argument("--mpi", action="store_true", help="Run the event generation for the basis with MPI")
+    morph_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of basis points to generate concurrently on the local machine [default: 1]",
+    )
+    morph_parser.set_defaults(func="morph")
+
+    analyze_parser = subparsers.add_parser(
+        "analyze",
+        help="Fill the MC_VBF_HH histograms from HepMC3 ASCII files with the NumPy analysis engine",
+        formatter_class=help_formatter,
+    )
+    analyze_parser.add_argument("hepmc", nargs="+", help="HepMC3 ASCII files of the same process to analyse")
+    analyze_parser.add_argument(
+        "-o", "--output", default="MC_VBF_HH.yoda", help="YODA file to write the merged histograms to [default: MC_VBF_HH.yoda]"
+    )
+    analyze_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of files to analyse concurrently on the local machine [default: 1]",
+    )
+    analyze_parser.set_defaults(func="analyze")
 
     purge_parser = subparsers.add_parser(
         "purge",
@@ -150,8 +247,8 @@ if __name__ == "__main__":
     )
     purge_parser.add_argument("template", help="Name of the template in the 'Templates' folder to purge the grids for")
     purge_parser.add_argument("-l", "--library", help="Also purge the process library", action="store_true")
-    purge_parser.set_defaults(func=purge)
+    purge_parser.set_defaults(func="purge")
 
     root_args = root_parser.parse_args()
     logging.getLogger().setLevel(root_args.loglevel)
-    root_args.func(root_args)
+    command(root_args.func)(root_args)
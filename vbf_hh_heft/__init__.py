@@ -1,7 +1,18 @@
-from .install import install
-from .check_dependencies import print_dep_check
-from .generate_libraries import gen_libs
-from .integrate import integrate
-from .purge import purge
-from .fit import fit
-from .events import generate_events
+import importlib
+
+# command name -> submodule defining it, the submodules are only imported when their command runs
+commands = {
+    "install": "install",
+    "print_dep_check": "check_dependencies",
+    "gen_libs": "generate_libraries",
+    "integrate": "integrate",
+    "purge": "purge",
+    "fit": "fit",
+    "generate_events": "events",
+    "morph": "morphing",
+    "analyze": "analysis",
+}
+
+
+def command(name):
+    return getattr(importlib.import_module(f".{commands[name]}", __name__), name)
@@ -0,0 +1,294 @@
+import os
+import sys
+from logging import info, critical
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from vbf_hh_heft import hepmc, yoda_io
+
+analysis_name = "MC_VBF_HH"
+jet_radius = 0.4
+jet_pt_min = 20.0
+default_sqrts = 14000.0
+
+
+def cluster_antikt(momenta, mask, radius=jet_radius):
+    momenta = momenta.copy()
+    active = mask.copy()
+    jets = np.zeros_like(momenta)
+    jet_mask = np.zeros_like(mask)
+    n_events, width = mask.shape
+    rows = np.arange(n_events)
+    pair = ~np.eye(width, dtype=bool)
+    for _ in range(width):
+        if not active.any():
+            break
+        pt2 = np.maximum(momenta[..., 0] ** 2 + momenta[..., 1] ** 2, 1e-300)
+        y = np.nan_to_num(hepmc.rapidity(momenta), nan=0.0, posinf=1e5, neginf=-1e5)
+        phi = np.arctan2(momenta[..., 1], momenta[..., 0])
+        inverse_pt2 = np.where(active, 1 / pt2, np.inf)
+        dphi = np.abs(phi[:, :, None] - phi[:, None, :])
+        dphi = np.minimum(dphi, 2 * np.pi - dphi)
+        dr2 = (y[:, :, None] - y[:, None, :]) ** 2 + dphi**2
+        with np.errstate(invalid="ignore"):
+            dij = np.minimum(inverse_pt2[:, :, None], inverse_pt2[:, None, :]) * dr2 / radius**2
+        dij = np.where(active[:, :, None] & active[:, None, :] & pair, dij, np.inf)
+        best_pair = np.argmin(dij.reshape(n_events, -1), axis=1)
+        best_dij = dij.reshape(n_events, -1)[rows, best_pair]
+        best_beam = np.argmin(inverse_pt2, axis=1)
+        best_dib = inverse_pt2[rows, best_beam]
+        alive = np.isfinite(best_dib)
+
+        merge = alive & (best_dij < best_dib)
+        i, j = np.divmod(best_pair[merge], width)
+        merged_rows = rows[merge]
+        momenta[merged_rows, i] += momenta[merged_rows, j]
+        active[merged_rows, j] = False
+
+        final = alive & ~merge
+        final_rows = rows[final]
+        jets[final_rows, best_beam[final]] = momenta[final_rows, best_beam[final]]
+        jet_mask[final_rows, best_beam[final]] = True
+        active[final_rows, best_beam[final]] = False
+    return jets, jet_mask
+
+
+def sort_by_pt(momenta, mask, pt_min=0.0):
+    pt = hepmc.transverse_momentum(momenta)
+    mask = mask & (pt > pt_min)
+    order = np.argsort(np.where(mask, -pt, np.inf), axis=1, kind="stable")
+    return np.take_along_axis(momenta, order[..., None], axis=1), np.take_along_axis(mask, order, axis=1)
+
+
+def delta_phi(a, b):
+    dphi = np.abs(hepmc.azimuth(a) - hepmc.azimuth(b))
+    return np.minimum(dphi, 2 * np.pi - dphi)
+
+
+def delta_r(a, b):
+    return np.hypot(hepmc.pseudorapidity(a) - hepmc.pseudorapidity(b), delta_phi(a, b))
+
+
+def linear_edges(n_bins, low, high):
+    return np.linspace(low, high, n_bins + 1)
+
+
+def log_edges(n_bins, low, high):
+    return np.geomspace(low, high, n_bins + 1)
+
+
+def book(sqrts):
+    pt_max = sqrts / 4.0
+    edges = {
+        "jet_pT_1": log_edges(50, 20.0, pt_max),
+        "jet_pT_2": log_edges(50, 20.0, pt_max),
+        "jet_pT_3": log_edges(50, 20.0, pt_max),
+        "jet_eta_1": linear_edges(25, -5.0, 5.0),
+        "jet_eta_2": linear_edges(25, -5.0, 5.0),
+        "jet_eta_3": linear_edges(25, -5.0, 5.0),
+        "jet_y_1": linear_edges(25, -5.0, 5.0),
+        "jet_y_2": linear_edges(25, -5.0, 5.0),
+        "jet_y_3": linear_edges(25, -5.0, 5.0),
+        "jet_HT": log_edges(50, 30, sqrts / 2.0),
+        "HH_mass": linear_edges(100, 200, 4000.0),
+        "HH_dR": linear_edges(25, 0.5, 10.0),
+        "HH_dPhi": linear_edges(32, 0, 3.2),
+        "HH_deta": linear_edges(25, -5, 5),
+        "H_pT": linear_edges(30, 0, 2000.0),
+        "HH_pT": linear_edges(30, 0, 2000.0),
+        "H_pT1": linear_edges(30, 0, 2000.0),
+        "H_pT2": linear_edges(30, 0, 2000.0),
+        "H_eta": linear_edges(25, -5.0, 5.0),
+        "H_eta1": linear_edges(25, -5.0, 5.0),
+        "H_eta2": linear_edges(25, -5.0, 5.0),
+        "H_phi": linear_edges(25, 0.0, 2 * np.pi),
+    }
+    for pair in ("12", "13", "23"):
+        edges[f"jets_absdeta_{pair}"] = linear_edges(10, 3.5, 7.5)
+        edges[f"jets_dphi_{pair}"] = linear_edges(25, 0.0, np.pi)
+        edges[f"jets_dR_{pair}"] = linear_edges(25, 4.0, 8.0)
+        edges[f"jets_mjj{pair}"] = linear_edges(40, 0.0, sqrts / 2.0)
+    for jet in ("1", "2", "3"):
+        edges[f"H_jet{jet}_deta"] = linear_edges(25, 0, 5.0)
+        edges[f"H_jet{jet}_dR"] = linear_edges(25, 0.5, 7.0)
+    return {name: Histogram(bin_edges) for name, bin_edges in edges.items()}
+
+
+class Histogram:
+    def __init__(self, edges):
+        self.edges = edges
+        self.sumw = np.zeros(len(edges) + 1)
+        self.sumw2 = np.zeros(len(edges) + 1)
+        self.sumwx = np.zeros(len(edges) + 1)
+        self.sumwx2 = np.zeros(len(edges) + 1)
+        self.entries = np.zeros(len(edges) + 1)
+
+    def fill(self, values, weights, selection):
+        values = values[selection]
+        weights = weights[selection]
+        finite = np.isfinite(values)
+        values = values[finite]
+        weights = weights[finite]
+        index = np.searchsorted(self.edges, values, side="right")
+        size = len(self.sumw)
+        self.sumw += np.bincount(index, weights, size)
+        self.sumw2 += np.bincount(index, weights**2, size)
+        self.sumwx += np.bincount(index, weights * values, size)
+        self.sumwx2 += np.bincount(index, weights * values**2, size)
+        self.entries += np.bincount(index, None, size)
+
+    def to_yoda(self, path, scale=1.0):
+        edges = ", ".join(f"{edge:.10e}" for edge in self.edges)
+        columns = ["sumW", "sumW2", "sumW(A1)", "sumW2(A1)", "numEntries"]
+        roles = yoda_io.column_roles(columns)
+        values = [self.sumw * scale, self.sumw2 * scale**2, self.sumwx * scale, self.sumwx2 * scale, self.entries]
+        rows = [[yoda_io.format_value(column[i], role) for column, role in zip(values, roles)] for i in range(len(self.sumw))]
+        return {
+            "begin": f"BEGIN YODA_HISTO1D_V3 {path}",
+            "path": path,
+            "body": [
+                f"Path: {path}",
+                "Title: ",
+                "Type: Histo1D",
+                "---",
+                f"Edges(A1): [{edges}]",
+                "# " + "\t".join(columns),
+                {"columns": columns, "roles": roles, "rows": rows},
+            ],
+            "end": "END YODA_HISTO1D_V3",
+        }
+
+
+class VBFHHAnalysis:
+    def __init__(self):
+        self.histograms = None
+        self.sumw = 0.0
+        self.sumw2 = 0.0
+        self.events = 0
+        self.cross_section = None
+
+    def analyze(self, batch):
+        if len(batch) == 0:
+            return
+        if self.histograms is None:
+            beams = (batch.status == 4) & (batch.event == 0)
+            sqrts = float(hepmc.mass(batch.momenta[beams].sum(axis=0))) if beams.any() else default_sqrts
+            self.histograms = book(sqrts if sqrts > 0 else default_sqrts)
+        h = self.histograms
+        weights = batch.weights
+        self.sumw += weights.sum()
+        self.sumw2 += (weights**2).sum()
+        self.events += len(batch)
+
+        final_state = batch.status == 1
+        higgs = final_state & (batch.pid == 25)
+        higgs_momenta, higgs_mask = batch.padded(higgs)
+        higgs_eta = hepmc.pseudorapidity(higgs_momenta)
+        higgs_momenta, higgs_mask = sort_by_pt(higgs_momenta, higgs_mask & (np.abs(higgs_eta) < 10.0))
+        if higgs_momenta.shape[1] < 2:
+            higgs_momenta = np.concatenate((higgs_momenta, np.zeros((len(batch), 2 - higgs_momenta.shape[1], 4))), axis=1)
+            higgs_mask = np.concatenate((higgs_mask, np.zeros((len(batch), 2 - higgs_mask.shape[1]), dtype=bool)), axis=1)
+        has_higgs = higgs_mask[:, 0]
+        has_pair = has_higgs & higgs_mask[:, 1]
+        h1, h2 = higgs_momenta[:, 0], higgs_momenta[:, 1]
+
+        h["HH_dR"].fill(delta_r(h1, h2), weights, has_pair)
+        h["HH_dPhi"].fill(delta_phi(h1, h2), weights, has_pair)
+        h["HH_deta"].fill(hepmc.pseudorapidity(h1) - hepmc.pseudorapidity(h2), weights, has_pair)
+        h["HH_pT"].fill(hepmc.transverse_momentum(h1 + h2), weights, has_pair)
+        h["HH_mass"].fill(hepmc.mass(h1 + h2), weights, has_pair)
+        h["H_pT1"].fill(hepmc.transverse_momentum(h1), weights, has_pair)
+        h["H_eta1"].fill(hepmc.pseudorapidity(h1), weights, has_pair)
+        h["H_pT2"].fill(hepmc.transverse_momentum(h2), weights, has_pair)
+        h["H_eta2"].fill(hepmc.pseudorapidity(h2), weights, has_pair)
+        h["H_pT"].fill(hepmc.transverse_momentum(h1), weights, has_higgs)
+        h["H_eta"].fill(hepmc.pseudorapidity(h1), weights, has_higgs)
+        h["H_phi"].fill(hepmc.azimuth(h1), weights, has_higgs)
+
+        jet_inputs, jet_input_mask = batch.padded(final_state & (np.abs(batch.pid) != 25))
+        jets, jet_mask = sort_by_pt(*cluster_antikt(jet_inputs, jet_input_mask), pt_min=jet_pt_min)
+        if jets.shape[1] < 3:
+            jets = np.concatenate((jets, np.zeros((len(batch), 3 - jets.shape[1], 4))), axis=1)
+            jet_mask = np.concatenate((jet_mask, np.zeros((len(batch), 3 - jet_mask.shape[1]), dtype=bool)), axis=1)
+        n_jets = jet_mask.sum(axis=1)
+        for k in range(3):
+            selected = has_higgs & (n_jets > k)
+            jet = jets[:, k]
+            h[f"H_jet{k + 1}_deta"].fill(np.abs(hepmc.pseudorapidity(h1) - hepmc.pseudorapidity(jet)), weights, selected)
+            h[f"H_jet{k + 1}_dR"].fill(delta_r(h1, jet), weights, selected)
+            h[f"jet_pT_{k + 1}"].fill(hepmc.transverse_momentum(jet), weights, selected)
+            h[f"jet_eta_{k + 1}"].fill(hepmc.pseudorapidity(jet), weights, selected)
+            h[f"jet_y_{k + 1}"].fill(hepmc.rapidity(jet), weights, selected)
+        for pair, (a, b), minimum in (("12", (0, 1), 1), ("13", (0, 2), 2), ("23", (1, 2), 2)):
+            selected = has_higgs & (n_jets > minimum)
+            h[f"jets_absdeta_{pair}"].fill(
+                np.abs(hepmc.pseudorapidity(jets[:, a]) - hepmc.pseudorapidity(jets[:, b])), weights, selected
+            )
+            h[f"jets_dphi_{pair}"].fill(delta_phi(jets[:, a], jets[:, b]), weights, selected)
+            h[f"jets_dR_{pair}"].fill(delta_r(jets[:, a], jets[:, b]), weights, selected)
+            h[f"jets_mjj{pair}"].fill(hepmc.mass(jets[:, a] + jets[:, b]), weights, selected)
+        ht = np.sum(np.where(jet_mask, hepmc.transverse_momentum(jets), 0.0), axis=1)
+        h["jet_HT"].fill(ht, weights, has_higgs & (n_jets > 0))
+
+    def to_yoda(self):
+        objects = {}
+        counter = {
+            "columns": ["sumW", "sumW2", "numEntries"],
+            "roles": yoda_io.column_roles(["sumW", "sumW2", "numEntries"]),
+            "rows": [[yoda_io.format_value(self.sumw, "linear"), yoda_io.format_value(self.sumw2, "quadratic"), str(self.events)]],
+        }
+        objects["/_EVTCOUNT"] = {
+            "begin": "BEGIN YODA_COUNTER_V3 /_EVTCOUNT",
+            "path": "/_EVTCOUNT",
+            "body": ["Path: /_EVTCOUNT", "Title: ", "Type: Counter", "---", "# sumW\tsumW2\tnumEntries", counter],
+            "end": "END YODA_COUNTER_V3",
+        }
+        xsec, xsec_error = self.cross_section if self.cross_section is not None else (self.sumw, 0.0)
+        estimate = {
+            "columns": ["value", "errDn(1)", "errUp(1)"],
+            "roles": yoda_io.column_roles(["value", "errDn(1)", "errUp(1)"]),
+            "rows": [[yoda_io.format_value(value, "linear") for value in (xsec, -xsec_error, xsec_error)]],
+        }
+        objects["/_XSEC"] = {
+            "begin": "BEGIN YODA_ESTIMATE0D_V3 /_XSEC",
+            "path": "/_XSEC",
+            "body": ["Path: /_XSEC", "Title: ", "Type: Estimate0D", "---", 'ErrorLabels: [""]', "# value\terrDn(1)\terrUp(1)", estimate],
+            "end": "END YODA_ESTIMATE0D_V3",
+        }
+        scale = xsec / self.sumw if self.sumw != 0 else 0.0
+        for name, histogram in sorted((self.histograms or {}).items()):
+            objects[f"/RAW/{analysis_name}/{name}"] = histogram.to_yoda(f"/RAW/{analysis_name}/{name}")
+        for name, histogram in sorted((self.histograms or {}).items()):
+            objects[f"/{analysis_name}/{name}"] = histogram.to_yoda(f"/{analysis_name}/{name}", scale)
+        return objects
+
+
+def analyze_stream(file):
+    analysis = VBFHHAnalysis()
+    reader = None
+    for reader, batch in hepmc.read_batches(file):
+        analysis.analyze(batch)
+    if reader is not None:
+        analysis.cross_section = reader.cross_section
+    return analysis
+
+
+def analyze_file(path):
+    with open(path, "rb") as file:
+        analysis = analyze_stream(file)
+    return analysis.events, analysis.to_yoda()
+
+
+def analyze(args):
+    for path in args.hepmc:
+        if not os.path.isfile(path):
+            critical(f"HepMC file '{path}' does not exist")
+            sys.exit(1)
+    info(f"Analysing {len(args.hepmc)} HepMC files with {min(args.jobs, len(args.hepmc))} processes...")
+    with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(args.hepmc)))) as executor:
+        results = list(executor.map(analyze_file, args.hepmc))
+    for path, (events, _) in zip(args.hepmc, results):
+        info(f"Analysed {events} events from '{path}'")
+    yoda_io.write_yoda(yoda_io.merge([objects for _, objects in results]), args.output)
+    info(f"Successfully wrote histograms to '{args.output}'")
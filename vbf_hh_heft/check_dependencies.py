@@ -1,9 +1,15 @@
+import os
+import json
 import shutil
 import subprocess
 from logging import info, critical
+from concurrent.futures import ThreadPoolExecutor
 from rich.console import Console
 from rich.table import Table
 
+from vbf_hh_heft.util import get_src_location, file_stamps
+from vbf_hh_heft.db import atomic_write_json
+
 requirements = {
     "python": {
         "command": "python",
@@ -34,18 +40,45 @@ def cmp_version(version1, version2):
     return v1 > v2
 
 
+def get_dependency_cache_path():
+    return os.path.join(get_src_location(), ".cache", "dependencies.json")
+
+
+def probe_version(data, location, cached):
+    stamp = file_stamps([location])[location]
+    # the version of an unchanged binary is reused, only new or updated tools are run
+    if cached is not None and cached["location"] == location and cached["stamp"] == stamp:
+        return cached
+    version = subprocess.check_output(data["version_command"], shell=True).decode("utf-8").strip()
+    return {"location": location, "stamp": stamp, "version": version}
+
+
 def check_dependencies(args):
+    try:
+        with open(get_dependency_cache_path()) as file:
+            cache = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        cache = {}
+    locations = {
+        dep: shutil.which(data["command"]) for dep, data in requirements.items() if args.mpi or not "mpi" in dep
+    }
+    with ThreadPoolExecutor(max_workers=len(locations)) as executor:
+        probes = {
+            dep: executor.submit(probe_version, requirements[dep], location, cache.get(dep))
+            for dep, location in locations.items()
+            if location
+        }
+        cache.update({dep: probe.result() for dep, probe in probes.items()})
+    os.makedirs(os.path.dirname(get_dependency_cache_path()), exist_ok=True)
+    atomic_write_json(get_dependency_cache_path(), cache)
     dep_results = {}
-    for dep, data in requirements.items():
-        if not args.mpi and "mpi" in dep:
-            continue
-        location = shutil.which(data["command"])
+    for dep, location in locations.items():
         if not location:
             dep_results[dep] = None
             continue
-        version = subprocess.check_output(data["version_command"], shell=True).decode("utf-8").strip()
-        if "min_version" in data:
-            if cmp_version(version, data["min_version"]):
+        version = cache[dep]["version"]
+        if "min_version" in requirements[dep]:
+            if cmp_version(version, requirements[dep]["min_version"]):
                 ok = True
             else:
                 ok = False
@@ -0,0 +1,74 @@
+import os
+import sys
+
+import numpy as np
+
+from vbf_hh_heft import hepmc
+from vbf_hh_heft.analysis import cluster_antikt, sort_by_pt
+
+max_higgs = 2
+max_jets = 4
+
+event_dtype = np.dtype(
+    [
+        ("weight", "f8"),
+        ("higgs", "f4", (max_higgs, 4)),
+        ("jets", "f4", (max_jets, 4)),
+        ("n_higgs", "u1"),
+        ("n_jets", "u1"),
+    ]
+)
+
+
+def fixed_width(momenta, mask, width):
+    if momenta.shape[1] < width:
+        padding = width - momenta.shape[1]
+        momenta = np.concatenate((momenta, np.zeros((len(momenta), padding, 4))), axis=1)
+        mask = np.concatenate((mask, np.zeros((len(mask), padding), dtype=bool)), axis=1)
+    return momenta[:, :width], mask[:, :width]
+
+
+def event_records(batch):
+    records = np.zeros(len(batch), dtype=event_dtype)
+    records["weight"] = batch.weights
+    final_state = batch.status == 1
+    higgs, higgs_mask = fixed_width(*sort_by_pt(*batch.padded(final_state & (batch.pid == 25))), max_higgs)
+    records["higgs"] = np.where(higgs_mask[..., None], higgs, 0.0)
+    records["n_higgs"] = higgs_mask.sum(axis=1)
+    jet_inputs, jet_input_mask = batch.padded(final_state & (np.abs(batch.pid) != 25))
+    jets, jet_mask = fixed_width(*sort_by_pt(*cluster_antikt(jet_inputs, jet_input_mask)), max_jets)
+    records["jets"] = np.where(jet_mask[..., None], jets, 0.0)
+    records["n_jets"] = jet_mask.sum(axis=1)
+    return records
+
+
+def write_columns(source, path):
+    with open(path, "wb") as file:
+        for _, batch in hepmc.read_batches(source):
+            if len(batch) > 0:
+                file.write(event_records(batch).tobytes())
+
+
+def write_npy(record_files, destination):
+    n_events = sum(os.path.getsize(path) for path in record_files) // event_dtype.itemsize
+    with open(destination, "wb") as output:
+        np.lib.format.write_array_header_1_0(
+            output, {"descr": np.lib.format.dtype_to_descr(event_dtype), "fortran_order": False, "shape": (n_events,)}
+        )
+        for path in record_files:
+            with open(path, "rb") as records:
+                while True:
+                    data = records.read(1 << 24)
+                    if not data:
+                        break
+                    output.write(data)
+    return n_events
+
+
+def load_columns(path):
+    return np.load(path, mmap_mode="r")
+
+
+if __name__ == "__main__":
+    # run by the Rivet relays as a separate consumer of the HepMC stream on stdin
+    write_columns(sys.stdin.buffer, sys.argv[1])
@@ -0,0 +1,89 @@
+import os
+import json
+import fcntl
+import tempfile
+import threading
+from contextlib import contextmanager
+
+journal_compaction_size = 1 << 20
+
+thread_locks = {}
+thread_locks_guard = threading.Lock()
+
+
+@contextmanager
+def file_lock(path, shared=False):
+    with thread_locks_guard:
+        if path not in thread_locks:
+            thread_locks[path] = threading.Lock()
+        thread_lock = thread_locks[path]
+    with thread_lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.lock", "a+") as lock_file:
+            fcntl.lockf(lock_file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(lock_file, fcntl.LOCK_UN)
+
+
+def atomic_write_json(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}.")
+    try:
+        with os.fdopen(fd, "w") as file:
+            json.dump(data, file, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def replay_journal(path):
+    try:
+        with open(path) as db_file:
+            db = json.load(db_file)
+    except FileNotFoundError:
+        db = {}
+    try:
+        with open(f"{path}.journal") as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if "delete" in entry.keys():
+                    db.pop(entry["key"], None)
+                else:
+                    db[entry["key"]] = entry["value"]
+    except FileNotFoundError:
+        pass
+    return db
+
+
+def read_db(path):
+    with file_lock(path, shared=True):
+        return replay_journal(path)
+
+
+def compact_db(path):
+    with file_lock(path):
+        db = replay_journal(path)
+        atomic_write_json(path, db)
+        if os.path.exists(f"{path}.journal"):
+            os.remove(f"{path}.journal")
+    return db
+
+
+def update_db(path, key, value=None, delete=False):
+    entry = {"key": key, "delete": True} if delete else {"key": key, "value": value}
+    with file_lock(path):
+        with open(f"{path}.journal", "a") as journal:
+            journal.write(json.dumps(entry) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+        journal_size = os.path.getsize(f"{path}.journal")
+    if journal_size > journal_compaction_size:
+        compact_db(path)
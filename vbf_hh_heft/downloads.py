@@ -0,0 +1,207 @@
+from logging import info, warning, critical
+from urllib.request import urlopen, Request
+from urllib.error import HTTPError, URLError
+from http.client import HTTPException
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+import threading
+import hashlib
+import shutil
+import time
+import sys
+import os
+
+from rich.progress import (
+    BarColumn,
+    DownloadColumn,
+    Progress,
+    TextColumn,
+    TimeRemainingColumn,
+    TransferSpeedColumn,
+)
+
+checksum_file = "SHA256SUMS"
+chunk_size = 1 << 16
+max_attempts = 5
+download_jobs = 8
+headers = {"User-Agent": "vbf_hh_heft", "Accept": "*/*"}
+
+
+def archive_name(url):
+    return url.split("/")[-1]
+
+
+def is_url(location):
+    return location.startswith(("http://", "https://"))
+
+
+def parse_checksums(lines):
+    checksums = {}
+    for line in lines:
+        parts = line.split()
+        if len(parts) == 2:
+            checksums[parts[1].lstrip("*")] = parts[0].lower()
+    return checksums
+
+
+def read_checksums(location):
+    try:
+        if is_url(location):
+            with urlopen(Request(location, headers=headers), timeout=30) as response:
+                return parse_checksums(response.read().decode().splitlines())
+        with open(location) as file:
+            return parse_checksums(file)
+    except (FileNotFoundError, HTTPError, URLError):
+        return {}
+
+
+def write_checksums(path, checksums):
+    with open(f"{path}.tmp", "w") as file:
+        for filename, digest in sorted(checksums.items()):
+            file.write(f"{digest}  {filename}\n")
+    os.replace(f"{path}.tmp", path)
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for data in iter(partial(file.read, 1 << 20), b""):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def fetch(url, destination, progress, task_id):
+    partial_path = f"{destination}.part"
+    for attempt in range(max_attempts):
+        offset = os.path.getsize(partial_path) if os.path.isfile(partial_path) else 0
+        request = Request(url, headers={**headers, "Range": f"bytes={offset}-"} if offset > 0 else headers)
+        try:
+            with urlopen(request, timeout=60) as response:
+                if offset > 0 and response.status != 206:
+                    offset = 0
+                length = response.headers["Content-Length"]
+                progress.update(task_id, total=offset + int(length) if length else None, completed=offset)
+                progress.start_task(task_id)
+                with open(partial_path, "ab" if offset > 0 else "wb") as file:
+                    for data in iter(partial(response.read, chunk_size), b""):
+                        file.write(data)
+                        progress.update(task_id, advance=len(data))
+                if length and os.path.getsize(partial_path) < offset + int(length):
+                    raise HTTPException(f"connection closed after {os.path.getsize(partial_path)} bytes")
+            os.replace(partial_path, destination)
+            return
+        except HTTPError as error:
+            # the partial file is already complete, its checksum decides whether it is usable
+            if error.code == 416 and offset > 0:
+                os.replace(partial_path, destination)
+                return
+            if error.code < 500 or attempt == max_attempts - 1:
+                raise
+            reason = error
+        except (HTTPException, OSError) as error:
+            if attempt == max_attempts - 1:
+                raise
+            reason = error
+        warning(f"Download of {url} interrupted ({reason}), resuming in {2**attempt} s")
+        time.sleep(2**attempt)
+
+
+def copy_from_mirror(source, destination):
+    shutil.copyfile(source, f"{destination}.part")
+    os.replace(f"{destination}.part", destination)
+
+
+def verify(filename, path, checksums, lock):
+    digest = file_digest(path)
+    with lock:
+        expected = checksums.get(filename)
+        if expected is None:
+            checksums[filename] = digest
+    if expected is not None and expected != digest:
+        os.remove(path)
+        raise ValueError(f"checksum mismatch, expected {expected}, got {digest}")
+
+
+def download(url, dest_dir, mirror, checksums, lock, progress):
+    filename = archive_name(url)
+    destination = os.path.join(dest_dir, filename)
+    task_id = progress.add_task("download", filename=filename, start=False)
+    try:
+        if mirror is not None and not is_url(mirror) and os.path.isfile(os.path.join(mirror, filename)):
+            copy_from_mirror(os.path.join(mirror, filename), destination)
+        elif mirror is not None and is_url(mirror):
+            try:
+                fetch(f"{mirror.rstrip('/')}/{filename}", destination, progress, task_id)
+            except HTTPError as error:
+                if error.code != 404:
+                    raise
+                fetch(url, destination, progress, task_id)
+        else:
+            fetch(url, destination, progress, task_id)
+        verify(filename, destination, checksums, lock)
+    finally:
+        progress.remove_task(task_id)
+
+
+def download_archives(urls, dest_dir, pins=None, mirror=None, jobs=download_jobs, allow_unpinned=False):
+    os.makedirs(dest_dir, exist_ok=True)
+    checksum_path = os.path.join(dest_dir, checksum_file)
+    # digests recorded by an earlier run keep protecting the archives they were recorded for
+    checksums = read_checksums(checksum_path)
+    if mirror is not None:
+        # digests published next to the mirror take precedence over the ones recorded locally
+        checksums.update(
+            read_checksums(f"{mirror.rstrip('/')}/{checksum_file}" if is_url(mirror) else os.path.join(mirror, checksum_file))
+        )
+    pinned = {filename: digest.lower() for filename, digest in (pins or {}).items() if digest is not None}
+    checksums.update(pinned)
+    unpinned = [archive_name(url) for url in dict.fromkeys(urls) if archive_name(url) not in checksums.keys()]
+    if len(unpinned) > 0 and len(pinned) > 0 and not allow_unpinned:
+        critical(
+            f"No pinned SHA256 digest for {', '.join(unpinned)}. Add the digests to package_data, use a mirror with "
+            f"a {checksum_file} file or pass --allow-unpinned to trust the first download"
+        )
+        sys.exit(1)
+    if len(unpinned) > 0:
+        warning(
+            f"No SHA256 digest known for {', '.join(unpinned)}, trusting the first download and recording its digest "
+            f"in {checksum_path}"
+        )
+    lock = threading.Lock()
+    pending = []
+    for url in dict.fromkeys(urls):
+        path = os.path.join(dest_dir, archive_name(url))
+        if os.path.isfile(path):
+            try:
+                verify(archive_name(url), path, checksums, lock)
+                continue
+            except ValueError as error:
+                warning(f"Discarding cached '{archive_name(url)}': {error}")
+        pending.append(url)
+    failed = []
+    if len(pending) > 0:
+        info(f"Downloading {len(pending)} archives{f' from mirror {mirror}' if mirror is not None else ''}...")
+        with Progress(
+            TextColumn("[bold blue]{task.fields[filename]}", justify="right"),
+            BarColumn(bar_width=None),
+            "[progress.percentage]{task.percentage:>3.1f}%",
+            "•",
+            DownloadColumn(),
+            "•",
+            TransferSpeedColumn(),
+            "•",
+            TimeRemainingColumn(),
+            transient=True,
+        ) as progress, ThreadPoolExecutor(max_workers=max(1, min(jobs, len(pending)))) as executor:
+            futures = {
+                executor.submit(download, url, dest_dir, mirror, checksums, lock, progress): url for url in pending
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as error:
+                    critical(f"Failed to download {futures[future]}: {error}")
+                    failed.append(futures[future])
+    write_checksums(checksum_path, {**read_checksums(checksum_path), **checksums})
+    if len(failed) > 0:
+        sys.exit(1)
@@ -0,0 +1,131 @@
+import os
+import json
+import shutil
+import tempfile
+from logging import info
+
+from vbf_hh_heft.util import get_src_location
+from vbf_hh_heft.db import file_lock, atomic_write_json
+from vbf_hh_heft import yoda_io
+from vbf_hh_heft.columns import write_npy, load_columns
+
+
+def get_event_dir():
+    return os.path.join(get_src_location(), "Events")
+
+
+def get_event_path(conf_hash):
+    return os.path.join(get_event_dir(), conf_hash)
+
+
+def migrate_legacy_archive(conf_hash):
+    archive = os.path.join(get_event_dir(), f"{conf_hash}.tar.gz")
+    if not os.path.isfile(archive):
+        return
+    info(f"Migrating event archive '{conf_hash}.tar.gz' to the event store...")
+    staging = tempfile.mkdtemp(dir=get_event_dir())
+    shutil.unpack_archive(archive, staging)
+    if os.path.isdir(get_event_path(conf_hash)):
+        shutil.rmtree(get_event_path(conf_hash))
+    os.replace(staging, get_event_path(conf_hash))
+    os.remove(archive)
+
+
+def write_yoda_atomic(objects, path):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}.")
+    os.close(fd)
+    yoda_io.write_yoda(objects, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def has_events(conf_hash):
+    if os.path.isfile(os.path.join(get_event_dir(), f"{conf_hash}.tar.gz")):
+        with file_lock(get_event_path(conf_hash)):
+            migrate_legacy_archive(conf_hash)
+    return os.path.isfile(os.path.join(get_event_path(conf_hash), "content.json"))
+
+
+def read_content(conf_hash):
+    with file_lock(get_event_path(conf_hash), shared=True):
+        with open(os.path.join(get_event_path(conf_hash), "content.json")) as content_db:
+            return json.load(content_db)
+
+
+def read_histograms(conf_hash, process):
+    return yoda_io.read_yoda(os.path.join(get_event_path(conf_hash), f"{process}.yoda"))
+
+
+def read_columns(conf_hash, sample=None):
+    content = read_content(conf_hash)
+    if "columns" not in content.keys():
+        return {}
+    return {
+        seed: {
+            key: load_columns(os.path.join(get_event_path(conf_hash), path))
+            for key, path in files.items()
+            if sample is None or key == sample
+        }
+        for seed, files in content["columns"].items()
+    }
+
+
+def add_run(conf_hash, seed, run_dir, proc_info, template, param_dict, columns=None):
+    os.makedirs(get_event_dir(), exist_ok=True)
+    event_path = get_event_path(conf_hash)
+    with file_lock(event_path):
+        migrate_legacy_archive(conf_hash)
+        os.makedirs(event_path, exist_ok=True)
+        staging = tempfile.mkdtemp(dir=event_path)
+        for name, process in proc_info.items():
+            for component in process.keys():
+                shutil.copy2(os.path.join(run_dir, f"{name}_{component}.yoda"), staging)
+        if columns is not None:
+            for key, record_files in columns.items():
+                write_npy(record_files, os.path.join(staging, f"{key}.npy"))
+        if os.path.isdir(os.path.join(event_path, str(seed))):
+            shutil.rmtree(os.path.join(event_path, str(seed)))
+        os.replace(staging, os.path.join(event_path, str(seed)))
+
+        for name, process in proc_info.items():
+            components = []
+            for component in process.keys():
+                accumulator = os.path.join(event_path, f"{name}_{component}.yoda")
+                runs = [yoda_io.read_yoda(os.path.join(run_dir, f"{name}_{component}.yoda"))]
+                if os.path.exists(accumulator):
+                    runs.insert(0, yoda_io.read_yoda(accumulator))
+                components.append(yoda_io.merge(runs))
+                write_yoda_atomic(components[-1], accumulator)
+            write_yoda_atomic(yoda_io.merge(components, equivalent=False), os.path.join(event_path, f"{name}.yoda"))
+
+        run_events = {
+            name: {component: data["n_events"] for component, data in process.items()}
+            for name, process in proc_info.items()
+        }
+        if os.path.exists(os.path.join(event_path, "content.json")):
+            with open(os.path.join(event_path, "content.json")) as content_db:
+                content = json.load(content_db)
+            content["metadata"]["n_events"] = {
+                name: {
+                    component: content["metadata"]["n_events"][name][component] + n_events
+                    for component, n_events in process.items()
+                }
+                for name, process in run_events.items()
+            }
+        else:
+            content = {
+                "metadata": {
+                    "template": template,
+                    "params": param_dict,
+                    "processes": list(proc_info.keys()),
+                    "n_events": run_events,
+                },
+                "samples": {},
+            }
+        content["samples"][str(seed)] = run_events
+        if columns is not None:
+            content.setdefault("columns", {})[str(seed)] = {key: f"{seed}/{key}.npy" for key in columns.keys()}
+        elif "columns" in content.keys():
+            content["columns"].pop(str(seed), None)
+        atomic_write_json(os.path.join(event_path, "content.json"), content)
+    return content
+
@@ -2,14 +2,13 @@ import sys
 import os
 from logging import info, warning, critical
 import inspect
-import hashlib
 import json
-import tarfile
-import re
 import math
 
-from vbf_hh_heft.util import expand_parameters, get_src_location, get_install_info
-from vbf_hh_heft.integrate import run_integration, submit_jobs
+from vbf_hh_heft.util import expand_parameters, get_src_location, get_install_info, get_conf_hash
+from vbf_hh_heft.integrate import integrate_missing, submit_jobs
+from vbf_hh_heft.grid_store import lookup_grids
+from vbf_hh_heft.fit_function import linear_basis, is_linear
 
 from rich.console import Console
 from rich.table import Table
@@ -23,29 +22,92 @@ except ImportError:
         critical("Python versions older than 3.11 require the 'toml' package to be installed")
         sys.exit(1)
 
-try:
-    import iminuit
-    from iminuit.cost import LeastSquares
-    import numpy as np
-except ImportError:
-    critical(
-        "Fitting the total cross section requires the '[link=https://scikit-hep.org/iminuit/]iminuit[/link]' package to be installed"
-    )
-    sys.exit(1)
+import numpy as np
+
+
+def import_iminuit():
+    try:
+        import iminuit
+        from iminuit.cost import LeastSquares
+    except ImportError:
+        critical(
+            "Fitting non-linear functions to the total cross section requires the '[link=https://scikit-hep.org/iminuit/]iminuit[/link]' package to be installed"
+        )
+        sys.exit(1)
+    return iminuit, LeastSquares
+
+
+def covariance_whitener(variances, correlated=None):
+    scale = 1 / np.sqrt(variances)
+    if correlated is None or not np.any(correlated):
+        return lambda a: (np.asarray(a).T * scale).T
+    u = correlated * scale
+    norm = u @ u
+    alpha = (1 / np.sqrt(1 + norm) - 1) / norm
+
+    def whiten(a):
+        a = (np.asarray(a).T * scale).T
+        return a + alpha * np.multiply.outer(u, u @ a)
 
+    return whiten
 
-def corr_chi2(x, data, covariance_matrix, model):
+
+def corr_chi2(x, data, whiten, model):
     def res_func(params):
-        cm_inv = np.linalg.inv(covariance_matrix)
-        diff = data - model(x, *params)
-        return diff @ cm_inv @ diff
+        residuals = whiten(data - model(x, *params))
+        return residuals @ residuals
 
+    iminuit, _ = import_iminuit()
     f = res_func
     f.errordef = iminuit.Minuit.LEAST_SQUARES
     f.ndata = len(data)
     return f
 
 
+def linear_fit(design_matrix, data, whiten, names):
+    whitened_design = whiten(design_matrix)
+    whitened_data = whiten(data)
+    try:
+        factor = np.linalg.cholesky(whitened_design.T @ whitened_design)
+    except np.linalg.LinAlgError:
+        critical(f"The parameter points in the configuration do not determine all {len(names)} coefficients of the fit function")
+        sys.exit(1)
+    factor_inv = np.linalg.inv(factor)
+    covariance = factor_inv.T @ factor_inv
+    values = covariance @ (whitened_design.T @ whitened_data)
+    residuals = whitened_data - whitened_design @ values
+    ndf = len(data) - len(names)
+    return {
+        "algorithm": "GLS",
+        "edm": 0.0,
+        "reduced_chi2": float(residuals @ residuals) / ndf if ndf > 0 else float("nan"),
+        "is_valid": bool(np.all(np.isfinite(values))),
+        "values": dict(zip(names, values.tolist())),
+        "errors": dict(zip(names, np.sqrt(np.diag(covariance)).tolist())),
+        "covariance": covariance.tolist(),
+    }
+
+
+def minuit_fit(least_squares, names):
+    iminuit, _ = import_iminuit()
+    m = iminuit.Minuit(least_squares, ([1] * len(names)), name=names)
+    m.migrad()
+    m.hesse()
+    if not m.valid:
+        warning(f"Migrad did not converge to a valid minimum")
+    else:
+        m.minos()
+    return {
+        "algorithm": m.fmin.algorithm,
+        "edm": m.fmin.edm,
+        "reduced_chi2": m.fmin.reduced_chi2,
+        "is_valid": m.fmin.is_valid,
+        "values": m.values.to_dict(),
+        "errors": m.errors.to_dict(),
+        "covariance": [[m.covariance[i][j] for j in range(len(names))] for i in range(len(names))],
+    }
+
+
 def fit(args):
     if not args.config:
         critical("A configuration file containing the fit function and parameter points is required")
@@ -57,55 +119,38 @@ def fit(args):
             warning("Whizard was installed without MPI support, running serially")
         else:
             config["mpi"] = args.mpi
-    d = {}
-    exec(config["fit"]["code"], d)
-    fit_function = d[config["fit"]["function_name"]]
-    n_params = len(inspect.signature(fit_function).parameters) - 1
+    basis_terms, n_params, fit_function = linear_basis(config)
     param_list = expand_parameters(args.config, args.cmd_parameters)
     if len(param_list) < n_params:
         critical(
             f"The given fit function requires {n_params} parameter points to be fully determined, but the config only has {len(param_list)} parameter combinations"
         )
         sys.exit(1)
-    missing_points = []
     template_name = os.path.splitext(args.template)[0]
-    for param_dict in param_list:
-        conf_hash = hashlib.sha256(
-            json.dumps({"template": template_name, "parameters": param_dict}).encode("utf-8")
-        ).hexdigest()
-        if not os.path.isfile(os.path.join(get_src_location(), "Grids", f"{conf_hash}.tar.gz")):
-            missing_points.append(param_dict)
+    conf_hashes = [get_conf_hash(template_name, param_dict) for param_dict in param_list]
+    grids = lookup_grids(conf_hashes)
+    missing_points = [param_dict for param_dict, conf_hash in zip(param_list, conf_hashes) if conf_hash not in grids]
     if len(missing_points) > 0:
         if args.cluster:
             submit_jobs(args, config, param_list)
         else:
-            info(f"Running integration for {len(missing_points)} missing parameter combinations...")
-            for i, param_dict in enumerate(missing_points):
-                run_integration(
-                    config, param_dict, args.template, f"[orange]\\[{i + 1}/{len(missing_points)}][/orange] "
-                )
-            info(f"Successfully integrated {len(param_list)} missing parameter combinations")
+            integrate_missing(args, config, missing_points)
+        grids = lookup_grids(conf_hashes)
     info(f"Fitting the total cross section with the given function for {len(param_list)} parameter combinations...")
     xsec_list = []
     xsec_err_list = []
-    for param_dict in param_list:
-        conf_hash = hashlib.sha256(
-            json.dumps({"template": template_name, "parameters": param_dict}).encode("utf-8")
-        ).hexdigest()
-        xsecs = []
-        errors = []
-        with tarfile.open(os.path.join(get_src_location(), "Grids", f"{conf_hash}.tar.gz"), "r:gz") as grid_archive:
-            for file in grid_archive.getmembers():
-                if file.name.endswith(".vg2"):
-                    grid = grid_archive.extractfile(file).read().decode("utf-8")
-                    xsecs.append(float(re.search(r"Integral\s*=\s*([\d.+-E]+)", grid).group(1)))
-                    errors.append(float(re.search(r"Error\s*=\s*([\d.+-E]+)", grid).group(1)))
+    for conf_hash in conf_hashes:
+        xsecs = [component["xsec"] for component in grids[conf_hash]["components"]]
+        errors = [component["error"] for component in grids[conf_hash]["components"]]
         uncertainty = 1 / sum(1 / err**2 for err in errors)
         xsec = sum(xsec / err**2 for xsec, err in zip(xsecs, errors)) * uncertainty
         xsec_list.append(xsec)
         xsec_err_list.append(math.sqrt(uncertainty))
 
     x = [list(d.values()) for d in param_list]
+    names = tuple(list(inspect.signature(fit_function).parameters)[1:])
+    xsecs = np.array(xsec_list)
+    xsec_errors = np.array(xsec_err_list)
     if config["fit"]["normalize"]:
         try:
             i_norm = x.index([1.0] * len(config["parameters"]))
@@ -113,50 +158,38 @@ def fit(args):
             warning(f"Unit value parameter point not found in the configuration, normalizing to {param_list[0]}")
             i_norm = 0
         xsec_norm = xsec_list[i_norm]
-        xsec_norm_list = [xsec / xsec_norm for xsec in xsec_list]
-        cov_matrix = np.array(
-            [
-                [
-                    xsec_list[i] * xsec_list[j] * xsec_err_list[i_norm] ** 2 / xsec_norm**4
-                    + (xsec_err_list[i] ** 2 / xsec_norm**2 if i == j else 0)
-                    for j in range(len(param_list))
-                ]
-                for i in range(len(param_list))
-            ]
-        )
-        x = np.array(x)
-        least_squares = corr_chi2(x.T, xsec_norm_list, cov_matrix, fit_function)
+        data = xsecs / xsec_norm
+        whiten = covariance_whitener(xsec_errors**2 / xsec_norm**2, xsecs * xsec_err_list[i_norm] / xsec_norm**2)
     else:
-        x = np.array(x)
-        least_squares = LeastSquares(x.T, xsec_list, xsec_err_list, fit_function)
-    m = iminuit.Minuit(
-        least_squares, ([1] * n_params), name=tuple(list(inspect.signature(fit_function).parameters)[1:])
-    )
-    m.migrad()
-    m.hesse()
-    if not m.valid:
-        warning(f"Migrad did not converge to a valid minimum")
+        data = xsecs
+        whiten = covariance_whitener(xsec_errors**2)
+    x = np.array(x)
+    if is_linear(fit_function, basis_terms, n_params, x):
+        result = linear_fit(basis_terms(x), data, whiten, names)
+    elif config["fit"]["normalize"]:
+        result = minuit_fit(corr_chi2(x.T, data, whiten, fit_function), names)
     else:
-        m.minos()
-    info(f"Fit terminated with final 𝜒²/ndf = {m.fmin.reduced_chi2}")
+        _, LeastSquares = import_iminuit()
+        result = minuit_fit(LeastSquares(x.T, xsec_list, xsec_err_list, fit_function), names)
+    info(f"Fit terminated with final 𝜒²/ndf = {result['reduced_chi2']}")
     if not os.path.isdir(os.path.join(get_src_location(), "Fits")):
         os.mkdir(os.path.join(get_src_location(), "Fits"))
     with open(os.path.join(get_src_location(), "Fits", f"{template_name}.json"), "w") as f:
         json.dump(
             {
                 "metadata": {
-                    "algorithm": m.fmin.algorithm,
-                    "edm": m.fmin.edm,
-                    "chisq/ndf": m.fmin.reduced_chi2,
-                    "is_valid": m.fmin.is_valid,
+                    "algorithm": result["algorithm"],
+                    "edm": result["edm"],
+                    "chisq/ndf": result["reduced_chi2"],
+                    "is_valid": result["is_valid"],
                     "parmeter_points": param_list,
                     "xsecs": xsec_list,
                     "xsec_errors": xsec_err_list,
                 },
                 "parameters": {
-                    "values": m.values.to_dict(),
-                    "errors": m.errors.to_dict(),
-                    "covariance_matrix": [[m.covariance[i][j] for j in range(n_params)] for i in range(n_params)],
+                    "values": result["values"],
+                    "errors": result["errors"],
+                    "covariance_matrix": result["covariance"],
                 },
             },
             f,
@@ -166,7 +199,7 @@ def fit(args):
     table.add_column("Parameter")
     table.add_column("Value")
     table.add_column("Error")
-    for param in m.params:
-        table.add_row(param.name, str(param.value), str(param.error))
+    for name in names:
+        table.add_row(name, str(result["values"][name]), str(result["errors"][name]))
     console = Console()
     console.print(table)
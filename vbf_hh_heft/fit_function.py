@@ -0,0 +1,25 @@
+import inspect
+
+import numpy as np
+
+
+def linear_basis(config):
+    d = {}
+    exec(config["fit"]["code"], d)
+    fit_function = d[config["fit"]["function_name"]]
+    n_terms = len(inspect.signature(fit_function).parameters) - 1
+
+    def basis_terms(couplings):
+        couplings = np.atleast_2d(np.asarray(couplings, dtype=float))
+        return np.array([fit_function(couplings.T, *unit) for unit in np.eye(n_terms)], dtype=float).reshape(
+            n_terms, len(couplings)
+        ).T
+
+    return basis_terms, n_terms, fit_function
+
+
+def is_linear(fit_function, basis_terms, n_terms, couplings):
+    coefficients = np.random.default_rng(1).normal(size=n_terms)
+    expected = basis_terms(couplings) @ coefficients
+    actual = np.asarray(fit_function(np.asarray(couplings, dtype=float).T, *coefficients), dtype=float)
+    return np.allclose(actual, expected, rtol=1e-8, atol=1e-12 * np.max(np.abs(expected), initial=1.0))
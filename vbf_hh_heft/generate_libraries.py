@@ -1,54 +1,224 @@
-import jinja2
 import tempfile
-from logging import info, critical
+from logging import info, warning
 import tarfile
 import os
 import pathlib
-import re
 import glob
 import json
+import shutil
+import hashlib
+from functools import partial
 
-from vbf_hh_heft.util import get_src_location, execute_alt_screen, setup_env, get_install_info
+from vbf_hh_heft.util import (
+    get_src_location,
+    execute_alt_screen,
+    setup_env,
+    get_install_info,
+    get_toolchain,
+    run_concurrently,
+)
+from vbf_hh_heft.templates import render_template, get_template_info
+from vbf_hh_heft.sindarin import statements, tokenize
+from vbf_hh_heft.model_source import get_model_source_hash
+from vbf_hh_heft.db import file_lock, atomic_write_json
+from vbf_hh_heft.packages import package_data
 
+library_cache_version = 1
+
+# settings that Whizard only evaluates when integrating or simulating, they do not change the compiled code
+runtime_settings = {
+    "form_threads",
+    "$integration_method",
+    "$rng_method",
+    "$vamp_parallel_method",
+    "jet_algorithm",
+    "jet_r",
+    "cuts",
+    "sqrts",
+    "renormalization_scale",
+    "factorization_scale",
+    "beams",
+    "$lhapdf_file",
+    "?alphas_is_fixed",
+    "?alphas_from_lhapdf",
+}
+
+
+def get_library_cache_dir():
+    return os.path.join(get_src_location(), ".cache", "libraries")
+
+
+def toolchain_fingerprint():
+    toolchain = get_toolchain()
+    parts = [package_data["whizard"]["dirname"], package_data["gosam"]["dirname"], str(toolchain["installation"]["mpi"])]
+    for binary, stamp in toolchain["binaries"].items():
+        if stamp is not None:
+            parts.append(f"{binary}:{stamp[0]}:{stamp[1]}")
+    return " ".join(parts)
+
+
+def canonical(statement, model_path):
+    return " ".join(value for _, value in tokenize(statement.text.replace(model_path, "")))
+
+
+def library_layout(template_path):
+    model_path = os.path.join(get_src_location(), "Model")
+    prelude = []
+    processes = {}
+    for statement in statements(render_template(template_path, {"scale": 1.0, "seed": 1, "generate_events": False})):
+        if statement.head == "compile":
+            break
+        if statement.head == "process":
+            processes[statement.name] = statement
+        else:
+            prelude.append(statement)
+    common = hashlib.sha256(f"{library_cache_version}\n{toolchain_fingerprint()}\n".encode())
+    for statement in prelude:
+        if statement.head == "model":
+            model_name = tokenize(statement.text)[2][1]
+            common.update(f"{model_name} {get_model_source_hash(os.path.join(model_path, model_name))}\n".encode())
+        elif statement.head not in runtime_settings:
+            common.update(f"{canonical(statement, model_path)}\n".encode())
+    process_keys = {}
+    for name, statement in processes.items():
+        process_key = common.copy()
+        process_key.update(canonical(statement, model_path).encode())
+        process_keys[name] = process_key.hexdigest()
+    library_key = hashlib.sha256(" ".join(sorted(process_keys.values())).encode()).hexdigest()
+    return prelude, processes, process_keys, library_key
+
+
+def archive_atomic(path, add_files):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}.")
+    os.close(fd)
+    with tarfile.open(tmp_path, "w:gz") as archive:
+        add_files(archive)
+    os.replace(tmp_path, path)
+
+
+def process_artifact(process_key):
+    return os.path.join(get_library_cache_dir(), "processes", f"{process_key}.tar.gz")
+
+
+def build_process(name, process_key, prelude, statement, screen=True):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with open(os.path.join(tmpdir, "input.sin"), "w") as sindarin:
+            sindarin.write("\n".join([*(s.text for s in prelude), statement.text, "compile ()"]) + "\n")
+        execute_alt_screen(
+            f"Compiling process {name}",
+            [f"{get_install_info()['prefix']}/bin/whizard --single-event input.sin"],
+            logfile=os.path.join(get_src_location(), f"vbf_hh_heft_{name}.log"),
+            env=setup_env(),
+            cwd=tmpdir,
+            screen=screen,
+        )
+
+        def add_files(archive):
+            for module in glob.glob(os.path.join(tmpdir, "*_olp_modules")):
+                archive.add(module, arcname=os.path.basename(module))
+            for file in glob.glob(os.path.join(tmpdir, "*.ol?")):
+                archive.add(file, arcname=os.path.basename(file))
+
+        archive_atomic(process_artifact(process_key), add_files)
 
-def generate_libraries(template_path):
-    os.chdir(get_src_location())
-    template_name = os.path.splitext(pathlib.Path(template_path).name)[0]
-    if not os.path.isdir("Libraries"):
-        os.mkdir("Libraries")
-    else:
-        if os.path.isfile(os.path.join("Libraries", template_name + ".tar.gz")):
-            info(f"Found existing library archive '{template_name + '.tar.gz'}, skipping library generation")
-            return
-    info(f"Generating libraries for template '{template_path}'")
-    with open(template_path) as template_file:
-        template = jinja2.Template(template_file.read())
-    input_string = template.render(
-        {"model_path": os.path.join(get_src_location(), "Model"), "scale": 1.0, "seed": 1, "generate_events": False}
-    )
+
+def build_library(template_path, prelude, processes, process_keys, library_archive, jobs, seed_processes=False):
+    template_info = get_template_info(template_path)
+    # seeding the build with separately compiled processes relies on Whizard reusing their OLP modules, which has not
+    # been verified with a full Whizard/GoSam toolchain yet, the default is a single full build
+    missing = []
+    if seed_processes:
+        missing = [name for name in processes.keys() if not os.path.isfile(process_artifact(process_keys[name]))]
+    if len(missing) > 0:
+        info(f"Compiling {len(missing)} of {len(processes)} processes, the others are cached")
+        jobs = max(1, min(jobs, os.cpu_count() or 1, len(missing)))
+        if jobs > 1:
+            run_concurrently(
+                [
+                    partial(build_process, name, process_keys[name], prelude, processes[name], screen=False)
+                    for name in missing
+                ],
+                jobs,
+                f"Compiling {len(missing)} processes with {jobs} concurrent jobs",
+            )
+        else:
+            for name in missing:
+                build_process(name, process_keys[name], prelude, processes[name])
 
     with tempfile.TemporaryDirectory() as tmpdir:
+        for name in processes.keys() if seed_processes else []:
+            shutil.unpack_archive(process_artifact(process_keys[name]), tmpdir)
         with open(os.path.join(tmpdir, "input.sin"), "w") as sindarin:
-            sindarin.write(input_string)
-        os.chdir(tmpdir)
+            sindarin.write(render_template(template_path, {"scale": 1.0, "seed": 1, "generate_events": False}))
         execute_alt_screen(
             f"Generating libraries for {template_path}",
             [f"{get_install_info()['prefix']}/bin/whizard --single-event input.sin"],
             logfile=os.path.join(get_src_location(), "vbf_hh_heft.log"),
             env=setup_env(),
+            cwd=tmpdir,
         )
-        with tarfile.open(os.path.join(get_src_location(), "Libraries", template_name + ".tar.gz"), "w:gz") as archive:
-            archive.add(re.findall(r'\$compile_workspace = "(.+)"', input_string)[0])
-            for process in re.findall(r"process\s+(\S+)(?=\s)\s*=", input_string):
+
+        def add_files(archive):
+            workspace = template_info["compile_workspace"]
+            archive.add(os.path.join(tmpdir, workspace), arcname=workspace)
+            for process in template_info["process_names"]:
                 for type in ["BORN", "REAL", "LOOP", "DGLAP", "SUB"]:
-                    if os.path.exists(f"{process}_{type}_olp_modules/build/libgolem_olp.so"):
-                        archive.add(f"{process}_{type}_olp_modules/build/libgolem_olp.so")
-            for file in glob.glob("*.ol?"):
-                archive.add(file)
-    os.chdir(get_src_location())
-    info(f"Finished generating libraries for template '{template_path}'")
+                    olp_library = f"{process}_{type}_olp_modules/build/libgolem_olp.so"
+                    if os.path.exists(os.path.join(tmpdir, olp_library)):
+                        archive.add(os.path.join(tmpdir, olp_library), arcname=olp_library)
+            for file in glob.glob(os.path.join(tmpdir, "*.ol?")):
+                archive.add(file, arcname=os.path.basename(file))
+
+        archive_atomic(library_archive, add_files)
+
+
+def read_library_info(path):
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def generate_libraries(template_path, jobs=1, seed_processes=False):
+    template_name = os.path.splitext(pathlib.Path(template_path).name)[0]
+    library_dir = os.path.join(get_src_location(), "Libraries")
+    library_path = os.path.join(library_dir, f"{template_name}.tar.gz")
+    info_path = os.path.join(library_dir, f"{template_name}.json")
+    prelude, processes, process_keys, library_key = library_layout(template_path)
+    with file_lock(os.path.join(library_dir, template_name)):
+        library_info = read_library_info(info_path)
+        if os.path.isfile(library_path):
+            if library_info is None:
+                warning(
+                    f"Found library archive '{template_name}.tar.gz' without a cache key, it cannot be checked against "
+                    "the current template and toolchain and is rebuilt"
+                )
+            elif library_info["key"] == library_key and (seed_processes or not library_info.get("seeded", False)):
+                return
+            elif library_info["key"] == library_key:
+                info(f"Process library for template '{template_name}' was built from seeded processes, rebuilding it")
+            else:
+                changed = [name for name, key in process_keys.items() if library_info["processes"].get(name) != key]
+                info(
+                    f"Process library for template '{template_name}' is outdated, changed processes: {', '.join(changed)}"
+                )
+        cached_name = f"{library_key}_seeded.tar.gz" if seed_processes else f"{library_key}.tar.gz"
+        cached_library = os.path.join(get_library_cache_dir(), cached_name)
+        if os.path.isfile(cached_library):
+            info(f"Restoring the cached process library for template '{template_path}'")
+        else:
+            info(f"Generating libraries for template '{template_path}'")
+            build_library(template_path, prelude, processes, process_keys, cached_library, jobs, seed_processes)
+            info(f"Finished generating libraries for template '{template_path}'")
+        fd, tmp_path = tempfile.mkstemp(dir=library_dir, prefix=f".{template_name}.tar.gz.")
+        os.close(fd)
+        shutil.copy2(cached_library, tmp_path)
+        os.replace(tmp_path, library_path)
+        atomic_write_json(info_path, {"key": library_key, "processes": process_keys, "seeded": seed_processes})
 
 
 def gen_libs(args):
     for template in args.templates:
-        generate_libraries(os.path.join(get_src_location(), "Templates", template))
+        generate_libraries(os.path.join(get_src_location(), "Templates", template), args.jobs, args.seed_processes)
@@ -0,0 +1,194 @@
+import os
+import json
+import re
+import shutil
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+from logging import info, warning
+
+from vbf_hh_heft.util import get_src_location
+from vbf_hh_heft.db import file_lock
+
+schema = """
+CREATE TABLE IF NOT EXISTS grids (
+    hash TEXT PRIMARY KEY,
+    template TEXT NOT NULL,
+    parameters TEXT NOT NULL,
+    seed INTEGER,
+    xsec REAL,
+    error REAL,
+    components TEXT NOT NULL,
+    key TEXT
+);
+CREATE INDEX IF NOT EXISTS grids_template ON grids (template);
+"""
+
+
+def get_grid_dir():
+    return os.path.join(get_src_location(), "Grids")
+
+
+def get_grid_path(conf_hash):
+    return os.path.join(get_grid_dir(), conf_hash)
+
+
+def read_components(grid_path):
+    components = []
+    for root, _, files in os.walk(grid_path):
+        for file in sorted(files):
+            if file.endswith(".vg2"):
+                with open(os.path.join(root, file)) as gridfile:
+                    components.append(parse_vg2(file, gridfile.read()))
+    return components
+
+
+def parse_vg2(name, grid_string):
+    return {
+        "name": name.split(".")[0],
+        "file": name,
+        "xsec": float(re.search(r"Integral\s*=\s*([\d.+-E]+)", grid_string).group(1)),
+        "error": float(re.search(r"Error\s*=\s*([\d.+-E]+)", grid_string).group(1)),
+    }
+
+
+def row_to_dict(row):
+    return {
+        "hash": row[0],
+        "template": row[1],
+        "parameters": json.loads(row[2]),
+        "seed": row[3],
+        "xsec": row[4],
+        "error": row[5],
+        "components": json.loads(row[6]),
+        "key": row[7],
+    }
+
+
+def insert_grid(connection, conf_hash, template_name, param_dict, seed, components, key=None):
+    connection.execute(
+        "INSERT OR REPLACE INTO grids (hash, template, parameters, seed, xsec, error, components, key) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            conf_hash,
+            template_name,
+            json.dumps(param_dict),
+            seed,
+            sum(component["xsec"] for component in components),
+            sum(component["error"] ** 2 for component in components) ** 0.5,
+            json.dumps(components),
+            key,
+        ),
+    )
+
+
+def migrate_schema(connection):
+    # indices written before grids recorded the key of the template and process library they were integrated with
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(grids)")]
+    if "key" not in columns:
+        try:
+            connection.execute("ALTER TABLE grids ADD COLUMN key TEXT")
+        except sqlite3.OperationalError as error:
+            # readers only hold a shared lock, another one may have migrated the index in the meantime
+            if "duplicate column" not in str(error):
+                raise
+
+
+def migrate_legacy_db(connection):
+    legacy_db = os.path.join(get_grid_dir(), "grid_db.json")
+    with open(legacy_db) as db_file:
+        grid_db = json.load(db_file)
+    info(f"Migrating {len(grid_db)} grids from 'grid_db.json' to the grid index...")
+    for conf_hash, entry in grid_db.items():
+        archive = os.path.join(get_grid_dir(), f"{conf_hash}.tar.gz")
+        if not os.path.isfile(archive):
+            warning(f"Grid archive '{conf_hash}.tar.gz' listed in 'grid_db.json' does not exist, skipping")
+            continue
+        staging = tempfile.mkdtemp(dir=get_grid_dir())
+        shutil.unpack_archive(archive, staging)
+        if os.path.isdir(get_grid_path(conf_hash)):
+            shutil.rmtree(get_grid_path(conf_hash))
+        os.replace(staging, get_grid_path(conf_hash))
+        insert_grid(
+            connection,
+            conf_hash,
+            entry["template"],
+            entry["parameters"],
+            entry["seed"],
+            read_components(get_grid_path(conf_hash)),
+        )
+        os.remove(archive)
+    os.rename(legacy_db, legacy_db + ".migrated")
+
+
+@contextmanager
+def open_index(write=False):
+    os.makedirs(get_grid_dir(), exist_ok=True)
+    index_path = os.path.join(get_grid_dir(), "grid_index.sqlite")
+    legacy_db = os.path.join(get_grid_dir(), "grid_db.json")
+    with file_lock(index_path, shared=not (write or os.path.isfile(legacy_db))):
+        connection = sqlite3.connect(index_path, timeout=60)
+        try:
+            connection.executescript(schema)
+            migrate_schema(connection)
+            if os.path.isfile(legacy_db):
+                migrate_legacy_db(connection)
+            yield connection
+            connection.commit()
+        finally:
+            connection.close()
+
+
+def store_grid(conf_hash, template_name, param_dict, seed, workdir, workspace, passes=None, key=None):
+    os.makedirs(get_grid_dir(), exist_ok=True)
+    staging = tempfile.mkdtemp(dir=get_grid_dir())
+    shutil.copytree(os.path.join(workdir, workspace), os.path.join(staging, workspace))
+    components = read_components(staging)
+    if passes is not None:
+        for component in components:
+            if component["name"] in passes.keys():
+                component["iterations"] = passes[component["name"]]
+    with open_index(write=True) as connection:
+        if os.path.isdir(get_grid_path(conf_hash)):
+            shutil.rmtree(get_grid_path(conf_hash))
+        os.replace(staging, get_grid_path(conf_hash))
+        insert_grid(connection, conf_hash, template_name, param_dict, seed, components, key)
+    return components
+
+
+def restore_grid(conf_hash, dest):
+    shutil.copytree(get_grid_path(conf_hash), dest, dirs_exist_ok=True)
+
+
+def lookup_grids(conf_hashes):
+    grids = {}
+    conf_hashes = list(conf_hashes)
+    with open_index() as connection:
+        for i in range(0, len(conf_hashes), 500):
+            chunk = conf_hashes[i : i + 500]
+            for row in connection.execute(
+                f"SELECT * FROM grids WHERE hash IN ({', '.join('?' * len(chunk))})", chunk
+            ):
+                grids[row[0]] = row_to_dict(row)
+    return grids
+
+
+def lookup_grid(conf_hash):
+    grids = lookup_grids([conf_hash])
+    return grids[conf_hash] if conf_hash in grids else None
+
+
+def template_grids(template_name, key=None):
+    with open_index() as connection:
+        if key is not None:
+            rows = connection.execute("SELECT * FROM grids WHERE template = ? AND key = ?", (template_name, key))
+        else:
+            rows = connection.execute("SELECT * FROM grids WHERE template = ?", (template_name,))
+        return [row_to_dict(row) for row in rows]
+
+
+def remove_grid(conf_hash):
+    with open_index(write=True) as connection:
+        connection.execute("DELETE FROM grids WHERE hash = ?", (conf_hash,))
+    if os.path.isdir(get_grid_path(conf_hash)):
+        shutil.rmtree(get_grid_path(conf_hash))
@@ -0,0 +1,154 @@
+import re
+
+import numpy as np
+
+chunk_size = 1 << 24
+
+cross_section_pattern = re.compile(rb"^A\s+\d+\s+GenCrossSection\s+(\S+)\s+(\S+)", re.M)
+unit_pattern = re.compile(rb"^U\s+(\S+)", re.M)
+
+
+class EventBatch:
+    def __init__(self, weights, event, pid, status, momenta):
+        self.weights = weights
+        self.event = event
+        self.pid = pid
+        self.status = status
+        self.momenta = momenta
+
+    def __len__(self):
+        return len(self.weights)
+
+    def padded(self, selection):
+        event = self.event[selection]
+        momenta = self.momenta[selection]
+        counts = np.bincount(event, minlength=len(self))
+        width = int(counts.max(initial=0))
+        offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        position = np.arange(len(event)) - offsets[event]
+        padded = np.zeros((len(self), width, 4))
+        mask = np.zeros((len(self), width), dtype=bool)
+        padded[event, position] = momenta
+        mask[event, position] = True
+        return padded, mask
+
+
+def line_table(buffer):
+    data = np.frombuffer(b"\n" + buffer, dtype=np.uint8)
+    newlines = np.flatnonzero(data == 10)
+    line_of_byte = np.cumsum(data == 10, dtype=np.int64) - 1
+    starts = newlines + 1
+    first = np.zeros(len(starts), dtype=np.uint8)
+    first[starts < len(data)] = data[starts[starts < len(data)]]
+    return data, line_of_byte, first
+
+
+def select_lines(data, line_of_byte, lines):
+    return data[lines[line_of_byte]].tobytes()
+
+
+def parse_events(buffer, units=1.0):
+    data, line_of_byte, first = line_table(buffer)
+    is_event = first == ord("E")
+    event_of_line = np.cumsum(is_event) - 1
+    n_events = int(is_event.sum())
+
+    is_particle = (first == ord("P")) & (event_of_line >= 0)
+    values = np.fromstring(select_lines(data, line_of_byte, is_particle).replace(b"P", b" "), sep=" ")
+    particles = values.reshape(-1, 9)
+
+    weights = np.ones(n_events)
+    is_weight = (first == ord("W")) & (event_of_line >= 0)
+    n_weight_lines = int(is_weight.sum())
+    if n_weight_lines > 0:
+        weight_text = select_lines(data, line_of_byte, is_weight).replace(b"W", b" ")
+        weight_values = np.fromstring(weight_text, sep=" ")
+        if len(weight_values) % n_weight_lines == 0:
+            weight_values = weight_values.reshape(n_weight_lines, -1)[:, 0]
+        else:
+            weight_values = np.array([float(line.split()[0]) for line in weight_text.splitlines()[1:]])
+        weights[event_of_line[is_weight]] = weight_values
+
+    return EventBatch(
+        weights,
+        event_of_line[is_particle],
+        particles[:, 2].astype(np.int64),
+        particles[:, 8].astype(np.int64),
+        particles[:, 3:7] * units,
+    )
+
+
+class HepMCReader:
+    def __init__(self):
+        self.buffer = b""
+        self.units = None
+        self.cross_section = None
+        self.events = 0
+
+    def scan_metadata(self, buffer):
+        if self.units is None:
+            match = unit_pattern.search(buffer)
+            if match:
+                self.units = 1e-3 if match.group(1).upper() == b"MEV" else 1.0
+        matches = cross_section_pattern.findall(buffer)
+        if matches:
+            self.cross_section = (float(matches[-1][0]), float(matches[-1][1]))
+
+    def parse(self, buffer):
+        self.scan_metadata(buffer)
+        batch = parse_events(buffer, 1.0 if self.units is None else self.units)
+        self.events += len(batch)
+        return batch
+
+    def feed(self, chunk):
+        self.buffer += chunk
+        boundary = self.buffer.rfind(b"\nE ")
+        if boundary < 0:
+            return None
+        complete, self.buffer = self.buffer[: boundary + 1], self.buffer[boundary + 1 :]
+        if complete.find(b"\nE ") < 0 and not complete.startswith(b"E "):
+            return None
+        return self.parse(complete)
+
+    def finish(self):
+        buffer, self.buffer = self.buffer, b""
+        if buffer.find(b"\nE ") < 0 and not buffer.startswith(b"E "):
+            return None
+        return self.parse(buffer)
+
+
+def read_batches(file):
+    reader = HepMCReader()
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        batch = reader.feed(chunk)
+        if batch is not None:
+            yield reader, batch
+    batch = reader.finish()
+    if batch is not None:
+        yield reader, batch
+
+
+def transverse_momentum(momenta):
+    return np.hypot(momenta[..., 0], momenta[..., 1])
+
+
+def azimuth(momenta):
+    return np.mod(np.arctan2(momenta[..., 1], momenta[..., 0]), 2 * np.pi)
+
+
+def pseudorapidity(momenta):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.arcsinh(momenta[..., 2] / transverse_momentum(momenta))
+
+
+def rapidity(momenta):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return 0.5 * np.log((momenta[..., 3] + momenta[..., 2]) / (momenta[..., 3] - momenta[..., 2]))
+
+
+def mass(momenta):
+    m2 = momenta[..., 3] ** 2 - np.sum(momenta[..., :3] ** 2, axis=-1)
+    return np.sign(m2) * np.sqrt(np.abs(m2))
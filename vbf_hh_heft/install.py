@@ -1,316 +1,248 @@
 from logging import info, critical
-from urllib.request import urlopen, Request
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import os
-from functools import partial
 import shutil
 import sys
 import json
-from rich.progress import (
-    BarColumn,
-    DownloadColumn,
-    Progress,
-    TextColumn,
-    TimeRemainingColumn,
-    TransferSpeedColumn,
-)
+import time
+
+from rich.progress import Progress
 
 
 from vbf_hh_heft.check_dependencies import check_dependencies, print_dep_table
 from vbf_hh_heft.util import execute_alt_screen
+from vbf_hh_heft.downloads import download_archives
+from vbf_hh_heft.toolchain_cache import toolchain_key, store_toolchain, restore_toolchain
+from vbf_hh_heft.packages import package_data
 
-package_data = {
-    "lhapdf": {
-        "url": "https://lhapdf.hepforge.org/downloads/LHAPDF-6.5.5.tar.gz",
-        "dirname": "LHAPDF-6.5.5",
-        "pdf_urls": [
-            "https://lhapdfsets.web.cern.ch/lhapdfsets/current/PDF4LHC21_mc.tar.gz",
-            "https://lhapdfsets.web.cern.ch/lhapdfsets/current/CT10.tar.gz",
-            "https://lhapdfsets.web.cern.ch/lhapdfsets/current/cteq6l1.tar.gz",
-        ],
-        "configure": "./configure --prefix={prefix}",
-        "install": "make install -j {jobs}",
-    },
-    "hepmc": {
-        "url": "https://hepmc.web.cern.ch/hepmc/releases/HepMC3-3.3.0.tar.gz",
-        "dirname": "HepMC3-3.3.0",
-        "configure": "cmake -DCMAKE_INSTALL_PREFIX={prefix} -DHEPMC3_ENABLE_ROOTIO=OFF   -DHEPMC3_ENABLE_PYTHON=OFF CMakeLists.txt",
-        "build": "cmake --build . -j {jobs}",
-        "install": "cmake --install .",
-    },
-    "fastjet": {
-        "url": "https://fastjet.fr/repo/fastjet-3.4.3.tar.gz",
-        "dirname": "fastjet-3.4.3",
-        "configure": "./configure --prefix={prefix} --enable-shared --disable-auto-ptr --enable-allcxxplugins",
-        "install": "make install -j {jobs}",
-        "contrib_url": "https://fastjet.hepforge.org/contrib/downloads/fjcontrib-1.100.tar.gz",
-        "contrib_dirname": "fjcontrib-1.100",
-        "contrib_configure": "./configure --fastjet-config={prefix}/bin/fastjet-config CXXFLAGS=-fPIC",
-        "contrib_install": "make install fragile-shared-install -j {jobs}",
-    },
-    "yoda": {
-        "url": "https://yoda.hepforge.org/downloads/YODA-2.0.2.tar.gz",
-        "dirname": "YODA-2.0.2",
-        "configure": "./configure --prefix={prefix}",
-        "install": "make install -j {jobs}",
-    },
-    "rivet": {
-        "url": "https://rivet.hepforge.org/downloads/Rivet-4.0.2.tar.gz",
-        "dirname": "Rivet-4.0.2",
-        "configure": "./configure --prefix={prefix} --with-yoda={prefix} --with-hepmc={prefix} --with-fastjet={prefix}",
-        "install": "make install -j {jobs}",
-    },
-    "gosam": {
-        "url": "https://github.com/gudrunhe/gosam/releases/download/3.0.0/GoSam-3.0.0-1c107f1.tar.gz",
-        "dirname": "GoSam-3.0.0-1c107f1",
-        "configure": "meson setup build --prefix {prefix}",
-        "build": "meson compile -C build -j {jobs}",
-        "install": "meson install -C build",
-    },
-    "whizard": {
-        "url": "https://whizard.hepforge.org/downloads/whizard-3.1.6.tar.gz",
-        "dirname": "whizard-3.1.6",
-        "configure": "../configure --prefix={prefix} "
-        + "--enable-lhapdf LHAPDF_DIR={prefix} "
-        + "--enable-hepmc --with-hepmc={prefix} "
-        + "--enable-fastjet --with-fastjet={prefix} "
-        + "--enable-gosam --with-gosam={prefix}",
-        "mpi_flags": "FC=mpifort CC=mpicc CXX=mpic++ --enable-fc-mpi",
-        "install": "make install -j {jobs}",
-    },
-}
 
 src_dir = os.getcwd()
+cache_dir = os.path.join(src_dir, "download_cache")
 
 
-def download_archive(url):
-    info(f"Downloading {url}...")
-    with Progress(
-        TextColumn("[bold blue]{task.fields[filename]}", justify="right"),
-        BarColumn(bar_width=None),
-        "[progress.percentage]{task.percentage:>3.1f}%",
-        "•",
-        DownloadColumn(),
-        "•",
-        TransferSpeedColumn(),
-        "•",
-        TimeRemainingColumn(),
-        transient=True,
-    ) as progress:
-        filename = url.split("/")[-1]
-        task_id = progress.add_task("download", filename=filename, start=False)
-        response = urlopen(Request(url, headers={"User-Agent": "vbf_hh_heft", "Accept": "*/*"}))
-        if response.info()["Content-length"]:
-            progress.update(task_id, total=int(response.info()["Content-length"]))
-        else:
-            progress.update(task_id, total=None)
-        with open(filename, "wb") as dest_file:
-            progress.start_task(task_id)
-            for data in iter(partial(response.read, 32768), b""):
-                dest_file.write(data)
-                progress.update(task_id, advance=len(data))
+def package_urls(name):
+    data = package_data[name]
+    urls = [data[key] for key in ["url", "contrib_url"] if key in data.keys()]
+    return urls + (data["pdf_urls"] if "pdf_urls" in data.keys() else [])
+
+
+def archive_pins():
+    return {filename: digest for data in package_data.values() for filename, digest in data["sha256"].items()}
+
+
+def fetch_archives(args, urls, mirror=None):
+    download_archives(urls, cache_dir, archive_pins(), mirror, allow_unpinned=args.allow_unpinned)
 
 
-def download_unpack(url, dest_dir, dirname):
-    filename = url.split("/")[-1]
+def prefetch_archives(args):
+    urls = [
+        url
+        for name, data in package_data.items()
+        if not os.path.isfile(os.path.join(args.prefix, data["check"]))
+        for url in package_urls(name)
+    ]
+    fetch_archives(args, urls, args.mirror)
+
+
+def download_unpack(args, url, dest_dir, dirname):
+    filename = os.path.join(cache_dir, url.split("/")[-1])
     if not os.path.isdir(os.path.join(dest_dir, dirname)):
         if not os.path.isfile(filename):
-            download_archive(url)
+            fetch_archives(args, [url])
         else:
-            info(f"Using existing '{filename}'")
+            info(f"Using existing '{os.path.basename(filename)}'")
         shutil.unpack_archive(filename, extract_dir=dest_dir, format="gztar")
     else:
         info(f"Using existing '{dirname}'")
+    return os.path.join(dest_dir, dirname)
 
 
-def install_lhapdf(args):
-    if os.path.isfile(os.path.join(args.prefix, "bin/lhapdf-config")):
-        info(f"[1/{len(package_data)}] LHAPDF already installed in {args.prefix}, skipping")
-        return
-    info(f"[1/{len(package_data)}] Installing LHAPDF...")
-    os.chdir("download_cache")
-    download_unpack(package_data["lhapdf"]["url"], ".", package_data["lhapdf"]["dirname"])
-    os.chdir(package_data["lhapdf"]["dirname"])
+def run_steps(name, description, commands, cwd, screen):
     execute_alt_screen(
+        description, commands, logfile=os.path.join(src_dir, f"install_{name}.log"), cwd=cwd, screen=screen
+    )
+
+
+def install_lhapdf(args, jobs, screen):
+    data = package_data["lhapdf"]
+    source = download_unpack(args, data["url"], cache_dir, data["dirname"])
+    run_steps(
+        "lhapdf",
         "Installing LHAPDF...",
-        [
-            package_data["lhapdf"]["configure"].format(prefix=args.prefix),
-            package_data["lhapdf"]["install"].format(jobs=args.jobs),
-        ],
-        logfile=os.path.join(src_dir, "install.log"),
+        [data["configure"].format(prefix=args.prefix), data["install"].format(jobs=jobs)],
+        source,
+        screen,
     )
-    os.chdir("..")
-    for pdf_url in package_data["lhapdf"]["pdf_urls"]:
+    for pdf_url in data["pdf_urls"]:
         pdf = pdf_url.split("/")[-1].split(".")[0]
-        info(f"[1/{len(package_data)}] Installing default PDF '{pdf}'...")
-        download_unpack(pdf_url, os.path.join(args.prefix, f"share/LHAPDF"), pdf)
-    os.chdir("..")
-    if not os.path.isfile(os.path.join(args.prefix, "bin/lhapdf-config")):
-        critical("An error occurred while installing LHAPDF, see 'install.log' for details")
-        sys.exit(1)
-    else:
-        info(f"[1/{len(package_data)}] Successfully installed LHAPDF and the required PDFs")
+        info(f"Installing default PDF '{pdf}'...")
+        download_unpack(args, pdf_url, os.path.join(args.prefix, f"share/LHAPDF"), pdf)
 
 
-def install_hepmc(args):
-    if os.path.isfile(os.path.join(args.prefix, "bin/HepMC3-config")):
-        info(f"[2/{len(package_data)}] HepMC already installed in {args.prefix}, skipping")
-        return
-    info(f"[2/{len(package_data)}] Installing HepMC...")
-    os.chdir("download_cache")
-    download_unpack(package_data["hepmc"]["url"], ".", package_data["hepmc"]["dirname"])
-    os.chdir(package_data["hepmc"]["dirname"])
-    execute_alt_screen(
+def install_hepmc(args, jobs, screen):
+    data = package_data["hepmc"]
+    source = download_unpack(args, data["url"], cache_dir, data["dirname"])
+    run_steps(
+        "hepmc",
         "Installing HepMC...",
-        [
-            package_data["hepmc"]["configure"].format(prefix=args.prefix),
-            package_data["hepmc"]["build"].format(jobs=args.jobs),
-            package_data["hepmc"]["install"],
-        ],
-        logfile=os.path.join(src_dir, "install.log"),
+        [data["configure"].format(prefix=args.prefix), data["build"].format(jobs=jobs), data["install"]],
+        source,
+        screen,
     )
-    os.chdir("../..")
-    if not os.path.isfile(os.path.join(args.prefix, "bin/HepMC3-config")):
-        critical("An error occurred while installing HepMC, see 'install.log' for details")
-        sys.exit(1)
-    else:
-        info(f"[2/{len(package_data)}] Successfully installed HepMC")
 
 
-def install_fastjet(args):
-    if os.path.isfile(os.path.join(args.prefix, "bin/fastjet-config")):
-        info(f"[3/{len(package_data)}] FastJet already installed in {args.prefix}, skipping")
-        return
-    info(f"[3/{len(package_data)}] Installing FastJet...")
-    os.chdir("download_cache")
-    download_unpack(package_data["fastjet"]["url"], ".", package_data["fastjet"]["dirname"])
-    os.chdir(package_data["fastjet"]["dirname"])
-    execute_alt_screen(
+def install_fastjet(args, jobs, screen):
+    data = package_data["fastjet"]
+    source = download_unpack(args, data["url"], cache_dir, data["dirname"])
+    run_steps(
+        "fastjet",
         "Installing FastJet...",
-        [
-            package_data["fastjet"]["configure"].format(prefix=args.prefix),
-            package_data["fastjet"]["install"].format(jobs=args.jobs),
-        ],
-        logfile=os.path.join(src_dir, "install.log"),
+        [data["configure"].format(prefix=args.prefix), data["install"].format(jobs=jobs)],
+        source,
+        screen,
     )
-    os.chdir("..")
-    download_unpack(package_data["fastjet"]["contrib_url"], ".", package_data["fastjet"]["contrib_dirname"])
-    os.chdir(package_data["fastjet"]["contrib_dirname"])
-    execute_alt_screen(
+    source = download_unpack(args, data["contrib_url"], cache_dir, data["contrib_dirname"])
+    run_steps(
+        "fastjet",
         "Installing FastJet contrib...",
-        [
-            package_data["fastjet"]["contrib_configure"].format(prefix=args.prefix),
-            package_data["fastjet"]["contrib_install"].format(jobs=args.jobs),
-        ],
-        logfile=os.path.join(src_dir, "install.log"),
+        [data["contrib_configure"].format(prefix=args.prefix), data["contrib_install"].format(jobs=jobs)],
+        source,
+        screen,
     )
-    os.chdir("../..")
-    if not os.path.isfile(os.path.join(args.prefix, "bin/fastjet-config")):
-        critical("An error occurred while installing FastJet, see 'install.log' for details")
-        sys.exit(1)
-    else:
-        info(f"[3/{len(package_data)}] Successfully installed FastJet")
 
 
-def install_yoda(args):
-    if os.path.isfile(os.path.join(args.prefix, "bin/yoda-config")):
-        info(f"[4/{len(package_data)}] Yoda already installed in {args.prefix}, skipping")
-        return
-    info(f"[4/{len(package_data)}] Installing Yoda...")
-    os.chdir("download_cache")
-    download_unpack(package_data["yoda"]["url"], ".", package_data["yoda"]["dirname"])
-    os.chdir(package_data["yoda"]["dirname"])
-    execute_alt_screen(
+def install_yoda(args, jobs, screen):
+    data = package_data["yoda"]
+    source = download_unpack(args, data["url"], cache_dir, data["dirname"])
+    run_steps(
+        "yoda",
         "Installing Yoda...",
-        [
-            package_data["yoda"]["configure"].format(prefix=args.prefix),
-            package_data["yoda"]["install"].format(jobs=args.jobs),
-        ],
-        logfile=os.path.join(src_dir, "install.log"),
+        [data["configure"].format(prefix=args.prefix), data["install"].format(jobs=jobs)],
+        source,
+        screen,
     )
-    os.chdir("../..")
-    if not os.path.isfile(os.path.join(args.prefix, "bin/yoda-config")):
-        critical("An error occurred while installing Yoda, see 'install.log' for details")
-        sys.exit(1)
-    else:
-        info(f"[4/{len(package_data)}] Successfully installed Yoda")
 
 
-def install_rivet(args):
-    if os.path.isfile(os.path.join(args.prefix, "bin/rivet-config")):
-        info(f"[5/{len(package_data)}] Rivet already installed in {args.prefix}, skipping")
-        return
-    info(f"[5/{len(package_data)}] Installing Rivet...")
-    os.chdir("download_cache")
-    download_unpack(package_data["rivet"]["url"], ".", package_data["rivet"]["dirname"])
-    os.chdir(package_data["rivet"]["dirname"])
-    execute_alt_screen(
+def install_rivet(args, jobs, screen):
+    data = package_data["rivet"]
+    source = download_unpack(args, data["url"], cache_dir, data["dirname"])
+    run_steps(
+        "rivet",
         "Installing Rivet...",
-        [
-            package_data["rivet"]["configure"].format(prefix=args.prefix),
-            package_data["rivet"]["install"].format(jobs=args.jobs),
-        ],
-        logfile=os.path.join(src_dir, "install.log"),
+        [data["configure"].format(prefix=args.prefix), data["install"].format(jobs=jobs)],
+        source,
+        screen,
     )
-    if os.path.isfile("rivetenv.sh"):
-        shutil.copy2("rivetenv.sh", os.path.join(args.prefix, "share", "Rivet"))
-    os.chdir("../..")
-    if not os.path.isfile(os.path.join(args.prefix, "bin/rivet-config")):
-        critical("An error occurred while installing Rivet, see 'install.log' for details")
-        sys.exit(1)
-    else:
-        info(f"[5/{len(package_data)}] Successfully installed Rivet")
+    if os.path.isfile(os.path.join(source, "rivetenv.sh")):
+        shutil.copy2(os.path.join(source, "rivetenv.sh"), os.path.join(args.prefix, "share", "Rivet"))
 
 
-def install_gosam(args):
-    if os.path.isfile(os.path.join(args.prefix, "bin/gosam.py")):
-        info(f"[6/{len(package_data)}] GoSam already installed in {args.prefix}, skipping")
-        return
-    info(f"[6/{len(package_data)}] Installing GoSam...")
-    os.chdir("download_cache")
-    download_unpack(package_data["gosam"]["url"], ".", package_data["gosam"]["dirname"])
-    os.chdir(package_data["gosam"]["dirname"])
-    execute_alt_screen(
+def install_gosam(args, jobs, screen):
+    data = package_data["gosam"]
+    source = download_unpack(args, data["url"], cache_dir, data["dirname"])
+    run_steps(
+        "gosam",
         "Installing GoSam...",
-        [
-            package_data["gosam"]["configure"].format(prefix=args.prefix),
-            package_data["gosam"]["install"].format(jobs=args.jobs),
-        ],
-        logfile=os.path.join(src_dir, "install.log"),
+        [data["configure"].format(prefix=args.prefix), data["build"].format(jobs=jobs), data["install"]],
+        source,
+        screen,
     )
-    os.chdir("../..")
-    if not os.path.isfile(os.path.join(args.prefix, "bin/GoSam/gosam.py")):
-        critical("An error occurred while installing GoSam, see 'install.log' for details")
-        sys.exit(1)
-    else:
-        info(f"[6/{len(package_data)}] Successfully installed GoSam")
-
-
-def install_whizard(args):
-    if os.path.isfile(os.path.join(args.prefix, "bin/whizard-config")):
-        info(f"[7/{len(package_data)}] Whizard already installed in {args.prefix}, skipping")
-        return
-    info(f"[7/{len(package_data)}] Installing Whizard...")
-    os.chdir("download_cache")
-    download_unpack(package_data["whizard"]["url"], ".", package_data["whizard"]["dirname"])
-    os.chdir(package_data["whizard"]["dirname"])
-    if not os.path.isdir("build"):
-        os.mkdir("build")
-    os.chdir("build")
-    execute_alt_screen(
+
+
+def install_whizard(args, jobs, screen):
+    data = package_data["whizard"]
+    source = download_unpack(args, data["url"], cache_dir, data["dirname"])
+    os.makedirs(os.path.join(source, "build"), exist_ok=True)
+    run_steps(
+        "whizard",
         "Installing Whizard...",
         [
-            package_data["whizard"]["configure"].format(prefix=args.prefix)
-            + (" " + package_data["whizard"]["mpi_flags"] if args.mpi else ""),
-            package_data["whizard"]["install"].format(jobs=args.jobs),
+            data["configure"].format(prefix=args.prefix) + (" " + data["mpi_flags"] if args.mpi else ""),
+            data["install"].format(jobs=jobs),
         ],
-        logfile=os.path.join(src_dir, "install.log"),
+        os.path.join(source, "build"),
+        screen,
     )
-    os.chdir("../../..")
-    if not os.path.isfile(os.path.join(args.prefix, "bin/whizard-config")):
-        critical("An error occurred while installing Whizard, see 'install.log' for details")
+
+
+installers = {
+    "lhapdf": install_lhapdf,
+    "hepmc": install_hepmc,
+    "fastjet": install_fastjet,
+    "yoda": install_yoda,
+    "rivet": install_rivet,
+    "gosam": install_gosam,
+    "whizard": install_whizard,
+}
+
+
+def install_package(name, args, jobs, screen=False):
+    title = package_data[name]["title"]
+    if os.path.isfile(os.path.join(args.prefix, package_data[name]["check"])):
+        info(f"{title} already installed in {args.prefix}, skipping")
+        return 0.0
+    info(f"Installing {title} with {jobs} jobs...")
+    start = time.perf_counter()
+    installers[name](args, jobs, screen)
+    if not os.path.isfile(os.path.join(args.prefix, package_data[name]["check"])):
+        critical(f"An error occurred while installing {title}, see 'install_{name}.log' for details")
         sys.exit(1)
-    else:
-        info(f"[7/{len(package_data)}] Successfully installed Whizard")
+    wall_time = time.perf_counter() - start
+    info(f"Successfully installed {title} in {wall_time:.0f} s")
+    return wall_time
+
+
+def critical_path(wall_times):
+    finish = {}
+    previous = {}
+    for name in package_data.keys():
+        depends = package_data[name]["depends"]
+        previous[name] = max(depends, key=lambda dependency: finish[dependency], default=None)
+        finish[name] = wall_times[name] + (finish[previous[name]] if previous[name] is not None else 0.0)
+    name = max(finish, key=finish.get)
+    path = []
+    while name is not None:
+        path.append(name)
+        name = previous[name]
+    return path[::-1], finish[path[0]]
+
+
+def install_packages(args):
+    waiting = {name: set(data["depends"]) for name, data in package_data.items()}
+    running = {}
+    wall_times = {}
+    free_jobs = args.jobs
+    with Progress(transient=True) as progress, ThreadPoolExecutor(max_workers=len(package_data)) as executor:
+        task = progress.add_task("[green]Installing toolchain", total=len(package_data))
+        while len(waiting) > 0 or len(running) > 0:
+            ready = [name for name, depends in waiting.items() if len(depends) == 0]
+            for i, name in enumerate(ready):
+                if free_jobs < 1 and len(running) > 0:
+                    break
+                # split the free cores evenly among the packages that can start now, cores of finished packages
+                # go to the ones that become ready later
+                jobs = max(1, free_jobs // (len(ready) - i))
+                free_jobs -= jobs
+                del waiting[name]
+                running[executor.submit(install_package, name, args, jobs)] = (name, jobs)
+            progress.update(
+                task,
+                description=f"[green]Installing {', '.join(package_data[name]['title'] for name, _ in running.values())}",
+            )
+            done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+            for future in done:
+                name, jobs = running.pop(future)
+                try:
+                    wall_times[name] = future.result()
+                except BaseException:
+                    for pending in running.keys():
+                        pending.cancel()
+                    raise
+                free_jobs += jobs
+                for depends in waiting.values():
+                    depends.discard(name)
+                progress.update(task, advance=1)
+    return wall_times
 
 
 def install(args):
@@ -321,18 +253,31 @@ def install(args):
         critical(f"Build requirements not satisfied")
         sys.exit(1)
     info(f"Installing VBF_HH_HEFT toolchain to {args.prefix}")
-    if not os.path.isdir("download_cache"):
-        os.mkdir("download_cache")
-    install_lhapdf(args)
-    install_hepmc(args)
-    install_fastjet(args)
-    install_yoda(args)
-    install_rivet(args)
-    install_gosam(args)
-    install_whizard(args)
-    if os.path.isfile("install.log"):
-        os.remove("install.log")
+    installed = all(os.path.isfile(os.path.join(args.prefix, data["check"])) for data in package_data.values())
+    if args.toolchain_cache:
+        key = toolchain_key(package_data, dep_results, args.mpi)
+        if not installed and restore_toolchain(args.toolchain_cache, key, args.prefix):
+            write_install_info(args)
+            info(f"Successfully installed the prebuilt VBF_HH_HEFT toolchain to {args.prefix}")
+            return
+    prefetch_archives(args)
+    wall_times = install_packages(args)
+    for name in package_data.keys():
+        if os.path.isfile(os.path.join(src_dir, f"install_{name}.log")):
+            os.remove(os.path.join(src_dir, f"install_{name}.log"))
+    if any(wall_time > 0 for wall_time in wall_times.values()):
+        info("Wall time per package:")
+        for name in package_data.keys():
+            info(f"    {package_data[name]['title']:<10} {wall_times[name]:>8.0f} s")
+        path, total = critical_path(wall_times)
+        info(f"Critical path: {' -> '.join(package_data[name]['title'] for name in path)} ({total:.0f} s)")
+    if args.toolchain_cache:
+        store_toolchain(args.toolchain_cache, key, args.prefix)
+    write_install_info(args)
     info(f"Successfully installed VBF_HH_HEFT toolchain to {args.prefix}")
+
+
+def write_install_info(args):
     with open("installation.json", "w") as file:
         json.dump(
             {
@@ -1,16 +1,10 @@
-import jinja2
-import tempfile
 from logging import info, warning, critical
-import json
 import os
-import hashlib
 import random
-import shutil
-import re
 import math
 import sys
 import subprocess
-import time
+from functools import partial
 
 try:
     import tomllib
@@ -21,51 +15,56 @@ except ImportError:
         critical("Python versions older than 3.11 require the 'toml' package to be installed")
         sys.exit(1)
 
-from rich.progress import Progress
-
 from vbf_hh_heft.util import (
     get_src_location,
     execute_alt_screen,
     setup_env,
     get_install_info,
-    parse_processes,
     expand_parameters,
+    split_cores,
+    run_concurrently,
+    get_conf_hash,
 )
 from vbf_hh_heft.generate_libraries import generate_libraries
+from vbf_hh_heft.templates import render_template, get_template_info
+from vbf_hh_heft.workdirs import workdir
+from vbf_hh_heft.monitor import get_stamp_dir, clear_stamps, job_stamp, wait_for_jobs, wait_options, write_stamp
+from vbf_hh_heft.grid_store import store_grid, restore_grid, lookup_grid, lookup_grids, remove_grid
+from vbf_hh_heft.planner import warm_start, component_passes, grid_key
 
 grid_mapping = {"born": 1, "real": 2, "virtual": 3, "dglap": 4}
 
 
-def run_integration(config, param_dict, template, additional_description="", force=False):
+def run_integration(config, param_dict, template, additional_description="", force=False, screen=True):
     if param_dict is None:
         param_dict = {}
     template_name = os.path.splitext(template)[0]
-    conf_hash = hashlib.sha256(
-        json.dumps({"template": template_name, "parameters": param_dict}).encode("utf-8")
-    ).hexdigest()
-    if not os.path.isdir("Grids"):
-        os.mkdir("Grids")
-    if os.path.exists(f"Grids/{conf_hash}.tar.gz") and not force:
+    conf_hash = get_conf_hash(template_name, param_dict)
+    if not force and lookup_grid(conf_hash) is not None:
         info("Grid for current configuration already exists, skipping")
         return
-    with open(os.path.join(get_src_location(), "Templates", template)) as template_file:
-        jinja_template = jinja2.Template(template_file.read())
     seed = random.randint(0, 10000000)
-    input_string = jinja_template.render(
+    input_string = render_template(
+        template,
         {
-            "model_path": os.path.join(get_src_location(), "Model"),
             "scale": param_dict["scale"] if "scale" in param_dict.keys() else 1.0,
             "seed": seed,
             "parameters": [(key, value) for key, value in param_dict.items() if key != "scale"],
             "generate_events": False,
-        }
+        },
     )
+    template_info = get_template_info(template)
+    key = grid_key(template)
+    neighbor = None
+    passes = component_passes(input_string)
+    if not force:
+        input_string, neighbor, passes = warm_start(input_string, template_name, param_dict, config, key)
 
-    with tempfile.TemporaryDirectory() as tmpdir:
+    with workdir(template_name, config) as tmpdir:
         with open(os.path.join(tmpdir, "input.sin"), "w") as sindarin:
             sindarin.write(input_string)
-        shutil.unpack_archive(os.path.join(get_src_location(), "Libraries", f"{template_name}.tar.gz"), tmpdir)
-        os.chdir(tmpdir)
+        if neighbor is not None:
+            restore_grid(neighbor["hash"], tmpdir)
         if "mpi" in config.keys() and config["mpi"]:
             if "mpi_run" in config.keys():
                 mpi_run = config["mpi_run"] + " "
@@ -76,35 +75,36 @@ def run_integration(config, param_dict, template, additional_description="", for
                 sys.exit(1)
         else:
             mpi_run = ""
+        env = setup_env()
+        if "threads" in config.keys():
+            env["OMP_NUM_THREADS"] = str(config["threads"])
+        if screen:
+            logfile = os.path.join(get_src_location(), "integration.log")
+        else:
+            logfile = os.path.join(get_src_location(), f"integration_{conf_hash[:12]}.log")
         execute_alt_screen(
             f"{additional_description}Running integration for template {template_name} with parameters {param_dict}...",
             [f"{mpi_run}{get_install_info()['prefix']}/bin/whizard input.sin"],
-            logfile=os.path.join(get_src_location(), "integration.log"),
-            env=setup_env(),
+            logfile=logfile,
+            env=env,
+            cwd=tmpdir,
+            screen=screen,
         )
-        grid = re.findall(r'\$integrate_workspace = "(.+)"', input_string)[0]
-        shutil.make_archive(os.path.join(get_src_location(), "Grids", f"{conf_hash}"), "gztar", os.getcwd(), grid)
-        try:
-            with open(os.path.join(get_src_location(), "Grids", "grid_db.json"), "r") as db_file:
-                grid_db = json.load(db_file)
-        except FileNotFoundError:
-            grid_db = {}
-        grid_db[conf_hash] = {"template": template_name, "parameters": param_dict, "seed": seed}
-        with open(os.path.join(get_src_location(), "Grids", "grid_db.json"), "w") as db_file:
-            json.dump(grid_db, db_file, indent=4)
-        processes = parse_processes(input_string)
-        for process, process_data in processes.items():
+        grid = template_info["integrate_workspace"]
+        components = {
+            component["file"]: component
+            for component in store_grid(conf_hash, template_name, param_dict, seed, tmpdir, grid, passes, key)
+        }
+        for process, process_data in template_info["processes"].items():
             xsecs = []
             errors = []
             for component, data in process_data.items():
-                with open(os.path.join(grid, f"{data['name']}.m{grid_mapping[component]}.vg2")) as gridfile:
-                    grid_string = gridfile.read()
-                    xsecs.append(float(re.search(r"Integral\s*=\s*([\d.+-E]+)", grid_string).group(1)))
-                    errors.append(float(re.search(r"Error\s*=\s*([\d.+-E]+)", grid_string).group(1)))
+                result = components[f"{data['name']}.m{grid_mapping[component]}.vg2"]
+                xsecs.append(result["xsec"])
+                errors.append(result["error"])
             uncertainty = sum(err**2 for err in errors)
             xsec = sum(xsecs)
             info(f"Total cross section for process {process}: {xsec} ± {math.sqrt(uncertainty)}")
-    os.chdir(get_src_location())
     info(f"Successfully generated the integration grid for template {template_name} with parameters {param_dict}")
 
 
@@ -120,69 +120,70 @@ def submit_jobs(args, config, param_list):
     for p in args.cmd_parameters:
         command_args += f" -P{p}"
     template_name = os.path.splitext(args.template)[0]
-    grid_dict = {}
-    ids = []
-    for i, param_dict in enumerate(param_list):
-        conf_hash = hashlib.sha256(
-            json.dumps({"template": template_name, "parameters": param_dict}).encode("utf-8")
-        ).hexdigest()
-        if not os.path.exists(os.path.join("Grids", f"{conf_hash}.tar.gz")) or args.force:
-            grid_dict[f"{conf_hash}.tar.gz"] = False
-            ids.append(i)
-            if os.path.exists(os.path.join("Grids", f"{conf_hash}.tar.gz")):
-                os.remove(os.path.join("Grids", f"{conf_hash}.tar.gz"))
+    conf_hashes = [get_conf_hash(template_name, param_dict) for param_dict in param_list]
+    existing_grids = lookup_grids(conf_hashes)
+    ids = [i for i, conf_hash in enumerate(conf_hashes) if conf_hash not in existing_grids or args.force]
+    if args.force:
+        for i in ids:
+            remove_grid(conf_hashes[i])
     if len(ids) == 0:
         info("All grids already present for the given configuration, skipping...")
         return
+    stamp_dir = get_stamp_dir("integrate", template_name)
+    clear_stamps(stamp_dir, ids)
     info(
         f"Submitting {len(ids)} integration jobs with command '{config['submit_command']} {get_src_location()}/vbf_hh_heft.py integrate --id <ID> {command_args} {args.template}'"
     )
-    for i in range(len(ids)):
-        subprocess.run(
+    for i in ids:
+        submission = subprocess.run(
             config["submit_command"].format(
                 f"{get_src_location()}/vbf_hh_heft.py integrate --id {i} {command_args} {args.template}"
             ),
             stdout=subprocess.DEVNULL,
             shell=True,
         )
-
-    with Progress(transient=True) as progress:
-        task = progress.add_task(f"[green]Waiting for {len(param_list)} jobs to complete", total=len(param_list))
-        while True:
-            for grid in grid_dict.keys():
-                if grid_dict[grid]:
-                    continue
-                else:
-                    if os.path.exists(os.path.join(get_src_location(), "Grids", grid)):
-                        grid_dict[grid] = True
-                        progress.update(task, advance=1)
-            if all(grid_exists for grid_exists in grid_dict.values()):
-                break
-            else:
-                time.sleep(0.2)
+        if submission.returncode != 0:
+            write_stamp(stamp_dir, i, f"submission failed with code {submission.returncode}")
+    wait_for_jobs(stamp_dir, ids, **wait_options(config))
 
 
 def integrate_missing(args, config, param_list):
     template_name = os.path.splitext(args.template)[0]
-    missing_points = []
-    for param_dict in param_list:
-        conf_hash = hashlib.sha256(
-            json.dumps({"template": template_name, "parameters": param_dict}).encode("utf-8")
-        ).hexdigest()
-        if not os.path.exists(os.path.join("Grids", f"{conf_hash}.tar.gz")) or args.force:
-            missing_points.append(param_dict)
+    existing_grids = lookup_grids(get_conf_hash(template_name, param_dict) for param_dict in param_list)
+    missing_points = [
+        param_dict
+        for param_dict in param_list
+        if get_conf_hash(template_name, param_dict) not in existing_grids or args.force
+    ]
+    if len(missing_points) == 0:
+        info("All grids already present for the given configuration, skipping...")
+        return
     info(f"Running integration for {len(missing_points)} parameter combinations...")
-    for i, param_dict in enumerate(param_list):
-        run_integration(
-            config, param_dict, args.template, f"[orange]\\[{i + 1}/{len(missing_points)}][/orange] ", force=args.force
+    config, jobs = split_cores(config, args.jobs)
+    if jobs > 1 and len(missing_points) > 1:
+        run_concurrently(
+            [
+                partial(run_integration, config, param_dict, args.template, force=args.force, screen=False)
+                for param_dict in missing_points
+            ],
+            jobs,
+            f"Integrating {len(missing_points)} parameter combinations with {jobs} concurrent jobs",
         )
+    else:
+        for i, param_dict in enumerate(missing_points):
+            run_integration(
+                config,
+                param_dict,
+                args.template,
+                f"[orange]\\[{i + 1}/{len(missing_points)}][/orange] ",
+                force=args.force,
+            )
     info(f"Successfully integrated {len(missing_points)} parameter combinations")
 
 
 def integrate(args):
     template_name = os.path.splitext(args.template)[0]
-    if not os.path.exists(f"Libraries/{template_name}.tar.gz"):
-        generate_libraries(os.path.join(get_src_location(), "Templates", args.template))
+    generate_libraries(os.path.join(get_src_location(), "Templates", args.template), args.jobs)
     if args.config:
         with open(args.config, "rb") as config_file:
             config = tomllib.load(config_file)
@@ -197,9 +198,10 @@ def integrate(args):
     if args.cluster:
         submit_jobs(args, config, param_list)
         return
-    if args.id:
-        info(f"Running integration for the {id}-th parameter combination...")
-        run_integration(config, param_list[args.id], args.template, force=args.force)
+    if args.id is not None:
+        info(f"Running integration for the {args.id}-th parameter combination...")
+        with job_stamp("integrate", template_name, args.id):
+            run_integration(config, param_list[args.id], args.template, force=args.force)
         return
     if len(param_list) == 1:
         run_integration(config, param_list[0], args.template, force=args.force)
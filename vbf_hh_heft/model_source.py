@@ -0,0 +1,12 @@
+import os
+import glob
+import hashlib
+
+
+def get_model_source_hash(path):
+    model_hash = hashlib.sha256()
+    for file in sorted(glob.glob(os.path.join(path, "*.py"))):
+        model_hash.update(os.path.basename(file).encode())
+        with open(file, "rb") as source:
+            model_hash.update(hashlib.sha256(source.read()).digest())
+    return model_hash.hexdigest()
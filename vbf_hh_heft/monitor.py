@@ -0,0 +1,192 @@
+import os
+import sys
+import time
+import select
+import threading
+import ctypes
+import ctypes.util
+from contextlib import contextmanager
+from logging import warning, critical
+
+from rich.progress import Progress
+
+from vbf_hh_heft.util import get_src_location
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+
+min_poll_interval = 0.2
+max_poll_interval = 30.0
+heartbeat_interval = 60.0
+default_heartbeat_timeout = 600.0
+default_queue_timeout = 2 * 24 * 3600.0
+
+
+def get_stamp_dir(kind, template_name):
+    return os.path.join(get_src_location(), "Jobs", f"{kind}_{template_name}")
+
+
+def clear_stamps(stamp_dir, ids):
+    os.makedirs(stamp_dir, exist_ok=True)
+    for job_id in ids:
+        for suffix in ("done", "failed", "alive"):
+            if os.path.exists(os.path.join(stamp_dir, f"{job_id}.{suffix}")):
+                os.remove(os.path.join(stamp_dir, f"{job_id}.{suffix}"))
+
+
+def write_stamp(stamp_dir, job_id, error=None):
+    os.makedirs(stamp_dir, exist_ok=True)
+    stamp = os.path.join(stamp_dir, f"{job_id}.{'done' if error is None else 'failed'}")
+    with open(f"{stamp}.tmp", "w") as file:
+        file.write(error if error is not None else "")
+    os.replace(f"{stamp}.tmp", stamp)
+
+
+def heartbeat(path, stop):
+    while not stop.wait(heartbeat_interval):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+
+@contextmanager
+def job_stamp(kind, template_name, job_id):
+    stamp_dir = get_stamp_dir(kind, template_name)
+    os.makedirs(stamp_dir, exist_ok=True)
+    # jobs killed by the scheduler cannot write a stamp, the monitor notices when their heartbeat stops instead
+    alive = os.path.join(stamp_dir, f"{job_id}.alive")
+    with open(alive, "w") as file:
+        file.write(os.uname().nodename)
+    stop = threading.Event()
+    threading.Thread(target=heartbeat, args=(alive, stop), daemon=True).start()
+    try:
+        yield
+    except SystemExit as e:
+        if e.code not in (0, None):
+            write_stamp(stamp_dir, job_id, f"exited with code {e.code} on host {os.uname().nodename}")
+        else:
+            write_stamp(stamp_dir, job_id)
+        raise
+    except BaseException as e:
+        write_stamp(stamp_dir, job_id, f"{type(e).__name__}: {e} on host {os.uname().nodename}")
+        raise
+    else:
+        write_stamp(stamp_dir, job_id)
+    finally:
+        stop.set()
+        if os.path.exists(alive):
+            os.remove(alive)
+
+
+def inotify_watch(path):
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            os.close(fd)
+            return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+
+def scan_stamps(stamp_dir, pending):
+    finished = {}
+    stamps = set(os.listdir(stamp_dir))
+    for job_id in pending:
+        if f"{job_id}.done" in stamps:
+            finished[job_id] = None
+        elif f"{job_id}.failed" in stamps:
+            with open(os.path.join(stamp_dir, f"{job_id}.failed")) as file:
+                finished[job_id] = file.read().strip() or "unknown error"
+    return finished
+
+
+def check_heartbeats(stamp_dir, pending, heartbeats, now, heartbeat_timeout):
+    lost = {}
+    for job_id in pending:
+        try:
+            mtime = os.stat(os.path.join(stamp_dir, f"{job_id}.alive")).st_mtime_ns
+        except FileNotFoundError:
+            continue
+        # staleness is measured on the local clock, the stamp directory may live on a file server with another clock
+        if job_id not in heartbeats or heartbeats[job_id][0] != mtime:
+            heartbeats[job_id] = (mtime, now)
+        elif now - heartbeats[job_id][1] > heartbeat_timeout:
+            lost[job_id] = f"no heartbeat for {heartbeat_timeout:.0f} s, the job was probably killed by the scheduler"
+    return lost
+
+
+def wait_options(config):
+    return {
+        "timeout": config["job_timeout"] if "job_timeout" in config.keys() else None,
+        "heartbeat_timeout": config["heartbeat_timeout"] if "heartbeat_timeout" in config.keys() else None,
+        "queue_timeout": config["queue_timeout"] if "queue_timeout" in config.keys() else None,
+    }
+
+
+def wait_for_jobs(stamp_dir, ids, timeout=None, heartbeat_timeout=None, queue_timeout=None):
+    if heartbeat_timeout is None:
+        heartbeat_timeout = default_heartbeat_timeout
+    if queue_timeout is None:
+        queue_timeout = default_queue_timeout
+    os.makedirs(stamp_dir, exist_ok=True)
+    pending = set(ids)
+    failed = {}
+    heartbeats = {}
+    poll_interval = min_poll_interval
+    start = time.monotonic()
+    fd = inotify_watch(stamp_dir)
+    try:
+        with Progress(transient=True) as progress:
+            task = progress.add_task(f"[green]Waiting for {len(pending)} jobs to complete", total=len(pending))
+            while True:
+                finished = scan_stamps(stamp_dir, pending)
+                for job_id, error in finished.items():
+                    pending.discard(job_id)
+                    if error is not None:
+                        failed[job_id] = error
+                        warning(f"Job {job_id} failed: {error}")
+                now = time.monotonic()
+                lost = check_heartbeats(stamp_dir, pending, heartbeats, now, heartbeat_timeout)
+                if now - start > queue_timeout:
+                    for job_id in pending:
+                        if job_id not in heartbeats:
+                            lost[job_id] = f"did not start within {queue_timeout:.0f} s"
+                for job_id, error in lost.items():
+                    pending.discard(job_id)
+                    failed[job_id] = error
+                    warning(f"Job {job_id} failed: {error}")
+                progress.update(task, advance=len(finished) + len(lost))
+                if len(pending) == 0:
+                    break
+                if timeout is not None and now - start > timeout:
+                    for job_id in pending:
+                        failed[job_id] = f"no result after {timeout} s"
+                    break
+                if len(finished) > 0:
+                    poll_interval = min_poll_interval
+                else:
+                    poll_interval = min(poll_interval * 1.5, max_poll_interval)
+                if fd is not None:
+                    ready, _, _ = select.select([fd], [], [], poll_interval)
+                    if ready:
+                        try:
+                            while os.read(fd, 65536):
+                                pass
+                        except BlockingIOError:
+                            pass
+                else:
+                    time.sleep(poll_interval)
+    finally:
+        if fd is not None:
+            os.close(fd)
+    if len(failed) > 0:
+        critical(
+            f"{len(failed)} of {len(ids)} jobs failed:\n"
+            + "\n".join(f"    {job_id}: {error}" for job_id, error in sorted(failed.items()))
+        )
+        sys.exit(1)
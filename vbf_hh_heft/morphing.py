@@ -0,0 +1,170 @@
+import sys
+import os
+from logging import info, warning, critical
+import json
+from functools import partial
+
+import numpy as np
+
+try:
+    import tomllib
+except ImportError:
+    try:
+        import toml as tomllib
+    except ImportError:
+        critical("Python versions older than 3.11 require the 'toml' package to be installed")
+        sys.exit(1)
+
+from vbf_hh_heft.util import (
+    expand_parameters,
+    get_src_location,
+    get_install_info,
+    guess_mpi_processes,
+    split_cores,
+    run_concurrently,
+    get_conf_hash,
+)
+from vbf_hh_heft.generate_libraries import generate_libraries
+from vbf_hh_heft.integrate import integrate_missing
+from vbf_hh_heft.events import run_event_generation
+from vbf_hh_heft.event_store import has_events, read_content, read_histograms
+from vbf_hh_heft import yoda_io
+from vbf_hh_heft.fit_function import linear_basis, is_linear
+
+
+def select_basis(candidates, basis_terms, n_terms):
+    terms = basis_terms(candidates)
+    residual = terms.copy()
+    selected = []
+    for _ in range(n_terms):
+        norms = np.linalg.norm(residual, axis=1)
+        norms[selected] = 0.0
+        i = int(np.argmax(norms))
+        if norms[i] <= 1e-10 * np.max(np.abs(terms), initial=1.0):
+            critical(
+                f"The parameter points in the configuration do not span all {n_terms} terms of the fit function, please specify more points or a '[morphing] basis'"
+            )
+            sys.exit(1)
+        selected.append(i)
+        direction = residual[i] / norms[i]
+        residual -= np.outer(residual @ direction, direction)
+    return selected
+
+
+def morphing_weights(basis_terms, basis_couplings, target_couplings):
+    basis_matrix = basis_terms(basis_couplings)
+    condition = np.linalg.cond(basis_matrix)
+    if condition > 1e6:
+        warning(f"The morphing basis is badly conditioned (condition number {condition:.3g}), consider other basis points")
+    return basis_terms(target_couplings) @ np.linalg.inv(basis_matrix)
+
+
+def load_event_histograms(conf_hash):
+    content = read_content(conf_hash)
+    return {process: read_histograms(conf_hash, process) for process in content["metadata"]["processes"]}
+
+
+def generate_basis(args, config, basis_points):
+    generate_libraries(os.path.join(get_src_location(), "Templates", args.template), args.jobs)
+    args.force = False
+    integrate_missing(args, config, basis_points)
+    info(f"Generating events for {len(basis_points)} missing morphing basis points...")
+    config, jobs = split_cores(config, args.jobs)
+    if jobs > 1:
+        run_concurrently(
+            [partial(run_event_generation, config, param_dict, args.template, screen=False) for param_dict in basis_points],
+            jobs,
+            f"Generating events for {len(basis_points)} basis points with {jobs} concurrent jobs",
+        )
+    else:
+        for i, param_dict in enumerate(basis_points):
+            run_event_generation(config, param_dict, args.template, f"[orange]\\[{i + 1}/{len(basis_points)}][/orange] ")
+
+
+def morph(args):
+    if not args.config:
+        critical("A configuration file containing the fit function and parameter points is required")
+        sys.exit(1)
+    with open(args.config, "rb") as f:
+        config = tomllib.load(f)
+    if args.mpi:
+        if not get_install_info()["mpi"]:
+            warning("Whizard was installed without MPI support, running serially")
+        else:
+            config["mpi"] = args.mpi
+        if not "mpi_processes" in config.keys():
+            config["mpi_processes"] = guess_mpi_processes(config["mpi_run"])
+    template_name = os.path.splitext(args.template)[0]
+    basis_terms, n_terms, fit_function = linear_basis(config)
+    targets = expand_parameters(args.config, args.cmd_parameters)
+    coupling_names = [name for name in targets[0].keys() if name != "scale"]
+    target_couplings = np.array([[target[name] for name in coupling_names] for target in targets])
+    if not is_linear(fit_function, basis_terms, n_terms, target_couplings):
+        critical("Morphing requires a fit function that is linear in its coefficients")
+        sys.exit(1)
+
+    morphing_config = config["morphing"] if "morphing" in config.keys() else {}
+    if "basis" in morphing_config.keys():
+        basis = [{name: float(point[name]) for name in coupling_names} for point in morphing_config["basis"]]
+        if len(basis) != n_terms:
+            critical(f"The morphing basis has to contain exactly {n_terms} parameter points, got {len(basis)}")
+            sys.exit(1)
+    else:
+        candidates = []
+        for point in config["param_list"] if "param_list" in config.keys() else targets:
+            candidate = {name: float(point[name]) for name in coupling_names}
+            if candidate not in candidates:
+                candidates.append(candidate)
+        basis = [
+            candidates[i]
+            for i in select_basis(
+                np.array([[c[name] for name in coupling_names] for c in candidates]), basis_terms, n_terms
+            )
+        ]
+    info(f"Using morphing basis {basis}")
+    basis_couplings = np.array([[point[name] for name in coupling_names] for point in basis])
+    weights = morphing_weights(basis_terms, basis_couplings, target_couplings)
+
+    scales = []
+    for target in targets:
+        if target["scale"] not in scales:
+            scales.append(target["scale"])
+    basis_points = {scale: [{**point, "scale": scale} for point in basis] for scale in scales}
+    basis_hashes = {scale: [get_conf_hash(template_name, p) for p in points] for scale, points in basis_points.items()}
+    missing = [
+        point
+        for scale in scales
+        for point, conf_hash in zip(basis_points[scale], basis_hashes[scale])
+        if not has_events(conf_hash)
+    ]
+    if len(missing) > 0:
+        generate_basis(args, config, missing)
+
+    info(f"Morphing histograms for {len(targets)} parameter combinations...")
+    os.makedirs(os.path.join(get_src_location(), "Morphing"), exist_ok=True)
+    try:
+        with open(os.path.join(get_src_location(), "Morphing", "morph_db.json"), "r") as db_file:
+            morph_db = json.load(db_file)
+    except FileNotFoundError:
+        morph_db = {}
+    basis_histograms = {
+        scale: [load_event_histograms(conf_hash) for conf_hash in basis_hashes[scale]] for scale in scales
+    }
+    for target, target_weights in zip(targets, weights):
+        conf_hash = get_conf_hash(template_name, target)
+        histograms = basis_histograms[target["scale"]]
+        os.makedirs(os.path.join(get_src_location(), "Morphing", conf_hash), exist_ok=True)
+        for process in histograms[0].keys():
+            yoda_io.write_yoda(
+                yoda_io.combine([h[process] for h in histograms], target_weights),
+                os.path.join(get_src_location(), "Morphing", conf_hash, f"{process}.yoda"),
+            )
+        morph_db[conf_hash] = {
+            "template": template_name,
+            "parameters": target,
+            "basis": basis_hashes[target["scale"]],
+            "weights": target_weights.tolist(),
+        }
+    with open(os.path.join(get_src_location(), "Morphing", "morph_db.json"), "w") as db_file:
+        json.dump(morph_db, db_file, indent=4)
+    info(f"Successfully morphed histograms for {len(targets)} parameter combinations into 'Morphing'")
@@ -0,0 +1,109 @@
+# "sha256" pins the digest of every archive downloaded for a package, keyed by archive name. As long as no digest is
+# pinned, the first download of an archive is trusted and its digest recorded in download_cache/SHA256SUMS. Once
+# digests are pinned, archives without a pinned or recorded digest need 'install --allow-unpinned'.
+package_data = {
+    "lhapdf": {
+        "title": "LHAPDF",
+        "depends": [],
+        "url": "https://lhapdf.hepforge.org/downloads/LHAPDF-6.5.5.tar.gz",
+        "dirname": "LHAPDF-6.5.5",
+        "sha256": {
+            "LHAPDF-6.5.5.tar.gz": None,
+            "PDF4LHC21_mc.tar.gz": None,
+            "CT10.tar.gz": None,
+            "cteq6l1.tar.gz": None,
+        },
+        "check": "bin/lhapdf-config",
+        "pdf_urls": [
+            "https://lhapdfsets.web.cern.ch/lhapdfsets/current/PDF4LHC21_mc.tar.gz",
+            "https://lhapdfsets.web.cern.ch/lhapdfsets/current/CT10.tar.gz",
+            "https://lhapdfsets.web.cern.ch/lhapdfsets/current/cteq6l1.tar.gz",
+        ],
+        "configure": "./configure --prefix={prefix}",
+        "install": "make install -j {jobs}",
+    },
+    "hepmc": {
+        "title": "HepMC",
+        "depends": [],
+        "url": "https://hepmc.web.cern.ch/hepmc/releases/HepMC3-3.3.0.tar.gz",
+        "dirname": "HepMC3-3.3.0",
+        "sha256": {
+            "HepMC3-3.3.0.tar.gz": None,
+        },
+        "check": "bin/HepMC3-config",
+        "configure": "cmake -DCMAKE_INSTALL_PREFIX={prefix} -DHEPMC3_ENABLE_ROOTIO=OFF   -DHEPMC3_ENABLE_PYTHON=OFF CMakeLists.txt",
+        "build": "cmake --build . -j {jobs}",
+        "install": "cmake --install .",
+    },
+    "fastjet": {
+        "title": "FastJet",
+        "depends": [],
+        "url": "https://fastjet.fr/repo/fastjet-3.4.3.tar.gz",
+        "dirname": "fastjet-3.4.3",
+        "sha256": {
+            "fastjet-3.4.3.tar.gz": None,
+            "fjcontrib-1.100.tar.gz": None,
+        },
+        "check": "bin/fastjet-config",
+        "configure": "./configure --prefix={prefix} --enable-shared --disable-auto-ptr --enable-allcxxplugins",
+        "install": "make install -j {jobs}",
+        "contrib_url": "https://fastjet.hepforge.org/contrib/downloads/fjcontrib-1.100.tar.gz",
+        "contrib_dirname": "fjcontrib-1.100",
+        "contrib_configure": "./configure --fastjet-config={prefix}/bin/fastjet-config CXXFLAGS=-fPIC",
+        "contrib_install": "make install fragile-shared-install -j {jobs}",
+    },
+    "yoda": {
+        "title": "Yoda",
+        "depends": [],
+        "url": "https://yoda.hepforge.org/downloads/YODA-2.0.2.tar.gz",
+        "dirname": "YODA-2.0.2",
+        "sha256": {
+            "YODA-2.0.2.tar.gz": None,
+        },
+        "check": "bin/yoda-config",
+        "configure": "./configure --prefix={prefix}",
+        "install": "make install -j {jobs}",
+    },
+    "rivet": {
+        "title": "Rivet",
+        "depends": ["hepmc", "fastjet", "yoda"],
+        "url": "https://rivet.hepforge.org/downloads/Rivet-4.0.2.tar.gz",
+        "dirname": "Rivet-4.0.2",
+        "sha256": {
+            "Rivet-4.0.2.tar.gz": None,
+        },
+        "check": "bin/rivet-config",
+        "configure": "./configure --prefix={prefix} --with-yoda={prefix} --with-hepmc={prefix} --with-fastjet={prefix}",
+        "install": "make install -j {jobs}",
+    },
+    "gosam": {
+        "title": "GoSam",
+        "depends": [],
+        "url": "https://github.com/gudrunhe/gosam/releases/download/3.0.0/GoSam-3.0.0-1c107f1.tar.gz",
+        "dirname": "GoSam-3.0.0-1c107f1",
+        "sha256": {
+            "GoSam-3.0.0-1c107f1.tar.gz": None,
+        },
+        "check": "bin/GoSam/gosam.py",
+        "configure": "meson setup build --prefix {prefix}",
+        "build": "meson compile -C build -j {jobs}",
+        "install": "meson install -C build",
+    },
+    "whizard": {
+        "title": "Whizard",
+        "depends": ["lhapdf", "hepmc", "fastjet", "gosam"],
+        "url": "https://whizard.hepforge.org/downloads/whizard-3.1.6.tar.gz",
+        "dirname": "whizard-3.1.6",
+        "sha256": {
+            "whizard-3.1.6.tar.gz": None,
+        },
+        "check": "bin/whizard-config",
+        "configure": "../configure --prefix={prefix} "
+        + "--enable-lhapdf LHAPDF_DIR={prefix} "
+        + "--enable-hepmc --with-hepmc={prefix} "
+        + "--enable-fastjet --with-fastjet={prefix} "
+        + "--enable-gosam --with-gosam={prefix}",
+        "mpi_flags": "FC=mpifort CC=mpicc CXX=mpic++ --enable-fc-mpi",
+        "install": "make install -j {jobs}",
+    },
+}
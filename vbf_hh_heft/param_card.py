@@ -0,0 +1,104 @@
+import os
+import io
+import sys
+import tarfile
+from contextlib import nullcontext
+from logging import info, critical
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from vbf_hh_heft.ufo import load_model
+
+header = (
+    "######################################################################\n"
+    "## PARAM_CARD AUTOMATICALY GENERATED BY THE UFO  #####################\n"
+    "######################################################################\n"
+)
+leading_blocks = ["SMINPUTS", "MASS", "DECAY"]
+chunk_size = 256
+
+
+def block_order(blocks):
+    return [block for block in leading_blocks if block in blocks] + sorted(
+        block for block in blocks if block not in leading_blocks
+    )
+
+
+def card_layout(model):
+    external = model["external"]
+    lines = [header]
+    order = []
+    for block in block_order(model["blocks"].keys()):
+        lines.append(f"\n###################################\n## INFORMATION FOR {block.upper()}\n###################################\n")
+        if block != "DECAY":
+            lines.append(f"Block {block} \n")
+        for lhacode, i in sorted(model["blocks"][block], key=lambda entry: entry[0]):
+            code = " ".join(f"{key:>3}" for key in lhacode).replace("%", "%%")
+            if block != "DECAY":
+                lines.append(f"  {code} %e # {external[i][0].replace('%', '%%')} \n")
+            else:
+                lines.append(f"DECAY {code} %e \n")
+            order.append(i)
+    return "".join(lines), order
+
+
+def point_table(model, points):
+    names = [name for name, _, _, _, _ in model["external"]]
+    unknown = [name for name in points.keys() if name not in names]
+    if len(unknown) > 0:
+        critical(f"The UFO model '{model['name']}' has no external parameters {', '.join(unknown)}")
+        sys.exit(1)
+    columns = np.broadcast_arrays(
+        *[np.real(points[name]) if name in points else np.real(complex(value)) for name, _, value, _, _ in model["external"]]
+    )
+    return np.stack([np.atleast_1d(column) for column in columns], axis=1).astype(float)
+
+
+def format_cards(template, values):
+    return [template % tuple(row) for row in values.tolist()]
+
+
+def write_cards(template, values, paths):
+    for card, path in zip(format_cards(template, values), paths):
+        with open(path, "w") as card_file:
+            card_file.write(card)
+
+
+def card_name(i):
+    return f"param_card_{i:06d}.dat"
+
+
+def write_param_cards(points, output, model="SM_HEFT_LO", jobs=1):
+    compiled = load_model(model)
+    template, order = card_layout(compiled)
+    values = point_table(compiled, points)[:, order]
+    chunks = [(start, values[start : start + chunk_size]) for start in range(0, len(values), chunk_size)]
+    archive = output.endswith((".tar", ".tar.gz", ".tgz"))
+    info(f"Writing {len(values)} parameter cards to '{output}' with {jobs} workers...")
+    with ProcessPoolExecutor(jobs) if jobs > 1 else nullcontext() as executor:
+        run = map if executor is None else executor.map
+        if archive:
+            with tarfile.open(output, "w:gz" if output.endswith("gz") else "w") as tar:
+                cards = run(format_cards, [template] * len(chunks), [chunk for _, chunk in chunks])
+                for (start, _), chunk_cards in zip(chunks, cards):
+                    for i, card in enumerate(chunk_cards):
+                        data = card.encode()
+                        member = tarfile.TarInfo(card_name(start + i))
+                        member.size = len(data)
+                        tar.addfile(member, io.BytesIO(data))
+        else:
+            os.makedirs(output, exist_ok=True)
+            list(
+                run(
+                    write_cards,
+                    [template] * len(chunks),
+                    [chunk for _, chunk in chunks],
+                    [
+                        [os.path.join(output, card_name(start + i)) for i in range(len(chunk))]
+                        for start, chunk in chunks
+                    ],
+                )
+            )
+    return len(values)
+
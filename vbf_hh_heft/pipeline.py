@@ -0,0 +1,144 @@
+import os
+import sys
+import time
+import errno
+import subprocess
+import threading
+from contextlib import contextmanager
+from logging import info, critical
+
+from vbf_hh_heft.util import get_src_location
+
+chunk_size = 1 << 20
+reader_timeout = 600
+
+
+class AnalysisReader:
+    def __init__(self, analyses, fifo, output, cwd, env, columns=None):
+        self.fifo = os.path.join(cwd, fifo)
+        self.name = os.path.splitext(os.path.basename(fifo))[0]
+        self.events = 0
+        self.error = None
+        self.opened = threading.Event()
+        os.mkfifo(self.fifo)
+        self.process = subprocess.Popen(
+            ["rivet", "-a", ",".join(analyses), "-o", output, "-"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            cwd=cwd,
+            env=env,
+        )
+        self.columns = None
+        if columns is not None:
+            # HepMC parsing and jet clustering run in their own process, off the relay that feeds rivet
+            python_path = os.environ.get("PYTHONPATH")
+            self.columns = subprocess.Popen(
+                [sys.executable, "-m", "vbf_hh_heft.columns", os.path.join(cwd, columns)],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                cwd=cwd,
+                env={**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [str(get_src_location()), python_path]))},
+            )
+        self.thread = threading.Thread(target=self.relay, name=f"rivet-{self.name}", daemon=True)
+        self.thread.start()
+
+    def relay(self):
+        tail = b"\n"
+        with open(self.fifo, "rb", buffering=0) as source:
+            self.opened.set()
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                self.events += (tail + chunk).count(b"\nE ")
+                tail = (tail + chunk[-2:])[-2:]
+                if self.error is not None:
+                    continue
+                try:
+                    self.process.stdin.write(chunk)
+                except (BrokenPipeError, ValueError):
+                    self.error = f"rivet exited with code {self.process.poll()} while reading events"
+                    continue
+                if self.columns is not None:
+                    try:
+                        self.columns.stdin.write(chunk)
+                    except (BrokenPipeError, ValueError):
+                        self.error = f"writing the columnar event cache failed with code {self.columns.poll()}"
+        for process in self.processes():
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    def release(self):
+        while self.thread.is_alive() and not self.opened.wait(0.05):
+            try:
+                os.close(os.open(self.fifo, os.O_WRONLY | os.O_NONBLOCK))
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+
+    def processes(self):
+        return [process for process in [self.process, self.columns] if process is not None]
+
+    def kill(self):
+        for process in self.processes():
+            process.kill()
+            process.wait()
+
+    def finish(self, timeout=reader_timeout):
+        self.release()
+        deadline = time.monotonic() + timeout
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            # a stalled consumer blocks the relay on its stdin, killing it unblocks the relay with a broken pipe
+            self.kill()
+            self.thread.join(10)
+            self.error = f"relaying events did not finish within {timeout} s, its consumers were killed"
+            return
+        for process, name in [(self.process, "rivet"), (self.columns, "the columnar event cache")]:
+            if process is None:
+                continue
+            try:
+                code = process.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                self.kill()
+                self.error = f"{name} did not finish within {timeout} s"
+                return
+            if self.error is None and code != 0:
+                self.error = f"{name} exited with code {code}"
+
+    def abort(self):
+        self.release()
+        for process in self.processes():
+            if process.poll() is None:
+                process.terminate()
+        self.thread.join(timeout=10)
+        for process in self.processes():
+            process.wait()
+
+
+@contextmanager
+def analysis_pipeline(analyses, streams, cwd, env, columns=False):
+    readers = []
+    try:
+        for fifo, output in streams:
+            column_file = f"{os.path.splitext(fifo)[0]}.columns" if columns else None
+            readers.append(AnalysisReader(analyses, fifo, output, cwd, env, column_file))
+        yield readers
+    except BaseException:
+        for reader in readers:
+            reader.abort()
+        raise
+    for reader in readers:
+        reader.finish()
+    for reader in readers:
+        info(f"Rivet reader '{reader.name}' analysed {reader.events} events")
+    failed = [reader for reader in readers if reader.error is not None]
+    if len(failed) > 0:
+        critical(
+            "Event analysis failed:\n" + "\n".join(f"    {reader.name}: {reader.error}" for reader in failed)
+        )
+        sys.exit(1)
+
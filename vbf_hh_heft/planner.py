@@ -0,0 +1,147 @@
+import os
+import math
+import hashlib
+from logging import info
+
+from vbf_hh_heft.util import get_src_location
+from vbf_hh_heft.sindarin import statements, tokenize, scan
+from vbf_hh_heft.grid_store import template_grids
+from vbf_hh_heft.templates import get_template_hash
+from vbf_hh_heft.generate_libraries import read_library_info
+
+adaptation_iterations = 2
+min_iterations = 3
+
+
+def parameter_scales(grids, param_dict):
+    scales = {}
+    for key in param_dict.keys():
+        values = [coordinate(key, grid["parameters"][key]) for grid in grids if key in grid["parameters"].keys()]
+        spread = max(values) - min(values) if len(values) > 1 else 0.0
+        scales[key] = spread if spread > 0 else 1.0
+    return scales
+
+
+def coordinate(key, value):
+    return math.log(value) if key == "scale" and value > 0 else value
+
+
+def grid_key(template):
+    # grids are only exchangeable between points integrated with the same template source and process library
+    template_name = os.path.splitext(os.path.basename(template))[0]
+    library_info = read_library_info(os.path.join(get_src_location(), "Libraries", f"{template_name}.json"))
+    library_key = library_info["key"] if library_info is not None else ""
+    return hashlib.sha256(f"{get_template_hash(template)} {library_key}".encode()).hexdigest()
+
+
+def nearest_grid(template_name, param_dict, key):
+    grids = [
+        grid
+        for grid in template_grids(template_name, key)
+        if set(grid["parameters"].keys()) == set(param_dict.keys())
+        and all("iterations" in component.keys() for component in grid["components"])
+    ]
+    if len(grids) == 0:
+        return None
+    scales = parameter_scales(grids, param_dict)
+    return min(
+        grids,
+        key=lambda grid: sum(
+            ((coordinate(key, grid["parameters"][key]) - coordinate(key, value)) / scales[key]) ** 2
+            for key, value in param_dict.items()
+        ),
+    )
+
+
+def error_goal(source):
+    for statement in statements(source):
+        if statement.head == "relative_error_goal":
+            tokens = tokenize(statement.text)
+            if len(tokens) == 3 and tokens[2][0] == "number":
+                return float(tokens[2][1])
+    return None
+
+
+def integrated_processes(text):
+    names = []
+    for kind, value in tokenize(text)[1:]:
+        if value == ")":
+            break
+        if kind == "name":
+            names.append(value)
+    return names
+
+
+def format_passes(passes):
+    return ", ".join(
+        f'{n_iterations}:{n_calls}:"{adaptation}"' if adaptation else f"{n_iterations}:{n_calls}"
+        for n_iterations, n_calls, adaptation in passes
+    )
+
+
+def component_passes(source):
+    return {
+        component.name: [[p.n_iterations, p.n_calls, p.adaptation] for p in component.iterations]
+        for process in scan(source).processes.values()
+        for component in process.components.values()
+    }
+
+
+def relative_error(component):
+    return abs(component["error"] / component["xsec"]) if component["xsec"] != 0 else 0.0
+
+
+def plan_passes(stored, cold, relative_error, goal):
+    n_iterations, n_calls, _ = cold[-1]
+    adaptation = next((p[2] for p in cold if p[2]), "gw")
+    if goal is None or relative_error <= 0:
+        needed = n_iterations
+    else:
+        needed = math.ceil(stored[-1][0] * (relative_error / goal) ** 2)
+    return stored + [
+        [adaptation_iterations, n_calls, adaptation],
+        [max(min_iterations, min(needed, n_iterations)), n_calls, None],
+    ]
+
+
+def warm_start(source, template_name, param_dict, config, key):
+    if "warm_start" in config.keys() and not config["warm_start"]:
+        return source, None, component_passes(source)
+    grid = nearest_grid(template_name, param_dict, key)
+    if grid is None:
+        return source, None, component_passes(source)
+    goal = config["relative_error_goal"] if "relative_error_goal" in config.keys() else error_goal(source)
+    cold = component_passes(source)
+    stored = {component["name"]: component for component in grid["components"]}
+    if not all(name in stored.keys() for name in cold.keys()):
+        return source, None, cold
+    planned = {
+        name: plan_passes(stored[name]["iterations"], passes, relative_error(stored[name]), goal)
+        for name, passes in cold.items()
+    }
+    lines = []
+    for statement in statements(source):
+        if statement.head == "relative_error_goal" and goal is not None:
+            lines.append(f"relative_error_goal = {goal}")
+            continue
+        if statement.head == "integrate":
+            names = integrated_processes(statement.text)
+            if len(names) == 1 and names[0] in planned.keys():
+                # the donor grid was integrated at other couplings, which changes the MD5 sum Whizard checks, the
+                # override is local to this integration and the grid key guarantees the same process setup
+                lines.append(
+                    f"integrate ({names[0]}) {{\n"
+                    "    ?check_grid_file = false\n"
+                    f"    iterations = {format_passes(planned[names[0]])}\n"
+                    "}"
+                )
+                continue
+        lines.append(statement.text)
+    info(
+        f"Warm-starting the integration for {param_dict} from the grid for {grid['parameters']} "
+        f"({', '.join(f'{name}: {passes[-1][0]} iterations' for name, passes in planned.items())})"
+    )
+    # only the passes run at this point are recorded, the next warm start from it again adds a fixed number of passes
+    # instead of carrying the whole chain of donors along
+    run = {name: passes[len(stored[name]["iterations"]) :] for name, passes in planned.items()}
+    return "\n".join(lines) + "\n", grid, run
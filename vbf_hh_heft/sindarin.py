@@ -0,0 +1,316 @@
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+token_pattern = re.compile(
+    r"""
+    (?P<comment>[#!][^\n]*)
+    |(?P<newline>\n)
+    |(?P<space>[ \t\r]+)
+    |(?P<string>"[^"\n]*")
+    |(?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)
+    |(?P<name>[$?@]?[A-Za-z_][A-Za-z0-9_.]*)
+    |(?P<arrow>=>)
+    |(?P<symbol>.)
+    """,
+    re.VERBOSE,
+)
+
+nlo_suffixes = ("_BORN", "_REAL", "_VIRTUAL", "_DGLAP")
+continuation_tokens = {",", "=", "=>", ":", "(", "{", "+", "-", "*", "/", "^", "and", "or", "in"}
+leading_continuation_tokens = {"=>", ":", "+", "*", "/", "^", "and", "or", "in"}
+
+
+@dataclass
+class IterationPass:
+    n_iterations: int
+    n_calls: int
+    adaptation: Optional[str] = None
+
+
+@dataclass
+class Component:
+    name: str
+    kind: str
+    iterations: List[IterationPass] = field(default_factory=list)
+    sample: Optional[str] = None
+    n_events: Optional[int] = None
+
+    @property
+    def n_iter(self):
+        return sum(iteration.n_iterations for iteration in self.iterations)
+
+
+@dataclass
+class Process:
+    name: str
+    components: Dict[str, Component] = field(default_factory=dict)
+
+
+@dataclass
+class Statement:
+    head: str
+    name: Optional[str]
+    text: str
+
+
+@dataclass
+class Sindarin:
+    processes: Dict[str, Process] = field(default_factory=dict)
+    process_names: List[str] = field(default_factory=list)
+    compile_workspace: Optional[str] = None
+    integrate_workspace: Optional[str] = None
+    n_events: Optional[int] = None
+    sample: Optional[str] = None
+
+    def process_dict(self):
+        processes = {}
+        for process_name, process in self.processes.items():
+            processes[process_name] = {}
+            for kind, component in process.components.items():
+                data = {"name": component.name, "n_iter": component.n_iter}
+                if component.sample is not None:
+                    data["sample"] = component.sample
+                    data["n_events"] = component.n_events
+                processes[process_name][kind] = data
+        return processes
+
+
+def token_spans(source):
+    spans = []
+    for match in token_pattern.finditer(source):
+        kind = match.lastgroup
+        if kind == "space" or kind == "comment":
+            continue
+        spans.append(((kind, match.group(kind)), match.span()))
+    return spans
+
+
+def tokenize(source):
+    return [token for token, _ in token_spans(source)]
+
+
+class Scanner:
+    def __init__(self, source):
+        spans = token_spans(source)
+        self.tokens = [token for token, _ in spans]
+        self.spans = [span for _, span in spans]
+        self.position = 0
+
+    def peek(self, offset=0):
+        position = self.position + offset
+        return self.tokens[position] if position < len(self.tokens) else (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def skip_newlines(self):
+        while self.peek()[0] == "newline":
+            self.position += 1
+
+    def at_statement_end(self, previous):
+        if self.peek()[0] is None:
+            return True
+        if self.peek()[0] != "newline" or previous in continuation_tokens:
+            return False
+        offset = 1
+        while self.peek(offset)[0] == "newline":
+            offset += 1
+        return self.peek(offset)[1] not in leading_continuation_tokens
+
+    def at_option_end(self):
+        kind, value = self.peek()
+        return kind in ("newline", None) or value in ("}", ",") or (kind == "name" and self.peek(1)[1] == "=")
+
+    def skip_statement(self, previous=None):
+        depth = 0
+        while self.peek()[0] is not None:
+            if depth == 0 and self.at_statement_end(previous):
+                return
+            kind, value = self.next()
+            if kind == "newline":
+                continue
+            if value in ("(", "{", "["):
+                depth += 1
+            elif value in (")", "}", "]"):
+                depth -= 1
+            previous = value
+
+    def value(self):
+        self.skip_newlines()
+        kind, value = self.next()
+        if kind == "string":
+            return value[1:-1]
+        if kind == "number":
+            return int(value) if re.fullmatch(r"\d+", value) else float(value)
+        return value
+
+    def iterations(self):
+        passes = []
+        while True:
+            self.skip_newlines()
+            if self.peek()[0] != "number":
+                break
+            n_iterations = int(self.next()[1])
+            if self.peek()[1] != ":":
+                break
+            self.next()
+            n_calls = int(self.next()[1])
+            adaptation = None
+            if self.peek()[1] == ":" and self.peek(1)[0] == "string":
+                self.next()
+                adaptation = self.next()[1][1:-1]
+            passes.append(IterationPass(n_iterations, n_calls, adaptation))
+            if self.peek()[1] == "," and self.peek(1)[0] in ("number", "newline"):
+                offset = 1
+                while self.peek(offset)[0] == "newline":
+                    offset += 1
+                if self.peek(offset)[0] == "number" and self.peek(offset + 1)[1] == ":":
+                    self.next()
+                    continue
+            break
+        return passes
+
+    def options(self):
+        options = {}
+        if self.peek()[1] != "{":
+            return options
+        self.next()
+        while True:
+            self.skip_newlines()
+            kind, value = self.peek()
+            if kind is None or value == "}":
+                self.next()
+                return options
+            if kind == "name" and self.peek(1)[1] == "=":
+                self.next()
+                self.next()
+                if value == "iterations":
+                    options[value] = self.iterations()
+                else:
+                    start = self.position
+                    options[value] = self.value()
+                    if not self.at_option_end():
+                        self.position = start
+                        self.skip_option()
+                        options[value] = None
+            else:
+                self.next()
+
+    def skip_option(self):
+        depth = 0
+        while self.peek()[0] is not None:
+            kind, value = self.peek()
+            if depth == 0 and (value == "}" or (kind == "name" and self.peek(1)[1] == "=")):
+                return
+            if value in ("(", "{", "["):
+                depth += 1
+            elif value in (")", "}", "]"):
+                depth -= 1
+            self.next()
+
+    def arguments(self):
+        names = []
+        if self.peek()[1] != "(":
+            return names
+        self.next()
+        while self.peek()[0] is not None:
+            kind, value = self.next()
+            if value == ")":
+                break
+            if kind == "name":
+                names.append(value)
+        return names
+
+
+def statements(source):
+    scanner = Scanner(source)
+    result = []
+    while True:
+        scanner.skip_newlines()
+        kind, value = scanner.peek()
+        if kind is None:
+            return result
+        start = scanner.spans[scanner.position][0]
+        name = scanner.peek(1)[1] if value == "process" and scanner.peek(1)[0] == "name" else None
+        scanner.next()
+        scanner.skip_statement(value)
+        end = scanner.spans[scanner.position - 1][1]
+        result.append(Statement(value, name, source[start:end]))
+
+
+def process_base_name(name):
+    for suffix in nlo_suffixes:
+        if name.endswith(suffix):
+            return name[: -len(suffix)]
+    return name
+
+
+def scan(source):
+    scanner = Scanner(source)
+    result = Sindarin()
+    declarations = []
+    integrations = {}
+    simulations = {}
+    global_iterations = []
+    while True:
+        scanner.skip_newlines()
+        kind, value = scanner.peek()
+        if kind is None:
+            break
+        if kind == "name" and value == "process" and scanner.peek(1)[0] == "name":
+            scanner.next()
+            name = scanner.next()[1]
+            previous = None
+            while not scanner.at_statement_end(previous) and scanner.peek()[1] != "{":
+                kind, value = scanner.next()
+                if kind != "newline":
+                    previous = value
+            declarations.append((name, scanner.options()))
+            result.process_names.append(name)
+        elif kind == "name" and value in ("integrate", "simulate") and scanner.peek(1)[1] == "(":
+            scanner.next()
+            names = scanner.arguments()
+            options = scanner.options()
+            for name in names:
+                (integrations if value == "integrate" else simulations)[name] = options
+        elif kind == "name" and scanner.peek(1)[1] == "=":
+            scanner.next()
+            scanner.next()
+            if value == "iterations":
+                global_iterations = scanner.iterations()
+            elif value in ("$compile_workspace", "$integrate_workspace", "$sample", "n_events"):
+                if scanner.peek()[0] in ("string", "number"):
+                    setattr(result, value.lstrip("$"), scanner.value())
+                else:
+                    setattr(result, value.lstrip("$"), None)
+            scanner.skip_statement()
+        else:
+            scanner.next()
+            scanner.skip_statement()
+
+    for name, options in declarations:
+        nlo_calculation = options["nlo_calculation"] if "nlo_calculation" in options.keys() else None
+        kind = nlo_calculation if isinstance(nlo_calculation, str) else "born"
+        base_name = process_base_name(name)
+        if base_name not in result.processes:
+            result.processes[base_name] = Process(base_name)
+        component = Component(name, kind)
+        if name in integrations and "iterations" in integrations[name].keys():
+            component.iterations = integrations[name]["iterations"]
+        else:
+            component.iterations = global_iterations
+        if name in simulations:
+            simulation = simulations[name]
+            if "$sample" in simulation.keys() and simulation["$sample"] is not None:
+                component.sample = simulation["$sample"]
+            else:
+                component.sample = result.sample if result.sample is not None else name
+            if "n_events" in simulation.keys() and isinstance(simulation["n_events"], int):
+                component.n_events = simulation["n_events"]
+            else:
+                component.n_events = result.n_events if result.n_events is not None else 0
+        result.processes[base_name].components[kind] = component
+    return result
@@ -0,0 +1,66 @@
+import os
+import json
+import hashlib
+import threading
+
+import jinja2
+
+from vbf_hh_heft.util import get_src_location
+from vbf_hh_heft.sindarin import scan
+
+template_cache_version = 2
+
+environment = jinja2.Environment(
+    loader=jinja2.FileSystemLoader(os.path.join(get_src_location(), "Templates")),
+    auto_reload=True,
+    cache_size=-1,
+)
+template_info_cache = {}
+template_info_lock = threading.Lock()
+
+
+def render_template(template, context):
+    return environment.get_template(os.path.basename(template)).render(
+        {"model_path": os.path.join(get_src_location(), "Model"), **context}
+    )
+
+
+def get_template_hash(template):
+    with open(os.path.join(get_src_location(), "Templates", os.path.basename(template)), "rb") as template_file:
+        return hashlib.sha256(template_file.read()).hexdigest()
+
+
+def get_template_info(template, generate_events=False):
+    template_hash = get_template_hash(template)
+    key = (template_hash, generate_events)
+    with template_info_lock:
+        if key in template_info_cache:
+            return template_info_cache[key]
+    cache_file = os.path.join(
+        get_src_location(),
+        ".cache",
+        "templates",
+        f"{template_hash}_{'events' if generate_events else 'integration'}_v{template_cache_version}.json",
+    )
+    try:
+        with open(cache_file) as file:
+            template_info = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        sindarin = render_template(
+            template,
+            {"scale": 1.0, "seed": 1, "evt_gen_seed": 1, "parameters": [], "generate_events": generate_events},
+        )
+        scanned = scan(sindarin)
+        template_info = {
+            "processes": scanned.process_dict(),
+            "process_names": scanned.process_names,
+            "compile_workspace": scanned.compile_workspace,
+            "integrate_workspace": scanned.integrate_workspace,
+        }
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(f"{cache_file}.{os.getpid()}", "w") as file:
+            json.dump(template_info, file)
+        os.replace(f"{cache_file}.{os.getpid()}", cache_file)
+    with template_info_lock:
+        template_info_cache[key] = template_info
+    return template_info
@@ -0,0 +1,126 @@
+from logging import info, warning
+import platform
+import tempfile
+import tarfile
+import hashlib
+import shutil
+import json
+import re
+import os
+
+from vbf_hh_heft.db import atomic_write_json
+
+toolchain_cache_version = 1
+
+
+def toolchain_key(package_data, dep_results, mpi):
+    description = {
+        "version": toolchain_cache_version,
+        "packages": package_data,
+        "dependencies": {dep: data["version"] for dep, data in dep_results.items() if data is not None},
+        "mpi": bool(mpi),
+        "platform": [platform.system(), platform.machine(), *platform.libc_ver()],
+    }
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+
+def artifact_paths(cache_dir, key):
+    return os.path.join(cache_dir, f"toolchain_{key}.tar.gz"), os.path.join(cache_dir, f"toolchain_{key}.json")
+
+
+def store_toolchain(cache_dir, key, prefix):
+    archive_path, manifest_path = artifact_paths(cache_dir, key)
+    if os.path.isfile(manifest_path):
+        return
+    info(f"Storing the toolchain in {prefix} in the toolchain cache {cache_dir}")
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, prefix=f".{os.path.basename(archive_path)}.")
+    os.close(fd)
+    with tarfile.open(tmp_path, "w:gz", compresslevel=6) as archive:
+        archive.add(prefix, arcname=".")
+    os.replace(tmp_path, archive_path)
+    # the manifest is written last, an archive without one is incomplete
+    atomic_write_json(manifest_path, {"key": key, "prefix": prefix})
+
+
+def relocate_symlink(path, old_prefix, new_prefix):
+    target = os.readlink(path)
+    if target == old_prefix or target.startswith(old_prefix + os.sep):
+        os.remove(path)
+        os.symlink(new_prefix + target[len(old_prefix) :], path)
+
+
+def relocate_file(path, old_prefix, new_prefix):
+    with open(path, "rb") as file:
+        data = file.read()
+    old = old_prefix.encode()
+    new = new_prefix.encode()
+    if old not in data:
+        return True
+    if path.endswith(".pyc"):
+        # cached bytecode records the source location, Python regenerates it on first import
+        os.remove(path)
+        return True
+    if b"\0" not in data[:8192]:
+        data = data.replace(old, new)
+    elif len(new) <= len(old):
+        # paths in binaries are NUL terminated strings, pad them to keep all offsets intact
+        data = re.sub(
+            re.escape(old) + rb"([^\0]*)\0",
+            lambda match: new + match.group(1) + b"\0" * (len(old) - len(new) + 1),
+            data,
+        )
+    else:
+        return False
+    mode = os.stat(path).st_mode
+    with open(f"{path}.relocate", "wb") as file:
+        file.write(data)
+    os.chmod(f"{path}.relocate", mode)
+    os.replace(f"{path}.relocate", path)
+    return True
+
+
+def relocate(prefix, old_prefix, new_prefix):
+    if old_prefix == new_prefix:
+        return []
+    unrelocated = []
+    for root, dirs, files in os.walk(prefix):
+        for name in dirs + files:
+            path = os.path.join(root, name)
+            if os.path.islink(path):
+                relocate_symlink(path, old_prefix, new_prefix)
+            elif name in files and not relocate_file(path, old_prefix, new_prefix):
+                unrelocated.append(os.path.relpath(path, prefix))
+    return unrelocated
+
+
+def restore_toolchain(cache_dir, key, prefix):
+    archive_path, manifest_path = artifact_paths(cache_dir, key)
+    try:
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        info(f"No prebuilt toolchain for this configuration in {cache_dir}, building from source")
+        return False
+    info(f"Unpacking the prebuilt toolchain from {cache_dir} to {prefix}")
+    os.makedirs(prefix, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=prefix, prefix=".toolchain.")
+    try:
+        shutil.unpack_archive(archive_path, staging, format="gztar")
+        unrelocated = relocate(staging, manifest["prefix"], prefix)
+        if len(unrelocated) > 0:
+            # compiled-in data paths of LHAPDF, Whizard or GoSam would still point to the build prefix
+            warning(
+                f"{len(unrelocated)} binaries of the prebuilt toolchain contain the build prefix {manifest['prefix']}, "
+                f"which is shorter than {prefix} and cannot be rewritten in place "
+                f"({', '.join(unrelocated[:5])}{', ...' if len(unrelocated) > 5 else ''}), building from source"
+            )
+            return False
+        for name in os.listdir(staging):
+            if os.path.isdir(os.path.join(prefix, name)) and not os.path.islink(os.path.join(prefix, name)):
+                shutil.copytree(os.path.join(staging, name), os.path.join(prefix, name), symlinks=True, dirs_exist_ok=True)
+            else:
+                os.replace(os.path.join(staging, name), os.path.join(prefix, name))
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return True
@@ -0,0 +1,305 @@
+import os
+import ast
+import sys
+import cmath
+import marshal
+import hashlib
+import threading
+import importlib.util
+from logging import info, critical
+
+import numpy as np
+
+from vbf_hh_heft.util import get_src_location
+from vbf_hh_heft.model_source import get_model_source_hash
+
+model_cache_version = 1
+
+model_cache = {}
+model_cache_lock = threading.Lock()
+
+
+def get_model_path(model="SM_HEFT_LO"):
+    return os.path.join(get_src_location(), "Model", model)
+
+
+def get_model_hash(path):
+    return hashlib.sha256(
+        f"{model_cache_version} {sys.implementation.cache_tag} {get_model_source_hash(path)}".encode()
+    ).hexdigest()
+
+
+def import_ufo(path, name):
+    spec = importlib.util.spec_from_file_location(
+        name, os.path.join(path, "__init__.py"), submodule_search_locations=[path]
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        for loaded in [key for key in sys.modules.keys() if key == name or key.startswith(f"{name}.")]:
+            del sys.modules[loaded]
+    return module
+
+
+def expression_names(expression):
+    return {node.id for node in ast.walk(ast.parse(expression, mode="eval")) if isinstance(node, ast.Name)}
+
+
+def dependency_order(expressions, known):
+    ordered = []
+    resolved = set(known)
+    pending = list(expressions.items())
+    while len(pending) > 0:
+        remaining = [(name, dependencies) for name, dependencies in pending if not dependencies <= resolved]
+        if len(remaining) == len(pending):
+            critical(
+                f"The UFO parameters {', '.join(name for name, _ in remaining)} depend on undefined or circular parameters"
+            )
+            sys.exit(1)
+        for name, dependencies in pending:
+            if dependencies <= resolved:
+                ordered.append(name)
+                resolved.add(name)
+        pending = remaining
+    return ordered
+
+
+def compile_expression(name, expression):
+    return compile(str(expression), f"<{name}>", "eval")
+
+
+def compile_model(path):
+    ufo = import_ufo(path, f"ufo_{os.path.basename(path)}")
+    functions = [(function.name, tuple(function.arguments), function.expr) for function in ufo.all_functions]
+    function_names = {name for name, _, _ in functions} | {"cmath", "complex"}
+
+    external = [parameter for parameter in ufo.all_parameters if parameter.nature == "external"]
+    internal = {parameter.name: parameter for parameter in ufo.all_parameters if parameter.nature != "external"}
+    dependencies = {
+        name: expression_names(str(parameter.value)) - function_names for name, parameter in internal.items()
+    }
+    parameter_order = dependency_order(dependencies, [parameter.name for parameter in external])
+
+    coupling_dependencies = {
+        coupling.name: expression_names(str(coupling.value)) - function_names for coupling in ufo.all_couplings
+    }
+    parameter_names = {parameter.name for parameter in ufo.all_parameters}
+    undefined = set().union(*coupling_dependencies.values()) - parameter_names
+    if len(undefined) > 0:
+        critical(f"The UFO couplings depend on undefined parameters {', '.join(sorted(undefined))}")
+        sys.exit(1)
+
+    blocks = {}
+    for i, parameter in enumerate(external):
+        blocks.setdefault(parameter.lhablock, []).append((tuple(parameter.lhacode), i))
+    coupling_index = {coupling.name: i for i, coupling in enumerate(ufo.all_couplings)}
+    lorentz_index = {lorentz.name: i for i, lorentz in enumerate(ufo.all_lorentz)}
+    return {
+        "version": model_cache_version,
+        "name": os.path.basename(path),
+        "functions": functions,
+        "external": [
+            (parameter.name, parameter.type, parameter.value, parameter.lhablock, tuple(parameter.lhacode))
+            for parameter in external
+        ],
+        "internal": [
+            (
+                name,
+                internal[name].type,
+                str(internal[name].value),
+                compile_expression(name, internal[name].value),
+                tuple(sorted(dependencies[name])),
+            )
+            for name in parameter_order
+        ],
+        "couplings": [
+            (
+                coupling.name,
+                str(coupling.value),
+                compile_expression(coupling.name, coupling.value),
+                dict(coupling.order),
+                tuple(sorted(coupling_dependencies[coupling.name])),
+            )
+            for coupling in ufo.all_couplings
+        ],
+        "blocks": blocks,
+        "particles": [
+            (
+                particle.pdg_code,
+                particle.name,
+                particle.antiname,
+                particle.spin,
+                particle.color,
+                particle.mass.name,
+                particle.width.name,
+                particle.charge,
+            )
+            for particle in ufo.all_particles
+        ],
+        "lorentz": [(lorentz.name, tuple(lorentz.spins), lorentz.structure) for lorentz in ufo.all_lorentz],
+        "vertices": [
+            (
+                vertex.name,
+                tuple(particle.pdg_code for particle in vertex.particles),
+                tuple(vertex.color),
+                tuple(lorentz_index[lorentz.name] for lorentz in vertex.lorentz),
+                tuple((i, j, coupling_index[coupling.name]) for (i, j), coupling in vertex.couplings.items()),
+            )
+            for vertex in ufo.all_vertices
+        ],
+        "orders": [(order.name, order.expansion_order, order.hierarchy) for order in ufo.all_orders],
+    }
+
+
+def load_model(model="SM_HEFT_LO"):
+    path = get_model_path(model)
+    model_hash = get_model_hash(path)
+    with model_cache_lock:
+        if model_hash in model_cache:
+            return model_cache[model_hash]
+    cache_file = os.path.join(get_src_location(), ".cache", "models", f"{model}_{model_hash}.bin")
+    try:
+        with open(cache_file, "rb") as file:
+            compiled = marshal.load(file)
+    except (FileNotFoundError, EOFError, ValueError, TypeError):
+        info(f"Compiling the UFO model '{model}'...")
+        compiled = compile_model(path)
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(f"{cache_file}.{os.getpid()}", "wb") as file:
+            marshal.dump(compiled, file)
+        os.replace(f"{cache_file}.{os.getpid()}", cache_file)
+    with model_cache_lock:
+        model_cache[model_hash] = compiled
+    return compiled
+
+
+def model_namespace(model):
+    namespace = {"cmath": cmath, "complex": complex}
+    for name, arguments, expression in model["functions"]:
+        namespace[name] = eval(f"lambda {', '.join(arguments)}: {expression}", {"cmath": cmath})
+    return namespace
+
+
+def evaluate_model(model, parameters=None):
+    values = {name: value for name, _, value, _, _ in model["external"]}
+    if parameters is not None:
+        unknown = set(parameters.keys()) - set(values.keys())
+        if len(unknown) > 0:
+            critical(f"The UFO model '{model['name']}' has no external parameters {', '.join(sorted(unknown))}")
+            sys.exit(1)
+        values.update(parameters)
+    namespace = model_namespace(model)
+    namespace.update(values)
+    for name, _, _, code, _ in model["internal"]:
+        namespace[name] = eval(code, namespace)
+        values[name] = namespace[name]
+    couplings = {name: eval(code, namespace) for name, _, code, _, _ in model["couplings"]}
+    return values, couplings
+
+
+numpy_functions = {
+    "complexconjugate": np.conjugate,
+    "re": np.real,
+    "im": np.imag,
+    "sec": lambda z: 1 / np.cos(np.real(z)),
+    "asec": lambda z: np.arccos(1 / np.real(z) + 0j),
+    "csc": lambda z: 1 / np.sin(np.real(z)),
+    "acsc": lambda z: np.arcsin(1 / np.real(z) + 0j),
+    "cot": lambda z: 1 / np.tan(np.real(z)),
+    "theta_function": lambda x, y, z: np.where(x, y, z),
+    "cond": lambda condition, true, false: np.where(condition == 0.0, true, false),
+    "reglog": lambda z: np.log(np.where(z == 0.0, 1.0, np.real(z)) + 0j),
+}
+
+cmath_functions = {
+    "sqrt": "sqrt",
+    "exp": "exp",
+    "log": "log",
+    "log10": "log10",
+    "sin": "sin",
+    "cos": "cos",
+    "tan": "tan",
+    "asin": "arcsin",
+    "acos": "arccos",
+    "atan": "arctan",
+    "sinh": "sinh",
+    "cosh": "cosh",
+    "tanh": "tanh",
+    "asinh": "arcsinh",
+    "acosh": "arccosh",
+    "atanh": "arctanh",
+    "pi": "pi",
+    "e": "e",
+}
+
+
+class NumpyTransformer(ast.NodeTransformer):
+    def visit_Attribute(self, node):
+        if isinstance(node.value, ast.Name) and node.value.id == "cmath":
+            if node.attr not in cmath_functions:
+                critical(f"The UFO expression function 'cmath.{node.attr}' has no NumPy equivalent")
+                sys.exit(1)
+            return ast.copy_location(
+                ast.Attribute(value=ast.Name(id="np", ctx=ast.Load()), attr=cmath_functions[node.attr], ctx=ast.Load()),
+                node,
+            )
+        return self.generic_visit(node)
+
+    def visit_Call(self, node):
+        node = self.generic_visit(node)
+        if isinstance(node.func, ast.Name) and node.func.id == "complex" and len(node.args) == 2:
+            return ast.copy_location(
+                ast.BinOp(
+                    left=node.args[0],
+                    op=ast.Add(),
+                    right=ast.BinOp(left=ast.Constant(value=1j), op=ast.Mult(), right=node.args[1]),
+                ),
+                node,
+            )
+        return node
+
+
+def numpy_expression(expression):
+    tree = ast.fix_missing_locations(NumpyTransformer().visit(ast.parse(expression, mode="eval")))
+    return ast.unparse(tree)
+
+
+def required_parameters(model, outputs):
+    dependencies = {name: set(names) for name, _, _, _, names in model["internal"]}
+    dependencies.update({name: set(names) for name, _, _, _, names in model["couplings"]})
+    required = set()
+    pending = list(outputs)
+    while len(pending) > 0:
+        name = pending.pop()
+        if name in required:
+            continue
+        required.add(name)
+        pending.extend(dependencies.get(name, ()))
+    return required
+
+
+def compile_evaluator(model, outputs=None):
+    internal = [(name, expression) for name, _, expression, _, _ in model["internal"]]
+    couplings = [(name, expression) for name, expression, _, _, _ in model["couplings"]]
+    if outputs is None:
+        outputs = [name for name, _ in internal + couplings]
+    else:
+        known = {name for name, _ in internal + couplings} | {name for name, _, _, _, _ in model["external"]}
+        unknown = [name for name in outputs if name not in known]
+        if len(unknown) > 0:
+            critical(f"The UFO model '{model['name']}' has no parameters or couplings {', '.join(unknown)}")
+            sys.exit(1)
+    required = required_parameters(model, outputs)
+    external = [(name, value) for name, _, value, _, _ in model["external"]]
+
+    lines = [f"def evaluate({', '.join(f'{name}={value!r}' for name, value in external)}):"]
+    lines += [f"    {name} = np.asarray({name}, dtype=np.complex128)" for name, _ in external if name in required]
+    lines += [
+        f"    {name} = {numpy_expression(expression)}" for name, expression in internal + couplings if name in required
+    ]
+    lines.append(f"    return {{{', '.join(f'{name!r}: {name}' for name in outputs)}}}")
+    namespace = {"np": np, **numpy_functions}
+    exec(compile("\n".join(lines), f"<{model['name']} evaluator>", "exec"), namespace)
+    return namespace["evaluate"]
@@ -6,6 +6,12 @@ import sys
 import pathlib
 import json
 import itertools
+import hashlib
+import collections
+import shutil
+import gzip
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 try:
     import tomllib
@@ -17,44 +23,131 @@ except ImportError:
         sys.exit(1)
 from rich.live import Live
 from rich.spinner import Spinner
-from rich.console import Console
+from rich.text import Text
+from rich.console import Console, Group
+from rich.progress import Progress
+
+from vbf_hh_heft.sindarin import scan
+from vbf_hh_heft.db import atomic_write_json
 
 console = Console()
+log_max_bytes = 64 << 20
+log_backups = 5
+tail_lines = 2000
+report_lines = 20
+ui_refresh_rate = 10
+toolchain_cache_version = 1
+toolchain_cache = {}
+
+
+class RotatingLog:
+    """Streams command output to a log file, full segments are moved to gzip compressed backups."""
+
+    def __init__(self, path, max_bytes=log_max_bytes, backups=log_backups):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        for i in range(1, backups + 1):
+            if path and os.path.isfile(self.backup_path(i)):
+                os.remove(self.backup_path(i))
+        self.file = open(path, "wb") if path else None
+        self.size = 0
+
+    def backup_path(self, i):
+        return f"{self.path}.{i}.gz"
+
+    def write(self, data):
+        if self.file is None:
+            return
+        self.file.write(data)
+        self.size += len(data)
+        if self.size >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        self.file.close()
+        if os.path.isfile(self.backup_path(self.backups)):
+            os.remove(self.backup_path(self.backups))
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.isfile(self.backup_path(i)):
+                os.replace(self.backup_path(i), self.backup_path(i + 1))
+        with open(self.path, "rb") as source, gzip.open(self.backup_path(1), "wb", compresslevel=1) as backup:
+            shutil.copyfileobj(source, backup)
+        self.file = open(self.path, "wb")
+        self.size = 0
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class OutputView:
+    """Shows the last screen of output above the spinner, rendered only when the live display refreshes."""
+
+    def __init__(self, spinner, tail):
+        self.spinner = spinner
+        self.tail = tail
+
+    def __rich__(self):
+        lines = list(self.tail)[-max(1, console.height - 2) :]
+        text = Text(b"".join(lines).decode("utf-8", errors="replace").rstrip("\n"), no_wrap=True, overflow="ellipsis")
+        return Group(text, self.spinner)
+
+
+def stream_command(command, env, cwd, log, tail):
+    with subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True, env=env, cwd=cwd
+    ) as proc:
+        for line in proc.stdout:
+            log.write(line)
+            tail.append(line)
+    return proc.returncode
+
 
+def run_commands(commands, env, cwd, log, tail):
+    for command in commands:
+        return_code = stream_command(command, env, cwd, log, tail)
+        if return_code and return_code != 0:
+            return command, return_code
+    return None, 0
 
-def execute_alt_screen(task_description, commands, logfile=None, env=os.environ):
-    failed = False
-    failed_command = ""
-    return_code = 0
-    cmd_output = [
+
+def execute_alt_screen(task_description, commands, logfile=None, env=os.environ, cwd=None, screen=True):
+    header = [
         f"Running task '{task_description}' with commands:\n",
         *["    " + command + "\n" for command in commands],
         "-" * 80 + "\n",
     ]
-    with console.screen():
+    log = RotatingLog(logfile)
+    log.write("".join(header).encode("utf-8"))
+    tail = collections.deque(maxlen=tail_lines)
+    # nobody watches the alternate screen of a batch job, its output only goes to the log
+    if screen and console.is_terminal:
         spinner = Spinner("dots", text="[bold red]" + task_description + "[/bold red]", style="bold green")
-        with Live(spinner, console=console, transient=True) as live:
-            for command in commands:
-                with subprocess.Popen(
-                    command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, shell=True, env=env
-                ) as proc:
-                    for line in proc.stdout:
-                        line = line.decode("utf-8")
-                        live.console.print(line, end="")
-                        cmd_output.append(line)
-                        live.refresh()
-                    if proc.returncode and proc.returncode != 0:
-                        failed = True
-                        failed_command = command
-                        return_code = proc.returncode
-                        break
-    if logfile:
-        with open(logfile, "w") as file:
-            file.writelines(cmd_output)
-    if failed:
-        with open(os.path.join(get_src_location(), "vbf_hh_heft.log"), "w") as file:
-            file.writelines(cmd_output)
-        critical(f"Command {failed_command} failed with code {return_code}, output written to 'vbf_hh_heft.log'.")
+        with console.screen(), Live(
+            OutputView(spinner, tail), console=console, transient=True, refresh_per_second=ui_refresh_rate
+        ):
+            failed_command, return_code = run_commands(commands, env, cwd, log, tail)
+    else:
+        failed_command, return_code = run_commands(commands, env, cwd, log, tail)
+    log.close()
+    if failed_command is not None:
+        if logfile:
+            # the log already holds the full output, other failing tasks write their own logs
+            location = f"'{logfile}'" + (" and its compressed backups" if os.path.isfile(log.backup_path(1)) else "")
+        else:
+            fd, report = tempfile.mkstemp(dir=get_src_location(), prefix="vbf_hh_heft_failed_", suffix=".log")
+            with os.fdopen(fd, "w") as file:
+                file.writelines(header)
+                if len(tail) == tail.maxlen:
+                    file.write(f"[only the last {tail.maxlen} lines are shown]\n")
+                file.writelines(line.decode("utf-8", errors="replace") for line in tail)
+            location = f"'{os.path.basename(report)}'"
+        last_lines = "".join(line.decode("utf-8", errors="replace") for line in list(tail)[-report_lines:])
+        critical(
+            f"Command {failed_command} failed with code {return_code}, output written to {location}. "
+            f"Last lines of output:\n{last_lines.rstrip()}"
+        )
         sys.exit(1)
 
 
@@ -62,6 +155,12 @@ def get_src_location():
     return pathlib.Path(os.path.realpath(__file__)).parent.parent
 
 
+def get_conf_hash(template_name, param_dict):
+    return hashlib.sha256(
+        json.dumps({"template": template_name, "parameters": param_dict}).encode("utf-8")
+    ).hexdigest()
+
+
 def get_install_info():
     if not os.path.exists(os.path.join(get_src_location(), "installation.json")):
         critical(f"Unable to find 'installation.json', did you run './vbf_hh_heft.py install' yet?")
@@ -71,90 +170,73 @@ def get_install_info():
     return installation
 
 
-def setup_env():
+def get_toolchain_cache_path():
+    return os.path.join(get_src_location(), ".cache", "toolchain.json")
+
+
+def file_stamps(paths):
+    stamps = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stamps[path] = [stat.st_size, stat.st_mtime_ns]
+        except FileNotFoundError:
+            stamps[path] = None
+    return stamps
+
+
+def probe_toolchain():
     installation = get_install_info()
-    env = os.environ.copy()
-    if "PATH" in env:
-        env[
-            "PATH"
-        ] = f"{os.path.join(installation['prefix'], 'bin/GoSam')}:{os.path.join(installation['prefix'], 'bin')}:{env['PATH']}"
-    else:
-        env[
-            "PATH"
-        ] = f"{os.path.join(installation['prefix'], 'bin/GoSam')}:{os.path.join(installation['prefix'], 'bin')}"
-    if "LD_LIBRARY_PATH" in env:
-        env[
-            "LD_LIBRARY_PATH"
-        ] = f"{os.path.join(installation['prefix'], 'lib')}:{os.path.join(installation['prefix'], 'lib64')}:{env['LD_LIBRARY_PATH']}"
-    else:
-        env[
-            "LD_LIBRARY_PATH"
-        ] = f"{os.path.join(installation['prefix'], 'lib')}:{os.path.join(installation['prefix'], 'lib64')}"
-    with open(os.path.join(installation["prefix"], "share", "Rivet", "rivetenv.sh"), "r") as file:
+    prefix = installation["prefix"]
+    rivetenv = os.path.join(prefix, "share", "Rivet", "rivetenv.sh")
+    with open(rivetenv, "r") as file:
         python_path = re.findall(r"export PYTHONPATH=\"([^\"\n]*)\"", file.read())[0]
-    env["PYTHONPATH"] = python_path
+    binaries = file_stamps([os.path.join(prefix, "bin", "whizard"), os.path.join(prefix, "bin", "GoSam", "gosam.py")])
+    return {
+        "version": toolchain_cache_version,
+        "sources": file_stamps([os.path.join(get_src_location(), "installation.json"), rivetenv, *binaries.keys()]),
+        "installation": installation,
+        "binaries": {os.path.relpath(path, prefix): stamp for path, stamp in binaries.items()},
+        "env": {
+            "PATH": [os.path.join(prefix, "bin/GoSam"), os.path.join(prefix, "bin")],
+            "LD_LIBRARY_PATH": [os.path.join(prefix, "lib"), os.path.join(prefix, "lib64")],
+            "PYTHONPATH": python_path,
+        },
+    }
+
+
+def get_toolchain():
+    toolchain = toolchain_cache.get("toolchain")
+    if toolchain is None:
+        try:
+            with open(get_toolchain_cache_path()) as file:
+                toolchain = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+    # a reinstall or a moved prefix changes one of the stamped files
+    if (
+        toolchain is None
+        or toolchain["version"] != toolchain_cache_version
+        or file_stamps(toolchain["sources"].keys()) != toolchain["sources"]
+    ):
+        toolchain = probe_toolchain()
+        os.makedirs(os.path.dirname(get_toolchain_cache_path()), exist_ok=True)
+        atomic_write_json(get_toolchain_cache_path(), toolchain)
+    toolchain_cache["toolchain"] = toolchain
+    return toolchain
+
+
+def setup_env():
+    paths = get_toolchain()["env"]
+    env = os.environ.copy()
+    for variable in ["PATH", "LD_LIBRARY_PATH"]:
+        env[variable] = ":".join(paths[variable] + ([env[variable]] if variable in env else []))
+    env["PYTHONPATH"] = paths["PYTHONPATH"]
     return env
 
 
 def parse_processes(sindarin):
-    processes = {}
-    process_declarations = re.findall(r"(?<=\n)[^#\n]*(?=process)(.*)", sindarin)
-    processes_set = set()
-    for declaration in process_declarations:
-        match = re.findall(r"process\s+(?:([^=\s]+)(?:_BORN|_REAL|_VIRTUAL|_DGLAP)|([^=\s]+))", declaration)[-1]
-        if match[0] == "":
-            processes_set.add(match[1])
-        else:
-            processes_set.add(match[0])
-    for process_name in processes_set:
-        declarations = list(
-            filter(
-                lambda decl: re.search(
-                    r"process\s+(?:(" + process_name + ")(?:_BORN|_REAL|_VIRTUAL|_DGLAP)|(" + process_name + r"))", decl
-                )
-                is not None,
-                process_declarations,
-            )
-        )
-        d = {}
-        for declaration in declarations:
-            match = re.search(r"nlo_calculation\s*=\s*(\w+)", declaration)
-            if match:
-                d[match.group(1)] = {"name": f"{process_name}_{match.group(1).upper()}"}
-            else:
-                d["born"] = {"name": f"{process_name}"}
-        processes[process_name] = d
-
-        n_events_global_match = re.search(r"\n[\t ]*n_events\s*=\s*(\d+)", sindarin)
-        if n_events_global_match:
-            n_events = int(n_events_global_match.group(1))
-        else:
-            n_events = None
-
-    for process_name, process_data in processes.items():
-        for component, data in process_data.items():
-            int_decl = re.search(
-                r"(?<=\n)[^#\n]*integrate[ \t]*\([ \t]*" + data["name"] + r"[ \t]*\).*", sindarin
-            ).group(0)
-            int_match = re.search(r"iterations\s*=\s*((?:\d+:\d+(?::\"\w+\")?,?\s*)*)", int_decl).group(1)
-            n_iter = sum([int(stage.split(":")[0]) for stage in int_match.split(",")])
-            data["n_iter"] = n_iter
-
-            sim_decl = re.search(r"(?<=\n)[^#\n]*simulate[ \t]*\([ \t]*" + data["name"] + r"[ \t]*\).*", sindarin)
-            if sim_decl:
-                sim_decl = sim_decl.group(0)
-                sample_match = re.search(r"\$sample\s*=\s*\"([^\"\n]*)\"", sim_decl).group(1)
-                data["sample"] = sample_match
-                n_events_match = re.search(r"\$n_events\s*=\s*(\d+)", sim_decl)
-                if n_events_match is None:
-                    if n_events is None:
-                        data["n_events"] = 0
-                    else:
-                        data["n_events"] = n_events
-                else:
-                    data["n_events"] = n_events_match
-
-    return processes
+    return scan(sindarin).process_dict()
 
 
 def expand_parameters(file, cmd_params):
@@ -227,12 +309,68 @@ def expand_parameters(file, cmd_params):
     return param_list
 
 
+mpi_processes_pattern = re.compile(r"(--?(?:np|c|n)(?:[ \t]*|=))(\d+)")
+
+
 def guess_mpi_processes(command):
-    match = re.findall(r"--?(?:np|c|n)[ \t]*(\d+)", command)
+    match = mpi_processes_pattern.findall(command)
     if len(match) > 0:
-        return int(match[0])
+        return int(match[0][1])
     else:
         critical(
             "'mpi_processes' is not set and the number of MPI processes cannot be guesses from 'mpi_command', please set 'mpi_processes'"
         )
         sys.exit(1)
+
+
+def split_cores(config, jobs):
+    n_cores = os.cpu_count() or 1
+    jobs = max(1, min(jobs, n_cores))
+    cores_per_job = max(1, n_cores // jobs)
+    config = dict(config)
+    if "mpi" in config.keys() and config["mpi"]:
+        if not "mpi_run" in config.keys():
+            critical(
+                "Running in MPI mode, but 'mpi_run' is not specified. Please specify a config file setting 'mpi_run'"
+            )
+            sys.exit(1)
+        if "mpi_processes" in config.keys():
+            mpi_processes = config["mpi_processes"]
+        else:
+            mpi_processes = guess_mpi_processes(config["mpi_run"])
+        if jobs > 1 and mpi_processes * jobs > n_cores:
+            mpi_run, substituted = mpi_processes_pattern.subn(
+                lambda match: f"{match.group(1)}{cores_per_job}", config["mpi_run"], count=1
+            )
+            if substituted > 0:
+                mpi_processes = cores_per_job
+                config["mpi_run"] = mpi_run
+            else:
+                # the rank count of 'mpi_run' cannot be changed, run fewer jobs with the configured number of ranks
+                jobs = max(1, n_cores // mpi_processes)
+                cores_per_job = max(1, n_cores // jobs)
+                warning(
+                    f"Cannot set the number of MPI processes in 'mpi_run' ({config['mpi_run']}), keeping "
+                    f"{mpi_processes} processes per job. Set the process count in 'mpi_run' and 'mpi_processes' or "
+                    "use -j to control the number of concurrent jobs"
+                )
+            info(f"Running {jobs} concurrent jobs with {mpi_processes} MPI processes each")
+        config["mpi_processes"] = mpi_processes
+        config["threads"] = max(1, cores_per_job // mpi_processes)
+    else:
+        config["threads"] = cores_per_job
+    return config, jobs
+
+
+def run_concurrently(tasks, jobs, description):
+    with Progress(transient=True) as progress, ThreadPoolExecutor(max_workers=jobs) as executor:
+        task = progress.add_task(f"[green]{description}", total=len(tasks))
+        futures = [executor.submit(t) for t in tasks]
+        try:
+            for future in as_completed(futures):
+                future.result()
+                progress.update(task, advance=1)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
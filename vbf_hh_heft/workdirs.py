@@ -0,0 +1,137 @@
+import os
+import json
+import fcntl
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+from logging import info
+
+from vbf_hh_heft.util import get_src_location
+
+held_slots = set()
+held_slots_lock = threading.Lock()
+
+
+def get_pool_dir(template_name):
+    return os.path.join(get_src_location(), ".cache", "workdirs", template_name)
+
+
+def get_library_path(template_name):
+    return os.path.join(get_src_location(), "Libraries", f"{template_name}.tar.gz")
+
+
+def library_key(template_name):
+    stat = os.stat(get_library_path(template_name))
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+def scan_tree(root):
+    files = {}
+    dirs = []
+    for path, dirnames, filenames in os.walk(root):
+        for dirname in dirnames:
+            dirs.append(os.path.relpath(os.path.join(path, dirname), root))
+        for filename in filenames:
+            stat = os.lstat(os.path.join(path, filename))
+            files[os.path.relpath(os.path.join(path, filename), root)] = [stat.st_size, stat.st_mtime_ns]
+    return files, dirs
+
+
+def read_manifest(slot):
+    try:
+        with open(os.path.join(slot, "manifest.json")) as manifest:
+            return json.load(manifest)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def unpack_library(template_name, slot):
+    info(f"Unpacking the process library for template {template_name} into a new work directory...")
+    work = os.path.join(slot, "work")
+    if os.path.isdir(work):
+        shutil.rmtree(work)
+    if os.path.exists(os.path.join(slot, "manifest.json")):
+        os.remove(os.path.join(slot, "manifest.json"))
+    key = library_key(template_name)
+    shutil.unpack_archive(get_library_path(template_name), work)
+    files, dirs = scan_tree(work)
+    with open(os.path.join(slot, "manifest.json"), "w") as manifest:
+        json.dump({"library": key, "files": files, "dirs": dirs}, manifest)
+
+
+def reset_workdir(slot, manifest):
+    work = os.path.join(slot, "work")
+    files, dirs = scan_tree(work)
+    if any(files.get(name) != stat for name, stat in manifest["files"].items()):
+        return False
+    library_dirs = set(manifest["dirs"])
+    for name in sorted(set(dirs) - library_dirs):
+        if os.path.isdir(os.path.join(work, name)):
+            shutil.rmtree(os.path.join(work, name))
+    for name in set(files.keys()) - set(manifest["files"].keys()):
+        if os.path.lexists(os.path.join(work, name)):
+            os.remove(os.path.join(work, name))
+    return True
+
+
+def prepare_slot(template_name, slot):
+    manifest = read_manifest(slot)
+    if manifest is None or manifest["library"] != library_key(template_name) or not reset_workdir(slot, manifest):
+        unpack_library(template_name, slot)
+    return os.path.join(slot, "work")
+
+
+def try_lock(slot):
+    with held_slots_lock:
+        if slot in held_slots:
+            return None
+        os.makedirs(slot, exist_ok=True)
+        lock_file = open(os.path.join(slot, "lock"), "a+")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return None
+        held_slots.add(slot)
+        return lock_file
+
+
+def release_lock(slot, lock_file):
+    with held_slots_lock:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+        held_slots.discard(slot)
+
+
+@contextmanager
+def workdir(template_name, config=None):
+    if config is not None and "workdir_pool" in config.keys() and not config["workdir_pool"]:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            shutil.unpack_archive(get_library_path(template_name), tmpdir)
+            yield tmpdir
+        return
+    i = 0
+    while True:
+        slot = os.path.join(get_pool_dir(template_name), str(i))
+        lock_file = try_lock(slot)
+        if lock_file is not None:
+            break
+        i += 1
+    try:
+        path = prepare_slot(template_name, slot)
+        try:
+            yield path
+        finally:
+            manifest = read_manifest(slot)
+            if manifest is None or not reset_workdir(slot, manifest):
+                shutil.rmtree(path, ignore_errors=True)
+                if os.path.exists(os.path.join(slot, "manifest.json")):
+                    os.remove(os.path.join(slot, "manifest.json"))
+    finally:
+        release_lock(slot, lock_file)
+
+
+def remove_pool(template_name):
+    if os.path.isdir(get_pool_dir(template_name)):
+        shutil.rmtree(get_pool_dir(template_name))
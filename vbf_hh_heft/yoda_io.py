@@ -0,0 +1,247 @@
+import gzip
+import math
+import re
+import sys
+from logging import critical
+
+import numpy as np
+
+stale_annotations = re.compile(r"#\s*(?:Mean|Area|Integral)\s*:")
+
+
+def column_roles(columns):
+    names = [column.lower() for column in columns]
+    value_columns = [i for i, name in enumerate(names) if name == "value" or re.fullmatch(r"[xyz]val", name)]
+    last_value = value_columns[-1] if value_columns else None
+    roles = []
+    for i, name in enumerate(names):
+        # sumW2 is the sum of squared weights, the moments sumW2(A1) = sum w x^2 scale linearly with the weights
+        if name == "sumw2":
+            roles.append("quadratic")
+        elif name.startswith("sum"):
+            roles.append("linear")
+        elif name == "numentries":
+            roles.append("count")
+        elif last_value is not None and i == last_value:
+            roles.append("linear")
+        elif last_value is not None and i > last_value and "err" in name:
+            roles.append("error")
+        else:
+            roles.append("keep")
+    return roles
+
+
+def parse_yoda(text):
+    objects = {}
+    current = None
+    table = None
+    for line in text.splitlines():
+        stripped = line.strip()
+        if current is None:
+            if stripped.startswith("BEGIN "):
+                path = stripped.split(maxsplit=2)[2] if len(stripped.split()) > 2 else ""
+                current = {"begin": stripped, "path": path, "body": [], "end": None, "data_section": False}
+            continue
+        if stripped.startswith("END "):
+            current["end"] = stripped
+            current.pop("data_section")
+            objects[current["path"]] = current
+            current = None
+            table = None
+            continue
+        if stripped == "---":
+            current["data_section"] = True
+            current["body"].append(line)
+            table = None
+            continue
+        if current["data_section"] and stripped.startswith("#") and not stale_annotations.match(stripped):
+            columns = stripped.lstrip("#").split()
+            table = {"columns": columns, "roles": column_roles(columns), "rows": []}
+            current["body"].append(line)
+            current["body"].append(table)
+            continue
+        if table is not None and stripped and not stripped.startswith("#"):
+            tokens = stripped.split()
+            if len(tokens) == len(table["columns"]) and not tokens[0].endswith(":"):
+                table["rows"].append(tokens)
+                continue
+        table = None
+        if not stale_annotations.match(stripped):
+            current["body"].append(line)
+    return objects
+
+
+def read_yoda(path):
+    if str(path).endswith(".gz"):
+        with gzip.open(path, "rt") as file:
+            return parse_yoda(file.read())
+    with open(path) as file:
+        return parse_yoda(file.read())
+
+
+def format_value(value, role):
+    if role == "count":
+        return f"{value:.10e}" if not float(value).is_integer() else str(int(value))
+    return f"{value:.10e}"
+
+
+def dump_yoda(objects):
+    lines = []
+    for obj in objects.values():
+        lines.append(obj["begin"])
+        for entry in obj["body"]:
+            if isinstance(entry, str):
+                lines.append(entry)
+            else:
+                for row in entry["rows"]:
+                    lines.append("\t".join(row))
+        lines.append(obj["end"])
+        lines.append("")
+    return "\n".join(lines)
+
+
+def write_yoda(objects, path):
+    if str(path).endswith(".gz"):
+        with gzip.open(path, "wt") as file:
+            file.write(dump_yoda(objects))
+    else:
+        with open(path, "w") as file:
+            file.write(dump_yoda(objects))
+
+
+def combine_tables(tables, coefficients):
+    reference = tables[0]
+    columns = list(zip(*reference["rows"])) if reference["rows"] else []
+    combined_columns = []
+    for i, role in enumerate(reference["roles"]):
+        if role == "keep":
+            combined_columns.append(columns[i] if columns else ())
+            continue
+        values = np.array([[float(row[i]) for row in table["rows"]] for table in tables])
+        c = np.asarray(coefficients)[:, np.newaxis]
+        if role == "linear":
+            result = np.sum(c * values, axis=0)
+        elif role == "quadratic":
+            result = np.sum(c**2 * values, axis=0)
+        elif role == "count":
+            result = np.sum(values, axis=0)
+        else:
+            result = np.copysign(np.sqrt(np.sum(c**2 * values**2, axis=0)), values[0])
+        combined_columns.append([format_value(value, role) for value in result])
+    rows = [list(row) for row in zip(*combined_columns)] if combined_columns else []
+    return {"columns": reference["columns"], "roles": reference["roles"], "rows": rows}
+
+
+def combine_object(path, objects, coefficients):
+    reference = objects[0]
+    # every coefficient belongs to one file, leaving out a file would silently give a different combination
+    if any(
+        len(obj["body"]) != len(reference["body"])
+        or any(isinstance(a, str) != isinstance(b, str) for a, b in zip(obj["body"], reference["body"]))
+        for obj in objects
+    ):
+        critical(f"Layout of YODA object '{path}' differs between the combined files")
+        sys.exit(1)
+    body = []
+    for i, entry in enumerate(reference["body"]):
+        if isinstance(entry, str):
+            body.append(entry)
+        else:
+            tables = [obj["body"][i] for obj in objects]
+            if any(table["columns"] != entry["columns"] or len(table["rows"]) != len(entry["rows"]) for table in tables):
+                critical(f"Binning of YODA object '{path}' differs between the combined files")
+                sys.exit(1)
+            body.append(combine_tables(tables, coefficients))
+    return {"begin": reference["begin"], "path": path, "body": body, "end": reference["end"]}
+
+
+def combine(yoda_files, coefficients):
+    combined = {}
+    for path in dict.fromkeys(path for yoda in yoda_files for path in yoda.keys()):
+        missing = [i for i, yoda in enumerate(yoda_files) if path not in yoda]
+        if len(missing) > 0:
+            critical(
+                f"YODA object '{path}' is missing in {len(missing)} of the {len(yoda_files)} combined files "
+                f"(files {', '.join(str(i) for i in missing)})"
+            )
+            sys.exit(1)
+        combined[path] = combine_object(path, [yoda[path] for yoda in yoda_files], coefficients)
+    return combined
+
+
+def weight_suffix(path):
+    match = re.search(r"\[[^\]]*\]$", path)
+    return match.group(0) if match else ""
+
+
+def first_row(obj):
+    for entry in obj["body"]:
+        if not isinstance(entry, str) and len(entry["rows"]) > 0:
+            return entry
+    return None
+
+
+def run_statistics(objects):
+    statistics = {}
+    for path, obj in objects.items():
+        base = path[: len(path) - len(weight_suffix(path))]
+        if base not in ("/_XSEC", "/_EVTCOUNT"):
+            continue
+        table = first_row(obj)
+        if table is None:
+            continue
+        entry = statistics.setdefault(weight_suffix(path), {"xsec": 1.0, "xsec_error": 0.0, "sumw": 1.0})
+        row = [float(value) for value in table["rows"][0]]
+        if base == "/_XSEC":
+            entry["xsec"] = row[table["roles"].index("linear")]
+            errors = [abs(value) for value, role in zip(row, table["roles"]) if role == "error"]
+            entry["xsec_error"] = max(errors, default=0.0)
+        else:
+            names = [column.lower() for column in table["columns"]]
+            entry["sumw"] = row[names.index("sumw")] if "sumw" in names else row[0]
+    return statistics
+
+
+def set_cross_section(obj, xsec, error):
+    table = first_row(obj)
+    row = table["rows"][0]
+    for i, role in enumerate(table["roles"]):
+        if role == "linear":
+            row[i] = format_value(xsec, role)
+        elif role == "error":
+            row[i] = format_value(math.copysign(error, float(row[i])), role)
+
+
+def merge(runs, equivalent=True):
+    if len(runs) == 1:
+        return runs[0]
+    statistics = [run_statistics(run) for run in runs]
+    default = {"xsec": 1.0, "xsec_error": 0.0, "sumw": 1.0}
+    merged = {}
+    for path in runs[0].keys():
+        suffix = weight_suffix(path)
+        base = path[: len(path) - len(suffix)]
+        members = [(run[path], stats.get(suffix, default)) for run, stats in zip(runs, statistics) if path in run]
+        objects = [obj for obj, _ in members]
+        stats = [entry for _, entry in members]
+        sumw = sum(entry["sumw"] for entry in stats)
+        if equivalent:
+            xsec = sum(entry["xsec"] * entry["sumw"] for entry in stats) / sumw
+            xsec_error = math.sqrt(sum((entry["xsec_error"] * entry["sumw"]) ** 2 for entry in stats)) / sumw
+        else:
+            xsec = sum(entry["xsec"] for entry in stats)
+            xsec_error = math.sqrt(sum(entry["xsec_error"] ** 2 for entry in stats))
+        if base == "/_XSEC":
+            merged[path] = combine_object(path, objects[:1], [1.0])
+            set_cross_section(merged[path], xsec, xsec_error)
+        elif not equivalent or base.startswith("/RAW/") or base.startswith("/_"):
+            merged[path] = combine_object(path, objects, [1.0] * len(objects))
+        else:
+            merged[path] = combine_object(
+                path, objects, [(xsec / sumw) / (entry["xsec"] / entry["sumw"]) for entry in stats]
+            )
+    return merged
+
+
+def merge_files(paths, equivalent=True):
+    return merge([read_yoda(path) for path in paths], equivalent)